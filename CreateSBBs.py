@@ -2,7 +2,7 @@
 # CreateSBBs.py
 # Version:  ArcGIS 10.3.1 / Python 2.7.8
 # Creation Date: 2016-01-29
-# Last Edit: 2018-03-09
+# Last Edit: 2026-10-19
 # Creator:  Kirsten R. Hazler
 #
 # Summary:
@@ -115,7 +115,7 @@ def CreateNoBuffSBB(in_PF, out_SBB):
       printWrng('Unable to process the no-buffer features.')
       tback()
 
-def CreateWetlandSBB(in_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace = "in_memory", scratchGDB = "in_memory"):
+def CreateWetlandSBB(in_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace = "in_memory", scratchGDB = "in_memory", buffMethod = "GEODESIC", arcSegs = None, buffTol = 0.001):
    '''Creates standard wetland SBBs from Rule 5, 6, 7, or 9 Procedural Features (PFs). The procedures are the same for all rules, the only difference being the rule-specific inputs.
    
 #     Carries out the following general procedures:
@@ -125,7 +125,9 @@ def CreateWetlandSBB(in_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace = "i
 #     4.  Select clipped NWI features within 15-m of the PF.
 #     5.  Buffer the selected NWI feature(s), if applicable, by 100-m.
 #     6.  Merge the minimum buffer with the buffered NWI feature(s).
-#     7.  Clip the merged feature to the maximum buffer.'''
+#     7.  Clip the merged feature to the maximum buffer.
+   
+   The buffMethod, arcSegs and buffTol parameters are passed to ShrinkWrap (see Helper.Coalesce).'''
 
    # Process: Select PFs
    sub_PF = tmpWorkspace + os.sep + 'sub_PF'
@@ -148,9 +150,12 @@ def CreateWetlandSBB(in_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace = "i
       # Create an empty list to store IDs of features that fail to get processed
       myFailList = []
 
-      # Loop through the individual Procedural Features
+      # Get the PF attributes to carry over to the output SBBs
+      pfFlds = attributeFields(sub_PF)
+
+      # Loop through the individual Procedural Features, writing SBBs with a bulk writer (closed however the loop ends)
       myIndex = 1 # Set a counter index
-      with arcpy.da.SearchCursor(sub_PF, [fld_SFID, "SHAPE@"]) as myProcFeats:
+      with BulkWriter(out_SBB) as sbbWriter, arcpy.da.SearchCursor(sub_PF, [fld_SFID, "SHAPE@"] + pfFlds) as myProcFeats:
          for myPF in myProcFeats:
          # for each Procedural Feature in the set, do the following...
             try: # Even if one feature fails, script can proceed to next feature
@@ -179,7 +184,7 @@ def CreateWetlandSBB(in_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace = "i
                printMsg("Clipping NWI features to maximum buffer and shrinkwrapping...")
                arcpy.Clip_analysis(in_NWI, "myMaxBuffer", "tmpClipNWI")
                shrinkNWI = scratchGDB + os.sep + "shrinkNWI"
-               ShrinkWrap("tmpClipNWI", newMeas, shrinkNWI)
+               ShrinkWrap("tmpClipNWI", newMeas, shrinkNWI, buffMethod = buffMethod, arcSegs = arcSegs, buffTol = buffTol)
 
                # Step 4: Select shrinkwrapped NWI features within range
                printMsg("Selecting nearby NWI features")
@@ -216,16 +221,9 @@ def CreateWetlandSBB(in_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace = "i
                   printMsg("No NWI features found within specified search distance")
                   myFinalShape = arcpy.SearchCursor("myMinBuffer").next().Shape
 
-               # Update the PF shape
-               myCurrentPF_rows = arcpy.UpdateCursor("tmpPF", "", "", "Shape", "")
-               myPF_row = myCurrentPF_rows.next()
-               myPF_row.Shape = myFinalShape
-               myCurrentPF_rows.updateRow(myPF_row)
-
-               # Process:  Append
-               # Append the final geometry to the SBB feature class.
+               # Append the final geometry, with the PF attributes, to the SBB feature class.
                printMsg("Appending final shape to SBB feature class...")
-               arcpy.Append_management("tmpPF", out_SBB, "NO_TEST", "", "")
+               sbbWriter.add(myFinalShape, dict(zip(pfFlds, myPF[2:])))
 
                # Add final progress message
                printMsg("Finished processing feature " + str(myIndex))
@@ -264,13 +262,14 @@ def CreateWetlandSBB(in_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace = "i
    else:
       printMsg('There are no PFs with this rule; passing...')
       
-def CreateSBBs(in_PF, fld_SFID, fld_Rule, fld_Buff, in_nwi5, in_nwi67, in_nwi9, out_SBB, scratchGDB = "in_memory"):
+def CreateSBBs(in_PF, fld_SFID, fld_Rule, fld_Buff, in_nwi5, in_nwi67, in_nwi9, out_SBB, scratchGDB = "in_memory", buffMethod = "GEODESIC", arcSegs = None, buffTol = 0.001):
    '''Creates SBBs for all input PFs, subsetting and applying rules as needed.
    Usage Notes:  
    - This function does not test to determine if all of the input Procedural Features should be subject to a particular rule. The user must ensure that this is so.
    - It is recommended that the NWI feature class be stored on your local drive rather than a network drive, to optimize processing speed.
    - For the CreateWetlandSBBs function to work properly, the input NWI data must contain a subset of only those features applicable to the particular rule.  Adjacent NWI features should have boundaries dissolved.
-   - For best results, it is recommended that you close all other programs before running this tool, since it relies on having ample memory for processing.'''
+   - For best results, it is recommended that you close all other programs before running this tool, since it relies on having ample memory for processing.
+   - The buffMethod, arcSegs and buffTol parameters control the buffers used to shrinkwrap NWI features for wetland SBBs (see Helper.Coalesce).'''
 
    tStart = datetime.now()
    
@@ -315,7 +314,7 @@ def CreateSBBs(in_PF, fld_SFID, fld_Rule, fld_Buff, in_nwi5, in_nwi67, in_nwi9,
    selQry = "intRule = 5"
    in_NWI = in_nwi5
    try:
-      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory")
+      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory", buffMethod, arcSegs, buffTol)
       warnings(5)
    except:
       printWrng('Unable to process Rule 5 features')
@@ -326,7 +325,7 @@ def CreateSBBs(in_PF, fld_SFID, fld_Rule, fld_Buff, in_nwi5, in_nwi67, in_nwi9,
    selQry = "intRule = 6"
    in_NWI = in_nwi67
    try:
-      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory")
+      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory", buffMethod, arcSegs, buffTol)
       warnings(6)
    except:
       printWrng('Unable to process Rule 6 features')
@@ -337,7 +336,7 @@ def CreateSBBs(in_PF, fld_SFID, fld_Rule, fld_Buff, in_nwi5, in_nwi67, in_nwi9,
    selQry = "intRule = 7"
    in_NWI = in_nwi67
    try:
-      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory")
+      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory", buffMethod, arcSegs, buffTol)
       warnings(7)
    except:
       printWrng('Unable to process Rule 7 features')
@@ -348,7 +347,7 @@ def CreateSBBs(in_PF, fld_SFID, fld_Rule, fld_Buff, in_nwi5, in_nwi67, in_nwi9,
    selQry = "intRule = 9"
    in_NWI = in_nwi9
    try:
-      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory")
+      CreateWetlandSBB(tmp_PF, fld_SFID, selQry, in_NWI, out_SBB, tmpWorkspace, "in_memory", buffMethod, arcSegs, buffTol)
       warnings(9)
    except:
       printWrng('Unable to process Rule 9 features')
@@ -2,7 +2,7 @@
 # CreateSCU.py
 # Version:  ArcGIS 10.3.1 / Python 2.7.8
 # Creation Date: 2018-11-05
-# Last Edit: 2018-12-06
+# Last Edit: 2026-10-19
 # Creator(s):  Kirsten R. Hazler
 
 # Summary:
@@ -14,7 +14,9 @@
 # Dependencies:
 # This set of functions will not work if the hydro network is not set up properly! The network geodatabase VA_HydroNet.gdb has been set up manually, not programmatically.
 
-# The Network Analyst extension is required for some functions, which will fail if the license is unavailable.
+# The Network Analyst extension is required for some functions, which will fail if the license is unavailable. As an alternative, CreateLinesNative_scu uses a native network tracer (libNetworkFx.py) built directly from NHDFlowline, which needs neither the license nor the network dataset.
+
+# Likewise, CreateFlowBuffersNative_scu uses a native flow-length engine (libRasterFx.py) in place of the Spatial Analyst tools used by CreateFlowBuffers_scu. Catchments can also be taken from a precomputed upstream index of the flow direction raster (BuildFlowIndex_scu), which is built once and reused.
 
 # Note that the restrictions (contained in "r" variable below) for traversing the network must have been defined in the HydroNet itself (manually). If any additional restrictions are added, the HydroNet must be rebuilt or they will not take effect. I originally set a restriction of NoEphemeralOrIntermittent, but on testing I discovered that this eliminated some stream segments that actually contained EOs. I set the restriction to NoEphemeral instead. We may find that we need to remove the NoEphemeral restriction as well, or that users will need to edit attributes of the NHDFlowline segments on a case-by-case basis.
 
@@ -26,6 +28,8 @@
 import Helper
 from Helper import *
 from arcpy.sa import *
+import libNetworkFx
+import libRasterFx
 
 def MakeServiceLayers_scu(in_hydroNet):
    '''Creates two Network Analyst service layers needed for SCU delineation. This tool only needs to be run the first time you run the suite of SCU delineation tools. After that, the output layers can be reused repeatedly for the subsequent tools in the SCU delineation sequence.
@@ -101,6 +105,135 @@ def MakeServiceLayers_scu(in_hydroNet):
    
    return (lyrDownTrace, lyrUpTrace)
 
+def sfidWhere_scu(in_PF, fld_SFID, idList):
+   '''Returns a where clause selecting PFs with the specified Source Feature IDs'''
+   fld = arcpy.AddFieldDelimiters(in_PF, fld_SFID)
+   vals = ",".join(["'%s'" % str(id).replace("'", "''") for id in sorted(idList)])
+   return "%s IN (%s)" % (fld, vals)
+
+def writeMatchedPts_scu(ptWriter, inPts, fld_SFID):
+   '''Writes points to a BulkWriter, with attributes matched by name. If the points carry two sets of PF attributes (the second with the suffix "_1", as output by Intersect), only points where the two SFIDs match are written. Returns the set of SFIDs written.'''
+   flds = attributeFields(inPts)
+   fld2 = fld_SFID + "_1"
+   check = fld2 in flds
+   idSet = set()
+   with arcpy.da.SearchCursor(inPts, ["SHAPE@"] + flds) as cursor:
+      for row in cursor:
+         attrs = dict(zip(flds, row[1:]))
+         if check and attrs[fld_SFID] != attrs[fld2]:
+            continue
+         ptWriter.add(row[0], attrs)
+         idSet.add(attrs[fld_SFID])
+   return idSet
+
+def lineSegments_scu(inLines):
+   '''Reads line features and returns a dictionary of {OID: array of segments}, where each row of the array holds the coordinates (x0, y0, x1, y1) of one segment. Segments do not span parts.'''
+   segDict = dict()
+   with arcpy.da.SearchCursor(inLines, ["OID@", "SHAPE@"]) as cursor:
+      for oid, geom in cursor:
+         segs = []
+         if geom is not None:
+            for part in geom:
+               pts = [(pt.X, pt.Y) for pt in part if pt]
+               segs.extend([pts[i] + pts[i + 1] for i in range(len(pts) - 1)])
+               if len(pts) == 1:
+                  segs.append(pts[0] + pts[0])
+         segDict[oid] = numpy.array(segs, dtype = numpy.float64).reshape(-1, 4)
+   return segDict
+
+def segDistance_scu(a, b):
+   '''Returns the distances between segments a[i] and b[i], given as arrays of (x0, y0, x1, y1) rows. The distance is zero where segments cross, touch or overlap.'''
+   def ptSeg(px, py, s):
+      dx = s[:,2] - s[:,0]
+      dy = s[:,3] - s[:,1]
+      len2 = dx*dx + dy*dy
+      t = ((px - s[:,0])*dx + (py - s[:,1])*dy)/numpy.where(len2 > 0, len2, 1.0)
+      t = numpy.clip(t, 0.0, 1.0)
+      return numpy.hypot(px - (s[:,0] + t*dx), py - (s[:,1] + t*dy))
+   def orient(s, px, py):
+      return numpy.sign((s[:,2] - s[:,0])*(py - s[:,1]) - (s[:,3] - s[:,1])*(px - s[:,0]))
+   dist = numpy.minimum(numpy.minimum(ptSeg(a[:,0], a[:,1], b), ptSeg(a[:,2], a[:,3], b)), numpy.minimum(ptSeg(b[:,0], b[:,1], a), ptSeg(b[:,2], b[:,3], a)))
+   cross = (orient(a, b[:,0], b[:,1])*orient(a, b[:,2], b[:,3]) < 0) & (orient(b, a[:,0], a[:,1])*orient(b, a[:,2], a[:,3]) < 0)
+   dist[cross] = 0.0
+   return dist
+
+def touchingPairs_scu(segsA, segsB = None, tol = 0.001):
+   '''Finds pairs of lines within the tolerance of each other, whether they share a vertex, an endpoint of one lies along a segment of the other, they overlap collinearly, or they cross. segsA and segsB are dictionaries from lineSegments_scu; if segsB is None, pairs of distinct lines within segsA are found. Only segments sharing a cell of a grid index are compared. Returns a set of (OID in segsA, OID in segsB) tuples.'''
+   sets = [segsA] if segsB is None else [segsA, segsB]
+   segList = []
+   setList = []
+   oidList = []
+   for (k, segDict) in enumerate(sets):
+      for oid, segs in segDict.items():
+         segList.append(segs)
+         setList.append(numpy.repeat(k, len(segs)))
+         oidList.append(numpy.repeat(oid, len(segs)))
+   pairs = set()
+   if not segList:
+      return pairs
+   segs = numpy.concatenate(segList)
+   setIDs = numpy.concatenate(setList)
+   oids = numpy.concatenate(oidList)
+   if len(segs) == 0:
+      return pairs
+   
+   # Grid index: each segment is registered in every cell its extent (expanded by the tolerance) covers
+   lengths = numpy.hypot(segs[:,2] - segs[:,0], segs[:,3] - segs[:,1])
+   cellSize = max(10*tol, 2*numpy.median(lengths))
+   x0 = numpy.floor((numpy.minimum(segs[:,0], segs[:,2]) - tol)/cellSize).astype(numpy.int64)
+   x1 = numpy.floor((numpy.maximum(segs[:,0], segs[:,2]) + tol)/cellSize).astype(numpy.int64)
+   y0 = numpy.floor((numpy.minimum(segs[:,1], segs[:,3]) - tol)/cellSize).astype(numpy.int64)
+   y1 = numpy.floor((numpy.maximum(segs[:,1], segs[:,3]) + tol)/cellSize).astype(numpy.int64)
+   cells = dict()
+   for i in xrange(len(segs)):
+      for cx in xrange(x0[i], x1[i] + 1):
+         for cy in xrange(y0[i], y1[i] + 1):
+            cells.setdefault((cx, cy), []).append(i)
+   
+   # Compare segments of different lines (or of different sets) within each cell
+   for idx in cells.values():
+      if len(idx) < 2:
+         continue
+      idx = numpy.array(idx)
+      (i, j) = numpy.triu_indices(len(idx), 1)
+      (i, j) = (idx[i], idx[j])
+      if segsB is None:
+         keep = oids[i] != oids[j]
+      else:
+         keep = setIDs[i] != setIDs[j]
+      (i, j) = (i[keep], j[keep])
+      if len(i) == 0:
+         continue
+      hit = segDistance_scu(segs[i], segs[j]) <= tol
+      for (p, q) in zip(i[hit], j[hit]):
+         if setIDs[p] > setIDs[q]:
+            (p, q) = (q, p)
+         pairs.add((int(oids[p]), int(oids[q])))
+   return pairs
+
+def touchingLines_scu(segsA, segsB, tol = 0.001):
+   '''Returns a dictionary of {OID: set of touching OIDs}, relating each line in segsA to the lines in segsB within the tolerance (see touchingPairs_scu)'''
+   nbrDict = dict((oid, set()) for oid in segsA)
+   for (a, b) in touchingPairs_scu(segsA, segsB, tol):
+      nbrDict[a].add(b)
+   return nbrDict
+
+def groupLines_scu(segDict, tol = 0.001):
+   '''Groups connected lines by union-find over pairs of lines within the tolerance of each other (see touchingPairs_scu). Returns a dictionary of {OID: group ID}, where the group ID is the lowest OID in the group.'''
+   parent = dict((oid, oid) for oid in segDict)
+   def find(oid):
+      root = oid
+      while parent[root] != root:
+         root = parent[root]
+      while parent[oid] != root:
+         parent[oid], oid = root, parent[oid]
+      return root
+   for (oid, nbr) in touchingPairs_scu(segDict, None, tol):
+      a, b = find(oid), find(nbr)
+      if a != b:
+         parent[max(a, b)] = min(a, b)
+   return dict((oid, find(oid)) for oid in segDict)
+
 def MakeNetworkPts_scu(in_hydroNet, in_PF, out_Points, fld_SFID = "SFID", out_Scratch = arcpy.env.scratchGDB):
    '''Given a set of procedural features, creates points along the hydrological network. The user must ensure that the procedural features are "SCU-worthy."
    Parameters:
@@ -122,12 +255,12 @@ def MakeNetworkPts_scu(in_hydroNet, in_PF, out_Points, fld_SFID = "SFID", out_Sc
    nhdFlowline = catPath + os.sep + "NHDFlowline"
    pfCirc = out_Scratch + os.sep + 'pfCirc'
    
-   # Variables used in-loop
+   # Variables for batch outputs
    pfBuff = out_Scratch + os.sep + 'pfBuff'
-   slopBuff = out_Scratch + os.sep + 'clpBuff'
+   slopBuff = out_Scratch + os.sep + 'slopBuff'
+   slopClp = out_Scratch + os.sep + 'clpBuff'
    tmpPts = out_Scratch + os.sep + 'tmpPts'
    tmpPts2 = out_Scratch + os.sep + 'tmpPts2'
-   attrib_Points = out_Scratch + os.sep + 'attrib_Points'
    clpArea = out_Scratch + os.sep + 'clpArea'
    clpLine = out_Scratch + os.sep + 'clpLine'
    # LineInArea = out_Scratch + os.sep + 'LineInArea'
@@ -151,63 +284,61 @@ def MakeNetworkPts_scu(in_hydroNet, in_PF, out_Points, fld_SFID = "SFID", out_Sc
    arcpy.CreateFeatureclass_management (outDir, outName, "POINT", in_PF, '', '', sr)
    
    # This whole procedure is clunky but I think necessary b/c of spatial discrepancies between PFs and NHD features
+   # All PFs are processed together in each step. Where two inputs both carry PF attributes, only output records where the SFIDs match (i.e., from the same PF) are kept.
    printMsg('Generating points on network...')
-   with  arcpy.da.SearchCursor(in_PF, [fld_SFID]) as myPFs:
-      for PF in myPFs:
-         id = PF[0]
-         printMsg('Working on SFID %s...' %id)
-         
-         # Create fresh feature class for storage
-         if arcpy.Exists(attrib_Points):
-            arcpy.Delete_management(attrib_Points)
-         arcpy.CreateFeatureclass_management (out_Scratch, 'attrib_Points', "POINT", in_PF, '', '', sr)
-         
-         # Make feature layers
-         qry = "%s = '%s'" % (fld_SFID, id)
-         arcpy.MakeFeatureLayer_management (pfCirc,  "tmpCirc", qry)
-         arcpy.MakeFeatureLayer_management (in_PF,  "tmpPF", qry)
-         
-         # Clip nhd layers
-         CleanClip("StreamRiver_Line", "tmpCirc", clpLine)
-         CleanClip("StreamRiver_Poly", "tmpCirc", clpArea)
-
-         # Generate points on bounding circle; this ensures the length of the PF along the FlowLine network is captured, for all but perfect circular features
-         ### First buffer PF by small amount to avoid some weird results for some features
-         arcpy.Buffer_analysis("tmpPF", pfBuff, "1 Meters", "", "", "NONE")
-         arcpy.Intersect_analysis ([pfBuff, "tmpCirc"], tmpPts, "", "", "POINT")
-         c = countFeatures(tmpPts) # Check for empty output
-         if c == 0: # Empty output if PF is a perfect circle; alternatives needed
-            ### Make centroid
-            arcpy.FeatureToPoint_management ("tmpPF", tmpPts, "CENTROID")
-            arcpy.Append_management (tmpPts, attrib_Points, "NO_TEST")
-            ### Make additional points for large circles
-            arcpy.Intersect_analysis(["tmpPF", clpArea], tmpPts, "", "", "POINT")
-            c = countFeatures(tmpPts) # Check for empty output
-            if c > 0: 
-               arcpy.MultipartToSinglepart_management (tmpPts, tmpPts2)
-               arcpy.Append_management (tmpPts2, attrib_Points, "NO_TEST")
-         else: # Finish processing normal generated points
+   allIDs = set(unique_values(in_PF, fld_SFID))
+   # The writer is closed (releasing its cursor) however the point generation ends
+   with BulkWriter(out_Points) as ptWriter:
+      # Clip nhd layers to the bounding circles
+      CleanClip("StreamRiver_Line", pfCirc, clpLine)
+      CleanClip("StreamRiver_Poly", pfCirc, clpArea)
+
+      # Generate points on bounding circle; this ensures the length of the PF along the FlowLine network is captured, for all but perfect circular features
+      ### First buffer PF by small amount to avoid some weird results for some features
+      printMsg('Getting intersections of PFs with bounding circles...')
+      arcpy.Buffer_analysis(in_PF, pfBuff, "1 Meters", "", "", "NONE")
+      arcpy.Intersect_analysis ([pfBuff, pfCirc], tmpPts, "", "", "POINT")
+      arcpy.MultipartToSinglepart_management (tmpPts, tmpPts2)
+      circIDs = writeMatchedPts_scu(ptWriter, tmpPts2, fld_SFID)
+   
+      # Empty output if PF is a perfect circle; alternatives needed
+      noCircIDs = allIDs - circIDs
+      if len(noCircIDs) > 0:
+         printMsg('Generating alternative points for %s circular PFs...' % len(noCircIDs))
+         arcpy.MakeFeatureLayer_management (in_PF, "circPF", sfidWhere_scu(in_PF, fld_SFID, noCircIDs))
+         ### Make centroids
+         arcpy.FeatureToPoint_management ("circPF", tmpPts, "CENTROID")
+         writeMatchedPts_scu(ptWriter, tmpPts, fld_SFID)
+         ### Make additional points for large circles
+         arcpy.Intersect_analysis(["circPF", clpArea], tmpPts, "", "", "POINT")
+         if countFeatures(tmpPts) > 0:
             arcpy.MultipartToSinglepart_management (tmpPts, tmpPts2)
-            arcpy.Append_management (tmpPts2, attrib_Points, "NO_TEST")
-         
-         # Get junctions with tributaries
-         arcpy.Intersect_analysis([clpLine, "tmpPF"], tmpPts, "", "", "POINT")
-         c = countFeatures(tmpPts) # Check for empty output
-         if c > 0: # Trib junctions present within PF
+            writeMatchedPts_scu(ptWriter, tmpPts2, fld_SFID)
+   
+      # Get junctions with tributaries
+      printMsg('Getting tributary junctions...')
+      arcpy.Intersect_analysis([clpLine, in_PF], tmpPts, "", "", "POINT")
+      junctIDs = set()
+      if countFeatures(tmpPts) > 0:
+         arcpy.MultipartToSinglepart_management (tmpPts, tmpPts2)
+         junctIDs = writeMatchedPts_scu(ptWriter, tmpPts2, fld_SFID)
+   
+      ### Try using a "slop" buffer to account for discrepancies between PF and NHD, only for PFs without junctions
+      noJunctIDs = allIDs - junctIDs
+      if len(noJunctIDs) > 0:
+         printMsg('Using slop buffers for %s PFs without tributary junctions...' % len(noJunctIDs))
+         arcpy.MakeFeatureLayer_management (in_PF, "slopPF", sfidWhere_scu(in_PF, fld_SFID, noJunctIDs))
+         arcpy.Buffer_analysis("slopPF", slopBuff, "30 Meters", "", "", "NONE")
+         # Clip each slop buffer to its own bounding circle
+         arcpy.Intersect_analysis([slopBuff, pfCirc], slopClp)
+         arcpy.MakeFeatureLayer_management (slopClp, "slopClp", '"%s" = "%s_1"' % (fld_SFID, fld_SFID))
+         arcpy.Intersect_analysis([clpLine, "slopClp"], tmpPts, "", "", "POINT")
+         if countFeatures(tmpPts) > 0:
             arcpy.MultipartToSinglepart_management (tmpPts, tmpPts2)
-            arcpy.Append_management (tmpPts2, attrib_Points, "NO_TEST")
-         else:
-         ### Try using a "slop" buffer to account for discrepancies between PF and NHD
-            arcpy.Buffer_analysis("tmpPF", pfBuff, "30 Meters", "", "", "NONE")
-            CleanClip(pfBuff, "tmpCirc", slopBuff)
-            arcpy.Intersect_analysis([clpLine, slopBuff], tmpPts, "", "", "POINT")
-            c = countFeatures(tmpPts) # Check for empty output
-            if c > 0: # Trib junctions present within slop buffer
-               arcpy.MultipartToSinglepart_management (tmpPts, tmpPts2)
-               arcpy.Append_management (tmpPts2, attrib_Points, "NO_TEST")
-
-         arcpy.CalculateField_management (attrib_Points, fld_SFID, "%s" %id, 'PYTHON_9.3')
-         arcpy.Append_management (attrib_Points, out_Points, "NO_TEST")
+            writeMatchedPts_scu(ptWriter, tmpPts2, fld_SFID)
+   
+   numPts = ptWriter.count
+   printMsg('Generated %s points for %s PFs.' % (numPts, len(allIDs)))
 
    if out_Scratch == "in_memory":
       # Clear out memory to avoid failures in subsequent functions
@@ -299,6 +430,29 @@ def CreateLines_scu(out_Lines, in_PF, in_Points, in_downTrace, in_upTrace, out_S
       printMsg('Saving updated %s service layer to %s...' %(inLyr,outLyr))      
       arcpy.SaveToLayerFile_management(inLyr, outLyr)
    
+   # Combine the upstream and downstream lines
+   nhdFlowline = catPath + os.sep + "NHDFlowline"
+   combineLines_scu(out_Lines, in_PF, downLines, upLines, nhdFlowline, out_Scratch)
+   
+   # timestamp
+   t1 = datetime.now()
+   ds = GetElapsedTime (t0, t1)
+   printMsg('Completed function. Time elapsed: %s' % ds)
+
+   arcpy.CheckInExtension("Network")
+   
+   return (out_Lines, lyrDownTrace, lyrUpTrace)
+   
+def combineLines_scu(out_Lines, in_PF, downLines, upLines, nhdFlowline, out_Scratch = arcpy.env.scratchGDB):
+   '''Combines upstream and downstream trace lines to create linear SCUs. Downstream segments beyond the first break (1609 meters) are retained only where they connect primary segments. Used by both CreateLines_scu and CreateLinesNative_scu.
+   Parameters:
+   - out_Lines = Output lines representing Stream Conservation Units
+   - in_PF = Input Procedural Features
+   - downLines = Downstream trace lines, with FacilityID and ToCumul_Length fields
+   - upLines = Upstream trace lines
+   - nhdFlowline = NHDFlowline feature class
+   - out_Scratch = Geodatabase to contain intermediate outputs'''
+   
    # Make feature layers for downstream lines
    qry = "ToCumul_Length <= 1609" 
    arcpy.MakeFeatureLayer_management (downLines, "downLTEbreak", qry)
@@ -320,33 +474,19 @@ def CreateLines_scu(out_Lines, in_PF, in_Points, in_downTrace, in_upTrace, out_S
    dissolvedLines = out_Scratch + os.sep + 'dissolvedLines'
    arcpy.Dissolve_management(erasedLines, dissolvedLines, "FacilityID", "", "SINGLE_PART", "DISSOLVE_LINES")
    
-   # From dissolved segments, select only those intersecting 2+ merged downstream/upstream segments
-   ### Conduct nearest neighbor analysis with zero distance (i.e. touching)
+   # From dissolved segments, select only those touching 2+ merged downstream/upstream segments
    printMsg('Analyzing adjacency of extension segments to primary segments...')
-   nearTab = out_Scratch + os.sep + 'nearTab'
-   arcpy.GenerateNearTable_analysis(dissolvedLines, mergedLines, nearTab, "0 Meters", "NO_LOCATION", "NO_ANGLE", "ALL", "2", "PLANAR")
+   ### Lines touch if they are within the XY tolerance, as with a near table at zero distance
+   sr = arcpy.Describe(mergedLines).spatialReference
+   xyTol = sr.XYTolerance or 0.001
+   nbrDict = touchingLines_scu(lineSegments_scu(dissolvedLines), lineSegments_scu(mergedLines), xyTol)
    
-   #### Find out if segment touches at least two neighbors
-   printMsg('Counting neighbors...')
-   countTab = out_Scratch + os.sep + 'countTab'
-   arcpy.Statistics_analysis(nearTab, countTab, "NEAR_FID COUNT", "IN_FID")
-   qry = "FREQUENCY = 2"
-   arcpy.MakeTableView_management(countTab, "connectorTab", qry)
-   
-   ### Get list of segments meeting the criteria, cast as a query and make feature layer
    printMsg('Extracting extension segments with at least two primary neighbors...')
-   valList = unique_values("connectorTab", "IN_FID")
-   if len(valList) > 0:
-      qryList = str(valList)
-      qryList = qryList.replace('[', '(')
-      qryList = qryList.replace(']', ')')
-      qry = "OBJECTID in %s" % qryList
-   else:
-      qry = "OBJECTID = -1"
+   valList = [oid for oid, nbrs in nbrDict.items() if len(nbrs) >= 2]
+   qry = oidWhere(dissolvedLines, valList)
    arcpy.MakeFeatureLayer_management (dissolvedLines, "extendLines", qry)
    
    # Grab additional segments that may have been missed within large PFs in wide water areas
-   nhdFlowline = catPath + os.sep + "NHDFlowline"
    clpLine = out_Scratch + os.sep + 'clpLine'
    qry = "FType in (460, 558)" # StreamRiver and ArtificialPath only
    arcpy.MakeFeatureLayer_management (nhdFlowline, "StreamRiver_Line", qry)
@@ -357,41 +497,243 @@ def CreateLines_scu(out_Lines, in_PF, in_Points, in_downTrace, in_upTrace, out_S
    comboLines = out_Scratch + os.sep + 'comboLines'
    arcpy.Merge_management (["extendLines", mergedLines, clpLine], comboLines)
    
-   printMsg('Buffering segments...')
-   buffLines = out_Scratch + os.sep + 'buffLines'
-   arcpy.Buffer_analysis(comboLines, buffLines, "1 Meters", "FULL", "ROUND", "ALL") 
+   printMsg('Grouping segments...')
+   ### Lines are grouped if they are within 2 meters, i.e. where 1-meter buffers around them would merge
+   grpDict = groupLines_scu(lineSegments_scu(comboLines), linearDistance("2 METERS", sr))
+   arcpy.AddField_management(comboLines, "grpID", "LONG")
+   with arcpy.da.UpdateCursor(comboLines, ["OID@", "grpID"]) as cursor:
+      for row in cursor:
+         row[1] = grpDict[row[0]]
+         cursor.updateRow(row)
    
-   printMsg('Exploding buffers...')
-   explBuff = outDir + os.sep + 'explBuff'
-   arcpy.MultipartToSinglepart_management(buffLines, explBuff)
+   printMsg('Dissolving segments by group...')
+   arcpy.Dissolve_management(comboLines, out_Lines, "grpID", "", "MULTI_PART", "DISSOLVE_LINES")
    
-   printMsg('Grouping segments...')
-   arcpy.AddField_management(explBuff, "grpID", "LONG")
-   arcpy.CalculateField_management(explBuff, "grpID", "!OBJECTID!", "PYTHON")
+   return out_Lines
+
+def BuildHydroGraph_scu(nhdFlowline, out_GraphDir = None):
+   '''Compiles NHDFlowline (with DamWeir barriers from NHDLine) into a network graph saved on disk, for use by CreateLinesNative_scu. This only needs to be run when the NHD changes; the saved graph is memory-mapped by subsequent tools, and is rebuilt automatically if it is out of date with the NHD.
+   Parameters:
+   - nhdFlowline = NHDFlowline feature class; NHDLine is expected in the same location
+   - out_GraphDir = Folder to store the graph. If None, a "HydroGraph" folder alongside the NHD geodatabase is used.'''
    
-   joinLines = out_Scratch + os.sep + 'joinLines'
-   fldMap = 'grpID "grpID" true true false 4 Long 0 0, First, #, %s, grpID, -1, -1' % explBuff
-   arcpy.SpatialJoin_analysis(comboLines, explBuff, joinLines, "JOIN_ONE_TO_ONE", "KEEP_ALL", fldMap, "INTERSECT")
+   # timestamp
+   t0 = datetime.now()
    
-   printMsg('Dissolving segments by group...')
-   arcpy.Dissolve_management(joinLines, out_Lines, "grpID", "", "MULTI_PART", "DISSOLVE_LINES")
+   if out_GraphDir is None:
+      out_GraphDir = libNetworkFx.defaultGraphDir(nhdFlowline)
+   stamp = libNetworkFx.sourceStamp(nhdFlowline)
+   graph = libNetworkFx.GraphFromNHD(nhdFlowline)
+   libNetworkFx.SaveGraph(graph, out_GraphDir, stamp)
    
    # timestamp
    t1 = datetime.now()
    ds = GetElapsedTime (t0, t1)
    printMsg('Completed function. Time elapsed: %s' % ds)
+   
+   return out_GraphDir
 
-   arcpy.CheckInExtension("Network")
+def CreateLinesNative_scu(out_Lines, in_PF, in_Points, nhdFlowline, out_Scratch = arcpy.env.scratchGDB, in_GraphDir = None):
+   '''Traces the network upstream and downstream from SCU points, and combines network segments to create linear SCUs. This is equivalent to CreateLines_scu, but uses a native network tracer (see libNetworkFx.py) built from NHDFlowline instead of Network Analyst service layers. The same restrictions and trace distances are applied, and DamWeir features in NHDLine serve as barriers.
+   Parameters:
+   - out_Lines = Output lines representing Stream Conservation Units
+   - in_PF = Input Procedural Features
+   - in_Points = Input feature class containing points generated from procedural features
+   - nhdFlowline = NHDFlowline feature class; NHDLine is expected in the same location
+   - out_Scratch = Geodatabase to contain intermediate outputs
+   - in_GraphDir = Folder containing the network graph saved by BuildHydroGraph_scu. If None, the default location is used. The graph is built (and saved) first if it does not exist or is out of date.'''
    
-   return (out_Lines, lyrDownTrace, lyrUpTrace)
+   # timestamp
+   t0 = datetime.now()
+   
+   # Set up some variables
+   downLines = out_Scratch + os.sep + 'downLines'
+   upLines = out_Scratch + os.sep + 'upLines'
+   
+   # Load the network graph
+   printMsg('Loading network graph...')
+   graph = libNetworkFx.GetGraph(nhdFlowline, in_GraphDir)
+   
+   # Downstream trace with breaks at 1609 (1 mile) and 3218 (2 miles)
+   # Upstream trace with break at 3218 (2 miles)
+   libNetworkFx.TraceFacilities(graph, in_Points, downLines, "DOWN", 3218, [1609], 500)
+   libNetworkFx.TraceFacilities(graph, in_Points, upLines, "UP", 3218, None, 500)
+   
+   # Combine the upstream and downstream lines
+   combineLines_scu(out_Lines, in_PF, downLines, upLines, nhdFlowline, out_Scratch)
+   
+   # timestamp
+   t1 = datetime.now()
+   ds = GetElapsedTime (t0, t1)
+   printMsg('Completed function. Time elapsed: %s' % ds)
+   
+   return out_Lines
+   
+def fidField_scu(inTab, pos):
+   '''Returns the name of the "FID_" field output by Intersect_analysis for the input in the specified position'''
+   flds = [f.name for f in arcpy.ListFields(inTab) if f.name.upper().startswith("FID_")]
+   return flds[pos]
+
+def BuildRiverCells_scu(in_hydroNet, out_Cells, out_Scratch = arcpy.env.scratchGDB, cutDist = 10000):
+   '''Segments NHD StreamRiver polygons into reach-aligned cells, each keyed to the NHDFlowline segment it contains. Cells are bounded by lines perpendicular to the flowlines at segment nodes. This only needs to be run when the NHD changes; CreatePolys_scu can then build SCU polygons by combining the cells for the segments each SCU covers, rather than splitting the river polygons for every SCU.
+   Parameters:
+   - in_hydroNet = Input hydrological network dataset
+   - out_Cells = Output polygon feature class representing river cells, with the field SEG_ID holding the ObjectID of the NHDFlowline segment
+   - out_Scratch = Geodatabase to contain intermediate outputs
+   - cutDist = Distance (in map units) the perpendicular cut lines extend on either side of a node. These need to be really long to cut wide rivers near Chesapeake.
+   '''
+   
+   # timestamp
+   t0 = datetime.now()
+   
+   # Set up some variables:
+   descHydro = arcpy.Describe(in_hydroNet)
+   nwDataset = descHydro.catalogPath
+   catPath = os.path.dirname(nwDataset) # This is where hydro layers will be found
+   nhdArea = catPath + os.sep + "NHDArea"
+   nhdFlowline = catPath + os.sep + "NHDFlowline"
+   sr = arcpy.Describe(nhdFlowline).spatialReference
+   res = sr.XYResolution
+   if not res:
+      res = 0.0001
+   riverPoly = out_Scratch + os.sep + 'riverPoly'
+   cutLines = out_Scratch + os.sep + 'cutLines'
+   clipCuts = out_Scratch + os.sep + 'clipCuts'
+   cellPoly = out_Scratch + os.sep + 'cellPoly'
+   cellLines = out_Scratch + os.sep + 'cellLines'
+   
+   # Make some feature layers   
+   qry = "FType in (460, 558)" # StreamRiver and ArtificialPath only
+   arcpy.MakeFeatureLayer_management (nhdFlowline, "StreamRiver_Line", qry)
+   qry = "FType = 460" # StreamRiver only
+   arcpy.MakeFeatureLayer_management (nhdArea, "StreamRiver_Poly", qry)
    
-def CreatePolys_scu(in_Lines, in_hydroNet, out_Polys, out_Scratch = arcpy.env.scratchGDB):
+   # Fill any holes in polygons to avoid aberrant results
+   printMsg('Filling holes in river polygons...')
+   arcpy.EliminatePolygonPart_management ("StreamRiver_Poly", riverPoly, "PERCENT", "", 99, "CONTAINED_ONLY")
+   arcpy.SelectLayerByLocation_management("StreamRiver_Line", "INTERSECT", riverPoly)
+   
+   # Get segment nodes, with the flow direction at each node averaged over the segments meeting there
+   printMsg('Locating segment nodes...')
+   nodeDict = dict()
+   with arcpy.da.SearchCursor("StreamRiver_Line", ["SHAPE@"]) as cursor:
+      for row in cursor:
+         if row[0] is None:
+            continue
+         for part in row[0]:
+            pts = [pt for pt in part if pt]
+            if len(pts) < 2:
+               continue
+            for (a, b, node) in [(pts[0], pts[1], pts[0]), (pts[-2], pts[-1], pts[-1])]:
+               dx = b.X - a.X
+               dy = b.Y - a.Y
+               d = math.hypot(dx, dy)
+               if d == 0:
+                  continue
+               key = (int(round(node.X/res)), int(round(node.Y/res)))
+               rec = nodeDict.setdefault(key, [node.X, node.Y, 0.0, 0.0])
+               rec[2] += dx/d
+               rec[3] += dy/d
+   
+   # Generate lines perpendicular to the flow direction at nodes
+   printMsg('Creating perpendicular lines at %s nodes...' % str(len(nodeDict)))
+   if arcpy.Exists(cutLines):
+      arcpy.Delete_management(cutLines)
+   arcpy.CreateFeatureclass_management (out_Scratch, 'cutLines', "POLYLINE", '', '', '', sr)
+   arcpy.AddField_management(cutLines, "NODE_X", "DOUBLE")
+   arcpy.AddField_management(cutLines, "NODE_Y", "DOUBLE")
+   with BulkWriter(cutLines) as cutWriter:
+      for (x, y, tx, ty) in nodeDict.values():
+         t = math.hypot(tx, ty)
+         if t == 0:
+            continue
+         px = -ty/t*cutDist
+         py = tx/t*cutDist
+         arr = arcpy.Array([arcpy.Point(x - px, y - py), arcpy.Point(x + px, y + py)])
+         cutWriter.add(arcpy.Polyline(arr, sr), {"NODE_X": x, "NODE_Y": y})
+   
+   # Clip perpendicular lines to river polygons, keeping only the pieces passing through their node
+   printMsg('Clipping perpendicular lines to river polygons...')
+   CleanClip(cutLines, riverPoly, clipCuts)
+   with arcpy.da.UpdateCursor(clipCuts, ["SHAPE@", "NODE_X", "NODE_Y"]) as cursor:
+      for row in cursor:
+         node = arcpy.PointGeometry(arcpy.Point(row[1], row[2]), sr)
+         if row[0].distanceTo(node) > 1:
+            cursor.deleteRow()
+   
+   # Use perpendicular lines to split river polygons
+   printMsg('Splitting river polygons with perpendiculars...')
+   arcpy.FeatureToPolygon_management([clipCuts, riverPoly], cellPoly)
+   
+   # Key each cell to the flowline segment with the greatest length inside it
+   printMsg('Relating cells to flowline segments...')
+   arcpy.Intersect_analysis([cellPoly, "StreamRiver_Line"], cellLines, "ONLY_FID", "", "LINE")
+   fldCell = fidField_scu(cellLines, 0)
+   fldSeg = fidField_scu(cellLines, 1)
+   lenDict = dict()
+   with arcpy.da.SearchCursor(cellLines, [fldCell, fldSeg, "SHAPE@LENGTH"]) as cursor:
+      for (cell, seg, length) in cursor:
+         lenDict[(cell, seg)] = lenDict.get((cell, seg), 0) + length
+   segDict = dict()
+   for (cell, seg), length in lenDict.items():
+      if length > segDict.get(cell, (0, None))[0]:
+         segDict[cell] = (length, seg)
+   
+   # Write cells to output
+   printMsg('Writing river cells...')
+   (outDir, outName) = os.path.split(out_Cells)
+   if arcpy.Exists(out_Cells):
+      arcpy.Delete_management(out_Cells)
+   arcpy.CreateFeatureclass_management (outDir, outName, "POLYGON", '', '', '', sr)
+   arcpy.AddField_management(out_Cells, "SEG_ID", "LONG")
+   with BulkWriter(out_Cells) as cellWriter:
+      with arcpy.da.SearchCursor(cellPoly, ["OID@", "SHAPE@"]) as cursor:
+         for (oid, shp) in cursor:
+            if oid in segDict:
+               cellWriter.add(shp, {"SEG_ID": segDict[oid][1]})
+      numCells = cellWriter.count
+   if outDir != "in_memory":
+      arcpy.AddIndex_management(out_Cells, "SEG_ID", "SEG_ID_idx")
+   printMsg('%s river cells created.' % str(numCells))
+   
+   # timestamp
+   t1 = datetime.now()
+   ds = GetElapsedTime (t0, t1)
+   printMsg('Completed function. Time elapsed: %s' % ds)
+   
+   return out_Cells
+
+def coveredSegments_scu(in_Lines, in_Flowlines, out_Scratch = arcpy.env.scratchGDB, minCover = 0.5):
+   '''Returns the set of flowline ObjectIDs for which a single linear SCU covers at least the specified proportion of the segment length
+   Parameters:
+   - in_Lines = Input line feature class representing Stream Conservation Units
+   - in_Flowlines = Input NHDFlowline feature class or layer
+   - out_Scratch = Geodatabase to contain intermediate outputs
+   - minCover = Minimum proportion of a segment's length that must be covered
+   '''
+   scuSegs = out_Scratch + os.sep + 'scuSegs'
+   arcpy.Intersect_analysis([in_Lines, in_Flowlines], scuSegs, "ONLY_FID", "", "LINE")
+   fldLine = fidField_scu(scuSegs, 0)
+   fldSeg = fidField_scu(scuSegs, 1)
+   coverDict = dict()
+   with arcpy.da.SearchCursor(scuSegs, [fldLine, fldSeg, "SHAPE@LENGTH"]) as cursor:
+      for (line, seg, length) in cursor:
+         coverDict[(line, seg)] = coverDict.get((line, seg), 0) + length
+   segIDs = set([seg for (line, seg) in coverDict])
+   lenDict = dict()
+   with arcpy.da.SearchCursor(in_Flowlines, ["OID@", "SHAPE@LENGTH"], oidWhere(in_Flowlines, sorted(segIDs))) as cursor:
+      for (oid, length) in cursor:
+         lenDict[oid] = length
+   return set([seg for (line, seg), length in coverDict.items() if length >= minCover*lenDict.get(seg, 0)])
+
+def CreatePolys_scu(in_Lines, in_hydroNet, out_Polys, out_Scratch = arcpy.env.scratchGDB, in_Cells = None):
    '''Converts linear SCUs to polygons, including associated NHD StreamRiver polygons
    Parameters:
    - in_Lines = Input line feature class representing Stream Conservation Units
    - in_hydroNet = Input hydrological network dataset
    - out_Polys = Output polygon feature class representing Stream Conservation Units (without catchment area)
    - out_Scratch = Geodatabase to contain intermediate outputs
+   - in_Cells = Input river cells generated by BuildRiverCells_scu. If supplied, SCU polygons are built from the cells for the flowline segments covered by the SCUs (at least half of the segment length), instead of splitting river polygons for each SCU.
    '''
    
    # timestamp
@@ -418,6 +760,36 @@ def CreatePolys_scu(in_Lines, in_hydroNet, out_Polys, out_Scratch = arcpy.env.sc
    qry = "FType = 460" # StreamRiver only
    arcpy.MakeFeatureLayer_management (nhdArea, "StreamRiver_Poly", qry)
    
+   if in_Cells:
+      # Buffer linear SCUs by at least half of cell size in flow direction raster (5 m)
+      # This serves as the minimum polygon representing the SCUs (in the absence of any nhdArea features)
+      printMsg('Creating minimum buffer around linear SCUs...')
+      bufferLines = out_Scratch + os.sep + 'bufferLines'
+      arcpy.Buffer_analysis(in_Lines, bufferLines, "5 Meters", "", "ROUND", "NONE")
+      
+      # Select river cells for flowline segments covered by SCUs
+      printMsg('Selecting river cells for covered flowline segments...')
+      segIDs = coveredSegments_scu(in_Lines, "StreamRiver_Line", out_Scratch)
+      fld = arcpy.AddFieldDelimiters(in_Cells, "SEG_ID")
+      if len(segIDs) > 0:
+         qry = "%s IN (%s)" % (fld, ",".join([str(s) for s in sorted(segIDs)]))
+      else:
+         qry = "%s < 0" % fld
+      arcpy.MakeFeatureLayer_management (in_Cells, "scuCells", qry)
+      
+      # Merge/dissolve cells with baseline buffered scuLines
+      printMsg('Merging and dissolving shapes...')
+      mergePoly = out_Scratch + os.sep + 'mergePoly'
+      arcpy.Merge_management ([bufferLines, "scuCells"], mergePoly)
+      arcpy.Dissolve_management (mergePoly, out_Polys, "", "", "SINGLE_PART")
+      
+      # timestamp
+      t1 = datetime.now()
+      ds = GetElapsedTime (t0, t1)
+      printMsg('Completed function. Time elapsed: %s' % ds)
+      
+      return out_Polys
+   
    # Variables used in-loop:
    bufferLines = out_Scratch + os.sep + 'bufferLines'
    splitPts = out_Scratch + os.sep + 'splitPts'
@@ -558,7 +930,28 @@ def CreatePolys_scu(in_Lines, in_hydroNet, out_Polys, out_Scratch = arcpy.env.sc
 
    return out_Polys
    
-def CreateFlowBuffers_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_Scratch = arcpy.env.scratchGDB):
+def copyToRaster_scu(in_Polys, in_Raster, out_Polys):
+   '''Copies features to the output, reprojecting them if needed to match the coordinate system of the raster'''
+   # Check if input features and input raster have same spatial reference.
+   # If so, just make a copy. If not, reproject features to match raster.
+   srRast = arcpy.Describe(in_Raster).spatialReference
+   srFeats = arcpy.Describe(in_Polys).spatialReference
+   if srFeats.Name == srRast.Name:
+      printMsg('Coordinate systems for features and raster are the same. Copying...')
+      arcpy.CopyFeatures_management (in_Polys, out_Polys)
+   else:
+      printMsg('Reprojecting features to match raster...')
+      # Check if geographic transformation is needed, and handle accordingly.
+      if srFeats.GCS.Name == srRast.GCS.Name:
+         geoTrans = ""
+         printMsg('No geographic transformation needed...')
+      else:
+         transList = arcpy.ListTransformations(srFeats,srRast)
+         geoTrans = transList[0]
+      arcpy.Project_management (in_Polys, out_Polys, srRast, geoTrans)
+   return out_Polys
+
+def CreateFlowBuffers_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_Scratch = arcpy.env.scratchGDB, smooth = False):
    '''Delineates catchment buffers around polygon SCUs based on flow distance down to features (rather than straight distance)
    Parameters:
    - in_Polys = Input polygons representing unbuffered Stream Conservation Units
@@ -567,6 +960,7 @@ def CreateFlowBuffers_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_
    - out_Polys = Output polygon feature class representing Stream Conservation Units with catchment buffers
    - maxDist = Maximum buffer distance (used to truncate catchments)
    - out_Scratch = Geodatabase to contain intermediate outputs
+   - smooth = If True, buffer boundaries are smoothed before conversion to polygons (see libRasterFx.smoothMask)
    
    Note that scratchGDB is used rather than in_memory b/c process inexplicably yields incorrect output otherwise.
    '''
@@ -587,22 +981,8 @@ def CreateFlowBuffers_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_
    arcpy.env.snapRaster = in_FlowDir
    (num, units, procDist) = multiMeasure(maxDist, 3)
 
-   # Check if input features and input flow direction have same spatial reference.
-   # If so, just make a copy. If not, reproject features to match raster.
-   srFeats = arcpy.Describe(in_Polys).spatialReference
-   if srFeats.Name == srRast.Name:
-      printMsg('Coordinate systems for features and raster are the same. Copying...')
-      arcpy.CopyFeatures_management (in_Polys, out_Polys)
-   else:
-      printMsg('Reprojecting features to match raster...')
-      # Check if geographic transformation is needed, and handle accordingly.
-      if srFeats.GCS.Name == srRast.GCS.Name:
-         geoTrans = ""
-         printMsg('No geographic transformation needed...')
-      else:
-         transList = arcpy.ListTransformations(srFeats,srRast)
-         geoTrans = transList[0]
-      arcpy.Project_management (in_Polys, out_Polys, srRast, geoTrans)
+   # Copy or reproject features to match raster
+   copyToRaster_scu(in_Polys, in_FlowDir, out_Polys)
 
    # Add and calculate a field needed for raster conversion
    arcpy.AddField_management (out_Polys, 'rasterVal', 'SHORT')
@@ -624,11 +1004,6 @@ def CreateFlowBuffers_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_
    clipBuff = out_Scratch + os.sep + 'clipBuff'
    clp_FlowDist = out_Scratch + os.sep + 'clp_FlowDist'
    binRast = out_Scratch + os.sep + 'binRast'
-   cleanRast = out_Scratch + os.sep + 'cleanRast'
-   prePoly = out_Scratch + os.sep + 'prePoly'
-   finPoly = out_Scratch + os.sep + 'finPoly'
-   coalescedPoly = out_Scratch + os.sep + 'finPoly'
-   multiPoly = out_Scratch + os.sep + 'multiPoly'
    
    # Create an empty list to store IDs of features that fail to get processed
    myFailList = []
@@ -695,27 +1070,18 @@ def CreateFlowBuffers_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_
                   (Con((IsNull(srcRast)== 0),1,0)),
                   (Con((Raster(clp_FlowDist) <= num),1,0)))
          tmpRast.save(binRast)
-         # printMsg('Boundary cleaning...')
-         # tmpRast = BoundaryClean (binRast, 'NO_SORT', 'TWO_WAY')
-         # tmpRast.save(cleanRast)
-         printMsg('Setting zeros to nulls...')
-         tmpRast = SetNull (binRast, 1, 'Value = 0')
-         tmpRast.save(prePoly)
-
-         # Convert raster to polygon
-         printMsg('Converting flow distance raster to polygon...')
-         arcpy.RasterToPolygon_conversion (prePoly, finPoly, "NO_SIMPLIFY")
-     
-         # Check the number of features at this point. 
-         # It should be just one. If more, need to remove orphan fragments.
-         arcpy.MakeFeatureLayer_management (finPoly, "finPoly")
-         count = countFeatures("finPoly")
-         if count > 1:
-            printMsg('Removing orphan fragments...')
-            arcpy.SelectLayerByLocation_management("finPoly", "CONTAINS", tmpFeat, "", "NEW_SELECTION")
          
-         # Use the flow distance buffer geometry as the final shape
-         myFinalShape = arcpy.SearchCursor("finPoly").next().Shape
+         # Convert raster to polygon in memory, removing orphan fragments not connected to the feature
+         printMsg('Converting flow distance raster to polygon...')
+         binExt = arcpy.Describe(binRast).extent
+         binMask = arcpy.RasterToNumPyArray(binRast, nodata_to_value = 0) == 1
+         (nRows, nCols) = binMask.shape
+         lowerLeft = arcpy.Point(binExt.XMin, binExt.YMax - nRows*float(cellSize))
+         srcMask = arcpy.RasterToNumPyArray(srcRast, lowerLeft, nCols, nRows, 0) == 1
+         window = (binExt.XMin, binExt.YMax, nRows, nCols)
+         myFinalShape = libRasterFx.maskToGeom(binMask, {"cellSize": float(cellSize), "sr": srRast}, window, srcMask, int(smooth))
+         if myFinalShape is None:
+            raise Exception('Flow distance buffer is empty')
 
          # Update the feature with its final shape
          row[1] = myFinalShape
@@ -770,6 +1136,155 @@ def CreateFlowBuffers_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_
    
    return out_Polys
    
+def BuildFlowIndex_scu(in_FlowDir, out_IndexDir):
+   '''Builds an upstream index of a D8 flow direction raster (see libRasterFx.FlowIndex) and saves it on disk, for use by CreateFlowBuffersNative_scu. This only needs to be run when the flow direction raster changes; the saved index is memory-mapped by subsequent tools, so each catchment is found without tracing the flow network. The whole raster is processed in memory, at about 60 bytes per cell (see libRasterFx.FlowIndex.build), so large rasters need 64-bit Python. Keep in_FlowDir in a geodatabase not used for outputs, since the index is refused once that geodatabase changes.
+   Parameters:
+   - in_FlowDir = Input raster representing D8 flow direction
+   - out_IndexDir = Folder to store the index
+   '''
+   
+   # timestamp
+   t0 = datetime.now()
+   
+   libRasterFx.FlowIndex.build(in_FlowDir, out_IndexDir)
+   
+   # timestamp
+   t1 = datetime.now()
+   ds = GetElapsedTime (t0, t1)
+   printMsg('Completed function. Time elapsed: %s' % ds)
+   
+   return out_IndexDir
+
+def CreateFlowBuffersNative_scu(in_Polys, fld_ID, in_FlowDir, out_Polys, maxDist, out_Scratch = arcpy.env.scratchGDB, multiSource = False, cacheMB = 256, smooth = False, in_IndexDir = None):
+   '''Delineates catchment buffers around polygon SCUs based on flow distance down to features (rather than straight distance). This is equivalent to CreateFlowBuffers_scu, but uses a native D8 flow-length engine (see libRasterFx.py) instead of Spatial Analyst, so no Spatial Analyst license is needed. As in CreateFlowBuffers_scu, the flow distance is limited to three times maxDist, and the buffer is truncated at the straight-line distance maxDist.
+   Parameters:
+   - in_Polys = Input polygons representing unbuffered Stream Conservation Units
+   - fld_ID = The field in the input Procedural Features containing the Source Feature ID
+   - in_FlowDir = Input raster representing D8 flow direction
+   - out_Polys = Output polygon feature class representing Stream Conservation Units with catchment buffers
+   - maxDist = Maximum buffer distance (used to truncate catchments)
+   - out_Scratch = Geodatabase to contain intermediate outputs (not used, since all processing is in memory; kept for consistency with CreateFlowBuffers_scu)
+   - multiSource = If True, all features are processed together in one raster pass, with each cell assigned to the first feature it drains into (see libRasterFx.MultiFlowBuffers). This is much faster for many features, but where one feature drains into another, the area upstream of the first is not included in the buffer of the second. Such cases are reported.
+   - cacheMB = Memory bound for cached tiles of the flow direction raster, in megabytes. The raster is read in tiles, which are reused by nearby features.
+   - smooth = If True, buffer boundaries are smoothed before conversion to polygons (see libRasterFx.smoothMask)
+   - in_IndexDir = Folder containing an upstream index of in_FlowDir, built by BuildFlowIndex_scu. If supplied, features processed one by one are buffered from the index instead of from the raster. An index built from a different raster, or before in_FlowDir (or its geodatabase) was last modified, is not used.
+   '''
+   
+   # timestamp
+   t0 = datetime.now()
+   
+   # Get cell size and output spatial reference from in_FlowDir
+   fdirTiles = libRasterFx.TiledRaster(in_FlowDir, maxMB = cacheMB)
+   info = fdirTiles.info
+   printMsg('Cell size of flow direction raster is %s %ss' %(info["cellSize"], info["sr"].linearUnitName))
+   printMsg('Flow modeling is strongly dependent on cell size.')
+   (num, units, procDist) = multiMeasure(maxDist, 3)
+   clipDist = num/3
+   
+   # Copy or reproject features to match raster
+   copyToRaster_scu(in_Polys, in_FlowDir, out_Polys)
+   
+   # Count features and report
+   numFeats = countFeatures(out_Polys)
+   printMsg('There are %s features to process.' % numFeats)
+   
+   if multiSource:
+      # Process all features in one pass
+      idDict = dict()
+      feats = []
+      with arcpy.da.SearchCursor(out_Polys, ["OID@", fld_ID, "SHAPE@"]) as cursor:
+         for row in cursor:
+            idDict[row[0]] = row[1]
+            feats.append((row[0], row[2]))
+      (geomDict, overlaps, drains) = libRasterFx.MultiFlowBuffers(feats, fdirTiles, info, num, clipDist, smooth = int(smooth))
+      
+      # Update the features with their final shapes
+      myFailList = []
+      with arcpy.da.UpdateCursor(out_Polys, ["OID@", "SHAPE@"]) as cursor:
+         for row in cursor:
+            if geomDict.get(row[0]) is None:
+               myFailList.append(idDict[row[0]])
+               continue
+            row[1] = geomDict[row[0]]
+            cursor.updateRow(row)
+      
+      # Report cases handled differently than in feature-by-feature processing
+      if len(overlaps) > 0:
+         printWrng('These features overlap other features, and share cells with them: %s' % str([idDict[i] for i in overlaps]))
+      if len(drains) > 0:
+         printWrng('These features drain into other features (upstream, downstream), so the downstream buffers exclude the upstream catchments: %s' % str([(idDict[a], idDict[b]) for (a, b) in drains]))
+      if len(myFailList) > 0:
+         printWrng('These features failed to process: %s' % str(myFailList))
+      fdirTiles.report()
+      
+      # timestamp
+      t1 = datetime.now()
+      ds = GetElapsedTime (t0, t1)
+      printMsg('Completed function. Time elapsed: %s' % ds)
+      
+      return out_Polys
+   
+   # Open the upstream index, if any, refusing it if it was not built from the current flow direction raster
+   index = None
+   if in_IndexDir:
+      try:
+         index = libRasterFx.FlowIndex(in_IndexDir, fdirTiles.sourceStamp())
+      except ValueError:
+         printWrng('The flow index in %s is out of date with the flow direction raster. Rebuild it with BuildFlowIndex_scu. Features will be buffered from the raster instead.' % in_IndexDir)
+   
+   # Create an empty list to store IDs of features that fail to get processed
+   myFailList = []
+   
+   with arcpy.da.UpdateCursor(out_Polys, [fld_ID, "SHAPE@"]) as cursor:
+      counter = 1
+      for row in cursor:
+         try:
+            # Extract the unique ID and geometry object
+            myID = row[0]
+            myShape = row[1]
+            printMsg('Working on feature %s with ID %s' % (counter, str(myID)))
+            
+            if index is not None:
+               myFinalShape = libRasterFx.IndexedFlowBufferGeom(myShape, index, num, clipDist, int(smooth))
+            else:
+               myFinalShape = libRasterFx.FlowBufferGeom(myShape, fdirTiles, info, num, clipDist, int(smooth))
+            if myFinalShape is None:
+               raise Exception('Feature is outside the flow direction raster')
+            
+            # Update the feature with its final shape
+            row[1] = myFinalShape
+            cursor.updateRow(row)
+            
+         except:
+            # Add failure message and append failed feature ID to list
+            printMsg("\nFailed to fully process feature " + str(myID))
+            myFailList.append(myID)
+            
+            # Error handling code swiped from "A Python Primer for ArcGIS"
+            tb = sys.exc_info()[2]
+            tbinfo = traceback.format_tb(tb)[0]
+            pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n " + str(sys.exc_info()[1])
+            msgs = "ARCPY ERRORS:\n" + arcpy.GetMessages(2) + "\n"
+            printWrng(msgs)
+            printWrng(pymsg)
+            
+            # Add status message
+            printMsg("\nMoving on to the next feature.  Note that the output will be incomplete.")
+         
+         finally:
+            counter += 1
+   
+   if len(myFailList) > 0:
+      printWrng('These features failed to process: %s' % str(myFailList))
+   fdirTiles.report()
+   
+   # timestamp
+   t1 = datetime.now()
+   ds = GetElapsedTime (t0, t1)
+   printMsg('Completed function. Time elapsed: %s' % ds)
+   
+   return out_Polys
+   
 # Use the main function below to run functions directly from Python IDE or command line with hard-coded variables
 def main():
    in_hydroGDB = r'C:\Users\xch43889\Documents\Working\SCU\VA_HydroNet.gdb'
@@ -787,6 +1302,8 @@ def main():
    # (downLyr, upLyr) = MakeServiceLayers_scu(in_GDB)
    # MakeNetworkPts_scu(in_PF, out_Points, "SFID", in_downTrace, in_upTrace, "in_memory")
    # CreateLines_scu(out_Lines, in_downTrace, in_upTrace, scratchGDB)
+   # CreateLinesNative_scu(out_Lines, in_PF, out_Points, in_hydroGDB + os.sep + 'HydroNet' + os.sep + 'NHDFlowline', scratchGDB)
+   # BuildRiverCells_scu(in_hydroGDB, scratchGDB + os.sep + "riverCells", scratchGDB)
    CreatePolys_scu(out_Lines, in_hydroGDB, out_Polys, scratchGDB)
    
 if __name__ == '__main__':
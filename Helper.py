@@ -2,7 +2,7 @@
 # Helper.py
 # Version:  ArcGIS 10.3.1 / Python 2.7.8
 # Creation Date: 2017-08-08
-# Last Edit: 2019-07-30
+# Last Edit: 2026-10-19
 # Creator:  Kirsten R. Hazler
 
 # Summary:
@@ -11,7 +11,12 @@
 # ----------------------------------------------------------------------------------------
 
 # Import modules
-import os, sys, traceback, numpy
+import os, sys, traceback, numpy, hashlib, math, threading, Queue, shutil
+from collections import OrderedDict
+try:
+   import cPickle as pickle
+except:
+   import pickle
 try:
    arcpy
    print "Arcpy is already loaded"
@@ -85,41 +90,207 @@ def CleanFeatures(inFeats, outFeats):
    
    return outFeats
 
-def CleanClip(inFeats, clipFeats, outFeats, scratchGDB = "in_memory"):
-   '''Clips the Input Features with the Clip Features.  The resulting features are then subjected to geometry repair and exploded (eliminating multipart polygons)'''
+### Vertex-budget subdivision ###
+# Overlay tools (Clip, Erase, Intersect) slow down dramatically, and sometimes fail, on polygons with huge numbers of vertices. Subdividing such polygons into smaller pieces before overlay, then reassembling the pieces afterward, is usually much faster than running the overlay on the originals.
+def subdivideGeom(geom, maxVerts, depth = 0):
+   '''Recursively splits a geometry at the midpoint of the longer axis of its extent, until each piece has no more than the specified number of vertices. Returns a list of geometries.
+   Parameters:
+   - geom = input polygon or polyline geometry
+   - maxVerts = maximum number of vertices allowed in a piece
+   - depth = recursion depth; splitting stops at depth 24 regardless of vertex count
+   '''
+   if geom.pointCount <= maxVerts or depth >= 24:
+      return [geom]
+   ext = geom.extent
+   if ext.width >= ext.height:
+      mid = (ext.XMin + ext.XMax)/2.0
+      boxes = [arcpy.Extent(ext.XMin, ext.YMin, mid, ext.YMax), arcpy.Extent(mid, ext.YMin, ext.XMax, ext.YMax)]
+   else:
+      mid = (ext.YMin + ext.YMax)/2.0
+      boxes = [arcpy.Extent(ext.XMin, ext.YMin, ext.XMax, mid), arcpy.Extent(ext.XMin, mid, ext.XMax, ext.YMax)]
+   pieces = []
+   for box in boxes:
+      part = geom.clip(box)
+      if part is None or part.pointCount == 0:
+         continue
+      if geom.type == "polygon" and part.area <= 0:
+         continue
+      pieces.extend(subdivideGeom(part, maxVerts, depth + 1))
+   return pieces
+
+def attributeFields(inFeats, exclude = []):
+   '''Returns a list of the names of the editable attribute fields of the input features, excluding the OID, geometry, and geometry length and area fields'''
+   desc = arcpy.Describe(inFeats)
+   skip = [getattr(desc, "lengthFieldName", ""), getattr(desc, "areaFieldName", "")] + exclude
+   flds = []
+   for f in arcpy.ListFields(inFeats):
+      if f.type in ("OID", "Geometry", "Blob", "Raster", "GUID", "GlobalID"):
+         continue
+      if f.name in skip or not f.editable:
+         continue
+      flds.append(f.name)
+   return flds
+
+def SubdivideFeats(inFeats, outFeats, maxVerts = 5000, fld_ID = "SUBDIV_ID"):
+   '''Subdivides polygons or lines with more than the specified number of vertices into smaller grid-aligned pieces, similar to ST_Subdivide in PostGIS. Attributes are carried over to the pieces, and the source feature's ObjectID is stored in a new ID field so the pieces can be reassembled with ReassembleFeats. A spatial index is added to the output if it is written to disk.
+   Returns the number of features that were subdivided.
+   Parameters:
+   - inFeats = input features
+   - outFeats = output subdivided features
+   - maxVerts = maximum number of vertices allowed in a piece
+   - fld_ID = name of the field to store the source feature ID
+   '''
+   desc = arcpy.Describe(inFeats)
+   sr = desc.spatialReference
+   flds = attributeFields(inFeats, [fld_ID])
+   
+   outDir = os.path.dirname(outFeats)
+   outName = os.path.basename(outFeats)
+   if arcpy.Exists(outFeats):
+      arcpy.Delete_management(outFeats)
+   arcpy.CreateFeatureclass_management (outDir, outName, desc.shapeType.upper(), inFeats, "", "", sr)
+   arcpy.AddField_management(outFeats, fld_ID, "LONG")
+   
+   numSplit = 0
+   numPieces = 0
+   with arcpy.da.SearchCursor(inFeats, ["OID@", "SHAPE@"] + flds) as inCursor:
+      with arcpy.da.InsertCursor(outFeats, ["SHAPE@", fld_ID] + flds) as outCursor:
+         for row in inCursor:
+            if row[1] is None:
+               continue
+            pieces = subdivideGeom(row[1], maxVerts)
+            if len(pieces) > 1:
+               numSplit += 1
+            for piece in pieces:
+               outCursor.insertRow([piece, row[0]] + list(row[2:]))
+               numPieces += 1
+   
+   if numSplit > 0:
+      printMsg('Subdivided %s features into %s pieces with at most %s vertices each' % (numSplit, numPieces, maxVerts))
+   if not outFeats.startswith("in_memory"):
+      arcpy.AddSpatialIndex_management(outFeats)
+   return numSplit
+
+def ReassembleFeats(inPieces, outFeats, fld_ID = "SUBDIV_ID"):
+   '''Reassembles pieces created by SubdivideFeats (or the outputs of an overlay run on them) into single features, by dissolving on the source feature ID and the attribute fields. The ID field is then removed.
+   Parameters:
+   - inPieces = input pieces
+   - outFeats = output reassembled features
+   - fld_ID = name of the field storing the source feature ID
+   '''
+   flds = attributeFields(inPieces, [fld_ID])
+   arcpy.Dissolve_management (inPieces, outFeats, [fld_ID] + flds, "", "MULTI_PART")
+   arcpy.DeleteField_management (outFeats, fld_ID)
+   return outFeats
+
+def isGeometry(inFeats):
+   '''Tests whether the input is a geometry object or a list of them, rather than a feature class or layer'''
+   if isinstance(inFeats, list):
+      return len(inFeats) > 0 and all([isinstance(g, arcpy.Geometry) for g in inFeats])
+   return isinstance(inFeats, arcpy.Geometry)
+
+def countOverBudget(inFeats, maxVerts):
+   '''Returns the number of features (or geometry objects) with more than the specified number of vertices'''
+   if isGeometry(inFeats):
+      if isinstance(inFeats, list):
+         geoms = inFeats
+      else:
+         geoms = [inFeats]
+   else:
+      with arcpy.da.SearchCursor(inFeats, ["SHAPE@"]) as cursor:
+         geoms = [row[0] for row in cursor]
+   return len([g for g in geoms if g is not None and g.pointCount > maxVerts])
+
+def subdivideInputs(inFeats, overFeats, maxVerts, scratchGDB = "in_memory"):
+   '''Subdivides the input and overlay features for CleanClip and CleanErase. Features are only copied and subdivided if some of them exceed the vertex budget. Either may be a geometry object (or list of them), as with the overlay tools; it is then written to scratch before subdividing. Returns a tuple (inFeats, overFeats, reassemble), where the features are the subdivided versions if any features needed subdividing (otherwise the inputs unchanged), and reassemble indicates whether the overlay output must be reassembled.'''
+   reassemble = False
+   if countOverBudget(inFeats, maxVerts) > 0:
+      if isGeometry(inFeats):
+         geomIn = scratchGDB + os.sep + "geomIn"
+         arcpy.CopyFeatures_management(inFeats, geomIn)
+         inFeats = geomIn
+      subIn = scratchGDB + os.sep + "subIn"
+      SubdivideFeats(inFeats, subIn, maxVerts)
+      inFeats = subIn
+      reassemble = True
+   if countOverBudget(overFeats, maxVerts) > 0:
+      if isGeometry(overFeats):
+         geomOver = scratchGDB + os.sep + "geomOver"
+         arcpy.CopyFeatures_management(overFeats, geomOver)
+         overFeats = geomOver
+      # Clip and Erase use the union of the overlay features, so the overlay pieces do not need reassembling
+      subOver = scratchGDB + os.sep + "subOver"
+      SubdivideFeats(overFeats, subOver, maxVerts)
+      overFeats = subOver
+   return (inFeats, overFeats, reassemble)
+
+def CleanClip(inFeats, clipFeats, outFeats, scratchGDB = "in_memory", maxVerts = None):
+   '''Clips the Input Features with the Clip Features.  The resulting features are then subjected to geometry repair and exploded (eliminating multipart polygons). If maxVerts is set, features with more than that number of vertices are subdivided before clipping (see SubdivideFeats), and the clipped pieces are reassembled.'''
    # # Determine where temporary data are written
    # msg = getScratchMsg(scratchGDB)
    # arcpy.AddMessage(msg)
    
+   # Process: Subdivide features with huge numbers of vertices
+   reassemble = False
+   if maxVerts:
+      (inFeats, clipFeats, reassemble) = subdivideInputs(inFeats, clipFeats, maxVerts, scratchGDB)
+   
    # Process: Clip
    tmpClip = scratchGDB + os.sep + "tmpClip"
    arcpy.Clip_analysis(inFeats, clipFeats, tmpClip)
+   
+   # Process: Reassemble pieces
+   if reassemble:
+      tmpAssembled = scratchGDB + os.sep + "tmpAssembled"
+      ReassembleFeats(tmpClip, tmpAssembled)
+      tmpClip = tmpAssembled
 
    # Process: Clean Features
    CleanFeatures(tmpClip, outFeats)
    
    # Cleanup
    if scratchGDB == "in_memory":
-      garbagePickup([tmpClip])
+      trashList = [scratchGDB + os.sep + "tmpClip"]
+      if reassemble:
+         trashList.append(scratchGDB + os.sep + "tmpAssembled")
+      if maxVerts:
+         trashList.extend([scratchGDB + os.sep + t for t in ["geomIn", "subIn", "geomOver", "subOver"]])
+      garbagePickup(trashList)
    
    return outFeats
    
-def CleanErase(inFeats, eraseFeats, outFeats, scratchGDB = "in_memory"):
-   '''Uses Eraser Features to erase portions of the Input Features, then repairs geometry and explodes any multipart polygons.'''
+def CleanErase(inFeats, eraseFeats, outFeats, scratchGDB = "in_memory", maxVerts = None):
+   '''Uses Eraser Features to erase portions of the Input Features, then repairs geometry and explodes any multipart polygons. If maxVerts is set, features with more than that number of vertices are subdivided before erasing (see SubdivideFeats), and the erased pieces are reassembled.'''
    # # Determine where temporary data are written
    # msg = getScratchMsg(scratchGDB)
    # arcpy.AddMessage(msg)
    
+   # Process: Subdivide features with huge numbers of vertices
+   reassemble = False
+   if maxVerts:
+      (inFeats, eraseFeats, reassemble) = subdivideInputs(inFeats, eraseFeats, maxVerts, scratchGDB)
+   
    # Process: Erase
    tmpErased = scratchGDB + os.sep + "tmpErased"
    arcpy.Erase_analysis(inFeats, eraseFeats, tmpErased, "")
+   
+   # Process: Reassemble pieces
+   if reassemble:
+      tmpAssembled = scratchGDB + os.sep + "tmpAssembled"
+      ReassembleFeats(tmpErased, tmpAssembled)
+      tmpErased = tmpAssembled
 
    # Process: Clean Features
    CleanFeatures(tmpErased, outFeats)
    
    # Cleanup
    if scratchGDB == "in_memory":
-      garbagePickup([tmpErased])
+      trashList = [scratchGDB + os.sep + "tmpErased"]
+      if reassemble:
+         trashList.append(scratchGDB + os.sep + "tmpAssembled")
+      if maxVerts:
+         trashList.extend([scratchGDB + os.sep + t for t in ["geomIn", "subIn", "geomOver", "subOver"]])
+      garbagePickup(trashList)
    
    return outFeats
    
@@ -200,8 +371,622 @@ def clearSelection(fc):
    if typeFC == 'FeatureLayer':
       arcpy.SelectLayerByAttribute_management (fc, "CLEAR_SELECTION")
       
-def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
-   '''If a positive number is entered for the dilation distance, features are expanded outward by the specified distance, then shrunk back in by the same distance. This causes nearby features to coalesce. If a negative number is entered for the dilation distance, features are first shrunk, then expanded. This eliminates narrow portions of existing features, thereby simplifying them. It can also break narrow "bridges" between features that were formerly coalesced.'''
+### Geometry memoization ###
+# Buffer, Coalesce and ShrinkWrap are often run repeatedly on the same input geometries with the same distances within a single run (and from one run to the next). When memoization is turned on with EnableGeomMemo, their results are cached and reused instead of being recomputed. It is off by default. Callers should turn it off again with DisableGeomMemo in a finally clause, so it does not stay on for later tools in the same session. Keys are hashes of the input geometries and parameters, so results on disk never go stale; the disk tier is pruned to a size bound, and can be deleted with ClearGeomMemo.
+geomMemo = None
+
+class GeomMemo(object):
+   '''A least-recently-used cache of geometry results, keyed by a hash of the normalized input geometries plus the operation and its parameters. Results are stored as lists of WKB strings. An optional on-disk tier allows results to be reused in later runs.
+   Parameters:
+   - maxMB = memory bound for cached results, in megabytes
+   - diskDir = optional directory for storing results on disk
+   - maxDiskMB = size bound for the disk tier, in megabytes (see pruneDisk)
+   '''
+   def __init__(self, maxMB = 256, diskDir = None, maxDiskMB = 1024):
+      self.maxBytes = int(maxMB*1024*1024)
+      self.diskDir = diskDir
+      self.maxDiskBytes = int(maxDiskMB*1024*1024)
+      self.cache = OrderedDict()
+      self.curBytes = 0
+      self.hits = 0
+      self.diskHits = 0
+      self.misses = 0
+      if diskDir and not os.path.exists(diskDir):
+         os.makedirs(diskDir)
+   
+   def makeKey(self, op, wkbList, parms):
+      '''Returns a hash key for the operation, parameters, and input geometries. Input geometries are normalized by hashing each one separately and sorting the hashes, so the key does not depend on feature order.'''
+      h = hashlib.sha1()
+      h.update(str(op).upper())
+      for p in parms:
+         h.update('|' + str(p).upper())
+      for d in sorted([hashlib.sha1(w).digest() for w in wkbList]):
+         h.update(d)
+      return h.hexdigest()
+      
+   def diskPath(self, key):
+      return self.diskDir + os.sep + key + '.pkl'
+   
+   def get(self, key):
+      '''Returns the cached list of WKB strings for the key, or None if not cached.'''
+      if key in self.cache:
+         val = self.cache.pop(key)
+         self.cache[key] = val # Move to most-recently-used position
+         self.hits += 1
+         return val
+      if self.diskDir and os.path.exists(self.diskPath(key)):
+         try:
+            with open(self.diskPath(key), 'rb') as f:
+               val = pickle.load(f)
+            os.utime(self.diskPath(key), None) # Mark as recently used, for pruning
+            self.store(key, val)
+            self.diskHits += 1
+            return val
+         except:
+            pass
+      self.misses += 1
+      return None
+      
+   def put(self, key, wkbList):
+      '''Adds a result to the cache, and to the disk tier if there is one.'''
+      self.store(key, wkbList)
+      if self.diskDir:
+         tmpPath = self.diskPath(key) + '.tmp'
+         with open(tmpPath, 'wb') as f:
+            pickle.dump(wkbList, f, pickle.HIGHEST_PROTOCOL)
+         if os.path.exists(self.diskPath(key)):
+            os.remove(self.diskPath(key))
+         os.rename(tmpPath, self.diskPath(key))
+   
+   def store(self, key, wkbList):
+      '''Adds a result to the in-memory tier, evicting least-recently-used results as needed to stay within the memory bound.'''
+      size = sum([len(w) for w in wkbList])
+      if size > self.maxBytes:
+         return
+      if key in self.cache:
+         self.curBytes -= sum([len(w) for w in self.cache.pop(key)])
+      self.cache[key] = wkbList
+      self.curBytes += size
+      while self.curBytes > self.maxBytes:
+         oldKey, oldVal = self.cache.popitem(last = False)
+         self.curBytes -= sum([len(w) for w in oldVal])
+   
+   def pruneDisk(self):
+      '''Deletes the least recently used results from the on-disk tier, as needed to keep it within its size bound.'''
+      if not self.diskDir or not os.path.exists(self.diskDir):
+         return
+      files = []
+      for f in os.listdir(self.diskDir):
+         path = os.path.join(self.diskDir, f)
+         try:
+            files.append((os.path.getmtime(path), os.path.getsize(path), path))
+         except OSError:
+            pass
+      total = sum([s for (t, s, p) in files])
+      for (t, s, path) in sorted(files):
+         if total <= self.maxDiskBytes:
+            break
+         try:
+            os.remove(path)
+            total -= s
+         except OSError:
+            pass
+   
+   def clearDisk(self):
+      '''Deletes the on-disk tier, if there is one.'''
+      if self.diskDir and os.path.exists(self.diskDir):
+         shutil.rmtree(self.diskDir, ignore_errors = True)
+   
+   def report(self):
+      '''Prints hit-rate statistics'''
+      lookups = self.hits + self.diskHits + self.misses
+      if lookups > 0:
+         rate = 100.0*(self.hits + self.diskHits)/lookups
+      else:
+         rate = 0.0
+      printMsg('Geometry memoization: %s lookups, %s memory hits, %s disk hits, %s misses (hit rate %.1f%%). %s results (%.1f MB) held in memory.' % (lookups, self.hits, self.diskHits, self.misses, rate, len(self.cache), self.curBytes/1048576.0))
+
+def EnableGeomMemo(maxMB = 256, diskDir = None, maxDiskMB = 1024):
+   '''Turns on memoization of buffer, coalesce and shrinkwrap results.
+   Parameters:
+   - maxMB = memory bound for cached results, in megabytes
+   - diskDir = optional directory for storing results on disk, so that they can be reused in later runs
+   - maxDiskMB = size bound for results stored on disk, in megabytes. The least recently used results are pruned when memoization is turned off.
+   '''
+   global geomMemo
+   geomMemo = GeomMemo(maxMB, diskDir, maxDiskMB)
+   return geomMemo
+   
+def DisableGeomMemo():
+   '''Reports statistics for, and turns off, memoization of geometry results. The on-disk tier, if any, is kept for later runs, but pruned to its size bound.'''
+   global geomMemo
+   if geomMemo is not None:
+      geomMemo.report()
+      geomMemo.pruneDisk()
+   geomMemo = None
+
+def ClearGeomMemo(diskDir):
+   '''Deletes memoized geometry results stored on disk (e.g. to reclaim space; results never go stale, since they are keyed by their inputs).
+   Parameters:
+   - diskDir = directory of results on disk, as given to EnableGeomMemo
+   '''
+   GeomMemo(0, diskDir).clearDisk()
+
+def readWKB(inFeats):
+   '''Returns a list of WKB strings for the (non-null) geometries in the input features'''
+   wkbList = []
+   with arcpy.da.SearchCursor(inFeats, ["SHAPE@WKB"]) as cursor:
+      for row in cursor:
+         if row[0] is not None:
+            wkbList.append(str(row[0]))
+   return wkbList
+
+def writeWKB(wkbList, outFeats, geomType = "POLYGON", template = "", sr = ""):
+   '''Creates a feature class and populates it with the geometries in a list of WKB strings'''
+   outDir = os.path.dirname(outFeats)
+   outName = os.path.basename(outFeats)
+   if arcpy.Exists(outFeats):
+      arcpy.Delete_management(outFeats)
+   arcpy.CreateFeatureclass_management (outDir, outName, geomType, template, "", "", sr)
+   with arcpy.da.InsertCursor(outFeats, ["SHAPE@"]) as cursor:
+      for w in wkbList:
+         cursor.insertRow([arcpy.FromWKB(bytearray(w))])
+   return outFeats
+
+def memoFetch(op, inFeats, parms, outFeats, template = ""):
+   '''Checks for a memoized result of a geometry operation. If one is found, it is written to the output features.
+   Returns a tuple (hit, key). The key is needed to store a new result with memoStore, and is None if memoization is off.
+   Parameters:
+   - op = name of the operation
+   - inFeats = input features to the operation
+   - parms = list of parameters that affect the result, e.g. distance, units, and method
+   - outFeats = output features to create on a hit
+   - template = template for the output feature class, if any
+   '''
+   if geomMemo is None:
+      return (False, None)
+   sr = arcpy.Describe(inFeats).spatialReference
+   key = geomMemo.makeKey(op, readWKB(inFeats), list(parms) + [sr.name])
+   wkbList = geomMemo.get(key)
+   if wkbList is None:
+      return (False, key)
+   writeWKB(wkbList, outFeats, "POLYGON", template, sr)
+   return (True, key)
+
+def memoStore(key, outFeats):
+   '''Stores the result of a geometry operation under the key obtained from memoFetch'''
+   if key is not None and geomMemo is not None:
+      geomMemo.put(key, readWKB(outFeats))
+   return
+
+### Prepared geometries ###
+# Loops that test the same site geometry repeatedly against other features (e.g., selecting procedural features within a ProtoSite) can run the tests in memory against prepared geometries instead of copying the site to a feature class for each geoprocessing call.
+class PreparedGeom(object):
+   '''Wraps a geometry for repeated predicate tests. Candidates are first screened against the geometry's bounding box, and results of tests against identified geometries (those with an ObjectID and a source) are cached. ObjectIDs are only unique within a dataset, so the source is part of the cache key.
+   Parameters:
+   - geom = the geometry
+   - oid = optional ObjectID of the source feature
+   - source = optional tag identifying the set of features the ObjectID belongs to (see loadPrepared)
+   '''
+   def __init__(self, geom, oid = None, source = None):
+      self.geom = geom
+      self.oid = oid
+      self.source = source
+      ext = geom.extent
+      self.bbox = (ext.XMin, ext.YMin, ext.XMax, ext.YMax)
+      self.cache = {}
+      
+   def bboxNear(self, other, dist = 0):
+      '''Returns True if the bounding box of the other geometry is within the specified distance of this geometry's bounding box'''
+      if isinstance(other, PreparedGeom):
+         b = other.bbox
+      else:
+         ext = other.extent
+         b = (ext.XMin, ext.YMin, ext.XMax, ext.YMax)
+      return not (b[0] > self.bbox[2] + dist or b[2] < self.bbox[0] - dist or b[1] > self.bbox[3] + dist or b[3] < self.bbox[1] - dist)
+   
+   def test(self, pred, other, dist = 0):
+      '''Tests the predicate ("INTERSECTS", "CONTAINS", or "WITHIN_DISTANCE") against the other geometry, which may be a PreparedGeom'''
+      key = None
+      if isinstance(other, PreparedGeom):
+         if other.oid is not None and other.source is not None:
+            key = (pred, dist, other.source, other.oid)
+         other = other.geom
+      if key is not None and key in self.cache:
+         return self.cache[key]
+      if not self.bboxNear(other, dist):
+         result = False
+      elif pred == "INTERSECTS":
+         result = not self.geom.disjoint(other)
+      elif pred == "CONTAINS":
+         result = self.geom.contains(other)
+      elif pred == "WITHIN_DISTANCE":
+         result = self.geom.distanceTo(other) <= dist
+      else:
+         raise ValueError("Invalid predicate: %s" % pred)
+      if key is not None:
+         self.cache[key] = result
+      return result
+   
+   def intersects(self, other):
+      return self.test("INTERSECTS", other)
+      
+   def contains(self, other):
+      return self.test("CONTAINS", other)
+   
+   def withinDistance(self, other, dist):
+      return self.test("WITHIN_DISTANCE", other, dist)
+   
+   def filter(self, candidates, pred = "INTERSECTS", dist = 0):
+      '''Returns the subset of a list of PreparedGeoms for which the predicate is true'''
+      return [c for c in candidates if self.test(pred, c, dist)]
+
+def loadPrepared(inFeats):
+   '''Returns a list of PreparedGeoms, with ObjectIDs, for the input features (honoring any selection). The PreparedGeoms share a source tag unique to this call, so cached test results for one set of features are never returned for another set with the same ObjectIDs.'''
+   prepList = []
+   source = object()
+   with arcpy.da.SearchCursor(inFeats, ["OID@", "SHAPE@"]) as cursor:
+      for row in cursor:
+         if row[1] is not None:
+            prepList.append(PreparedGeom(row[1], row[0], source))
+   return prepList
+
+def oidWhere(inFeats, oids):
+   '''Returns a where clause selecting the features with the specified ObjectIDs. If the list is empty, the where clause selects nothing.'''
+   oidFld = arcpy.AddFieldDelimiters(inFeats, arcpy.Describe(inFeats).OIDFieldName)
+   if len(oids) == 0:
+      return "%s < 0" % oidFld
+   return "%s IN (%s)" % (oidFld, ",".join([str(int(o)) for o in oids]))
+
+def selectByOIDs(featLyr, oids):
+   '''Selects features in a feature layer by ObjectID'''
+   arcpy.SelectLayerByAttribute_management(featLyr, "NEW_SELECTION", oidWhere(featLyr, oids))
+   return featLyr
+
+def linearDistance(meas, sr):
+   '''Converts a distance, which may be a measurement string such as "100 METERS", to the linear units of the spatial reference. Numbers are assumed to be in the linear units already.'''
+   if type(meas) != str:
+      return float(meas)
+   num, units, meas = multiMeasure(meas, 1)
+   toMeters = {"METERS": 1.0, "METER": 1.0, "KILOMETERS": 1000.0, "FEET": 0.3048, "MILES": 1609.344}
+   units = units.upper()
+   if units not in toMeters:
+      return num
+   return num*toMeters[units]/sr.metersPerUnit
+
+def ClipToGeom(inFeats, clipGeom, outFeats):
+   '''Clips polygon features to a single geometry in memory, writing the (geometry-only) results to a new feature class. This replaces copying the geometry to a feature class for use with Clip or Intersect.'''
+   prep = PreparedGeom(clipGeom)
+   sr = arcpy.Describe(inFeats).spatialReference
+   outDir = os.path.dirname(outFeats)
+   outName = os.path.basename(outFeats)
+   if arcpy.Exists(outFeats):
+      arcpy.Delete_management(outFeats)
+   arcpy.CreateFeatureclass_management (outDir, outName, "POLYGON", "", "", "", sr)
+   with arcpy.da.SearchCursor(inFeats, ["SHAPE@"]) as inCursor:
+      with arcpy.da.InsertCursor(outFeats, ["SHAPE@"]) as outCursor:
+         for row in inCursor:
+            if row[0] is None or not prep.intersects(row[0]):
+               continue
+            part = row[0].intersection(clipGeom, 4)
+            if part is not None and part.area > 0:
+               outCursor.insertRow([part])
+   return outFeats
+
+### Bulk writing ###
+# Appending features to an output one at a time with Append_management is slow, because each call validates the schema and opens the target. BulkWriter keeps a single insert cursor open on the output instead, and writes rows in batches.
+class BulkWriter(object):
+   '''Buffered writer holding one open insert cursor on an output feature class. Rows are added as a geometry plus a dictionary of attributes (keyed by field name), or copied from other features with fields matched by name, as with Append_management using "NO_TEST". Rows are written in batches, optionally on a background thread so that geometry processing and writes can overlap. Use it in a "with" statement, or call close() when finished.
+   Parameters:
+   - outFeats = output feature class, which must already exist
+   - batchSize = number of rows to buffer before writing
+   - background = if True, rows are written on a background thread
+   '''
+   def __init__(self, outFeats, batchSize = 500, background = False):
+      self.outFeats = outFeats
+      self.batchSize = batchSize
+      self.background = background
+      self.flds = attributeFields(outFeats)
+      self.fldIndex = dict([(f.upper(), i + 1) for i, f in enumerate(self.flds)])
+      self.batch = []
+      self.count = 0
+      self.error = None
+      if background:
+         self.queue = Queue.Queue(maxsize = 4)
+         self.thread = threading.Thread(target = self.worker)
+         self.thread.daemon = True
+         self.thread.start()
+      else:
+         self.cursor = arcpy.da.InsertCursor(outFeats, ["SHAPE@"] + self.flds)
+   
+   def __enter__(self):
+      return self
+      
+   def __exit__(self, excType, excValue, tb):
+      self.close()
+      return False
+   
+   def worker(self):
+      '''Writes batches from the queue until it receives None. The cursor is opened in this thread.'''
+      try:
+         with arcpy.da.InsertCursor(self.outFeats, ["SHAPE@"] + self.flds) as cursor:
+            while True:
+               rows = self.queue.get()
+               if rows is None:
+                  break
+               for row in rows:
+                  cursor.insertRow(row)
+      except Exception as e:
+         self.error = e
+         # Keep draining the queue so the main thread does not block
+         while self.queue.get() is not None:
+            pass
+   
+   def add(self, geom, attrDict = None):
+      '''Adds a row. Attributes for fields not in the output are ignored; fields without attributes are set to null.'''
+      row = [geom] + [None]*len(self.flds)
+      if attrDict:
+         for k, v in attrDict.items():
+            i = self.fldIndex.get(k.upper())
+            if i is not None:
+               row[i] = v
+      self.batch.append(row)
+      self.count += 1
+      if len(self.batch) >= self.batchSize:
+         self.flush()
+   
+   def addFeats(self, inFeats, attrDict = None):
+      '''Adds all the features (honoring any selection) from the input features, matching fields by name. Values in attrDict, if supplied, override the input attributes.'''
+      inFlds = [f for f in attributeFields(inFeats) if f.upper() in self.fldIndex]
+      with arcpy.da.SearchCursor(inFeats, ["SHAPE@"] + inFlds) as cursor:
+         for row in cursor:
+            attrs = dict(zip(inFlds, row[1:]))
+            if attrDict:
+               attrs.update(attrDict)
+            self.add(row[0], attrs)
+   
+   def flush(self):
+      '''Writes any buffered rows'''
+      if self.error is not None:
+         raise self.error
+      if not self.batch:
+         return
+      rows = self.batch
+      self.batch = []
+      if self.background:
+         self.queue.put(rows)
+      else:
+         for row in rows:
+            self.cursor.insertRow(row)
+   
+   def close(self):
+      '''Writes any buffered rows and releases the insert cursor'''
+      try:
+         self.flush()
+      finally:
+         if self.background:
+            if self.thread.is_alive():
+               self.queue.put(None)
+               self.thread.join()
+         elif hasattr(self, "cursor"):
+            del self.cursor
+      if self.error is not None:
+         raise self.error
+      return self.count
+
+def readColumns(inTab, flds, where = None):
+   '''Reads fields from a table into a dictionary of columns keyed by field name, plus the ObjectIDs under the key "OID@". Numeric columns are returned as float arrays, with nulls as NaN; other columns are returned as lists.'''
+   with arcpy.da.SearchCursor(inTab, ["OID@"] + flds, where) as cursor:
+      rows = [row for row in cursor]
+   cols = {"OID@": [row[0] for row in rows]}
+   for (i, f) in enumerate(flds):
+      vals = [row[i + 1] for row in rows]
+      if all([v is None or isinstance(v, (int, long, float)) for v in vals]):
+         cols[f] = numpy.array([numpy.nan if v is None else v for v in vals], dtype = numpy.float64)
+      else:
+         cols[f] = vals
+   return cols
+
+def writeColumns(inTab, oids, cols):
+   '''Writes columns of values (a dictionary keyed by field name) to a table in a single update pass, matching rows by ObjectID. NaN values are written as nulls.'''
+   flds = list(cols.keys())
+   valDict = dict()
+   for (k, oid) in enumerate(oids):
+      vals = []
+      for f in flds:
+         v = cols[f][k]
+         if isinstance(v, numpy.generic):
+            v = v.item()
+         if isinstance(v, float) and v != v:
+            v = None
+         vals.append(v)
+      valDict[oid] = vals
+   with arcpy.da.UpdateCursor(inTab, ["OID@"] + flds) as cursor:
+      for row in cursor:
+         if row[0] in valDict:
+            cursor.updateRow([row[0]] + valDict[row[0]])
+   return inTab
+
+### Table joins ###
+# JoinField is slow on file geodatabase tables, and needs key fields of the same type (e.g. EO_ID stored as a number in one table and as text in another). Instead, keyed tables are loaded into dictionaries once, keys are normalized so that numeric and text keys match, and the joined columns are written with writeColumns.
+fieldTypes = {"String": "TEXT", "Integer": "LONG", "SmallInteger": "SHORT", "Double": "DOUBLE", "Single": "FLOAT", "Date": "DATE"}
+
+def normKey(v):
+   '''Normalizes a join key, so that the same key stored as an integer, a whole float, or text (e.g. 1234, 1234.0, u"1234 ") matches. Returns None for nulls.'''
+   if v is None:
+      return None
+   if isinstance(v, float):
+      if v != v:
+         return None
+      if v == int(v):
+         v = int(v)
+   return ("%s" % v).strip()
+
+def loadKeyed(inTab, fldKey, flds, where = None):
+   '''Loads fields from a table into a dictionary relating normalized key values to tuples of field values. As with JoinField, the first record is used where a key is repeated, and records with a null key are ignored.'''
+   keyDict = {}
+   with arcpy.da.SearchCursor(inTab, [fldKey] + flds, where) as cursor:
+      for row in cursor:
+         k = normKey(row[0])
+         if k is not None and k not in keyDict:
+            keyDict[k] = tuple(row[1:])
+   return keyDict
+
+def addFieldsLike(inTab, templateTab, flds):
+   '''Adds fields to a table, with the same types and lengths as the fields of the same names in a template table (as JoinField would).'''
+   for fld in flds:
+      f = arcpy.ListFields(templateTab, fld)[0]
+      arcpy.AddField_management(inTab, fld, fieldTypes.get(f.type, "TEXT"), "", "", f.length if f.type == "String" else "")
+
+### Spatial pairs ###
+# Loops that select the features of one layer intersecting each feature of another (SelectLayerByLocation per feature) can be replaced by a single indexed spatial join listing all intersecting pairs, followed by grouped statistics over the pair list.
+def SpatialPairs(inFeats, joinFeats, scratchGDB = "in_memory"):
+   '''Finds all pairs of intersecting features in two feature classes (or layers, honoring any selection) with a single one-to-many spatial join. Returns a tuple (inOIDs, joinOIDs) of integer arrays, with one entry per intersecting pair.'''
+   pairFeats = scratchGDB + os.sep + 'pairFeats'
+   # Empty field mappings, so only the ObjectIDs of the pairs are written
+   arcpy.SpatialJoin_analysis(inFeats, joinFeats, pairFeats, "JOIN_ONE_TO_MANY", "KEEP_COMMON", arcpy.FieldMappings(), "INTERSECT")
+   arr = arcpy.da.TableToNumPyArray(pairFeats, ["TARGET_FID", "JOIN_FID"])
+   arcpy.Delete_management(pairFeats)
+   return (arr["TARGET_FID"].astype(numpy.int64), arr["JOIN_FID"].astype(numpy.int64))
+
+def oidPositions(oids, pairOIDs):
+   '''Converts ObjectIDs (e.g. from SpatialPairs) to positions in a list of ObjectIDs (e.g. the "OID@" column from readColumns), so that pair values can be gathered from and scattered to columns with array indexing. Returns an integer array; ObjectIDs not in the list are given -1.'''
+   oids = numpy.asarray(oids, dtype = numpy.int64)
+   pairOIDs = numpy.asarray(pairOIDs, dtype = numpy.int64)
+   if len(oids) == 0:
+      return -numpy.ones(len(pairOIDs), dtype = numpy.int64)
+   order = numpy.argsort(oids)
+   pos = numpy.minimum(numpy.searchsorted(oids[order], pairOIDs), len(oids) - 1)
+   return numpy.where(oids[order][pos] == pairOIDs, order[pos], -1)
+
+def SortKeepOIDs(inFeats, outFeats, sort_fields, fld_Key = "SORT_KEY"):
+   '''Sorts features with the Sort tool, and returns a dictionary relating the ObjectIDs of the input features to the ObjectIDs of the sorted output. A temporary key field is added to the input to carry the ObjectIDs through the sort, and removed afterwards.'''
+   oids = readColumns(inFeats, [])["OID@"]
+   arcpy.AddField_management(inFeats, fld_Key, "LONG")
+   writeColumns(inFeats, oids, {fld_Key: oids})
+   arcpy.Sort_management(inFeats, outFeats, sort_fields)
+   outCols = readColumns(outFeats, [fld_Key])
+   for fc in [inFeats, outFeats]:
+      arcpy.DeleteField_management(fc, fld_Key)
+   return dict([(int(k), oid) for (k, oid) in zip(outCols[fld_Key], outCols["OID@"])])
+
+def groupStats(keys, vals, stats = ["SUM", "MAX"]):
+   '''Summarizes values by group key in one pass. Returns a tuple (groups, results): the sorted unique keys, and a dictionary of arrays (one value per key) for each statistic ("COUNT", "SUM", "MIN", "MAX"). NaN values are ignored, as nulls are in Summary Statistics.'''
+   keys = numpy.asarray(keys)
+   vals = numpy.asarray(vals, dtype = numpy.float64)
+   ok = ~numpy.isnan(vals)
+   (groups, inv) = numpy.unique(keys, return_inverse = True)
+   n = len(groups)
+   results = {}
+   for stat in stats:
+      if stat == "COUNT":
+         results[stat] = numpy.bincount(inv[ok], minlength = n).astype(numpy.float64)
+      elif stat == "SUM":
+         results[stat] = numpy.bincount(inv[ok], weights = vals[ok], minlength = n)
+      elif stat in ("MIN", "MAX"):
+         # Sort the values by group, and reduce each run (ufunc.at needs NumPy 1.8)
+         ufunc = numpy.minimum if stat == "MIN" else numpy.maximum
+         r = numpy.ones(n)*numpy.nan
+         g = inv[ok]
+         if len(g) > 0:
+            srt = numpy.argsort(g, kind = 'mergesort')
+            g = g[srt]
+            starts = numpy.flatnonzero(numpy.concatenate([[True], g[1:] != g[:-1]]))
+            r[g[starts]] = ufunc.reduceat(vals[ok][srt], starts)
+         results[stat] = r
+      else:
+         raise ValueError("Invalid statistic: %s" % stat)
+   return (groups, results)
+
+### Buffer method selection ###
+# Geodesic buffers are much slower than planar buffers, and in a conformal projection such as NAD83 Virginia Lambert they gain almost nothing at the distances used here. With the "AUTO" buffer method, the scale distortion of the projection is measured over the data extent, and planar buffering is used if the distortion is within tolerance. Measurements are cached by spatial reference and (rounded) extent.
+distortionCache = {}
+
+def measureDistortion(inFeats, nSamples = 5):
+   '''Returns the maximum relative scale distortion of the coordinate system of the input features, over the extent of the input features. This is measured by comparing the planar and geodesic lengths of short east-west and north-south lines at a grid of sample points across the extent. Returns None if the coordinate system is not projected.
+   Parameters:
+   - inFeats = input features
+   - nSamples = number of sample points along each axis of the extent
+   '''
+   desc = arcpy.Describe(inFeats)
+   sr = desc.spatialReference
+   if sr.type != "Projected":
+      return None
+   ext = desc.extent
+   key = (sr.name, round(ext.XMin, -3), round(ext.YMin, -3), round(ext.XMax, -3), round(ext.YMax, -3))
+   if key in distortionCache:
+      return distortionCache[key]
+   
+   # Sample lines are 1 km long, in the units of the coordinate system
+   sampLen = 1000.0/sr.metersPerUnit
+   maxDist = 0.0
+   for i in range(nSamples):
+      x = ext.XMin + (ext.XMax - ext.XMin)*i/(nSamples - 1)
+      for j in range(nSamples):
+         y = ext.YMin + (ext.YMax - ext.YMin)*j/(nSamples - 1)
+         for (dx, dy) in [(sampLen, 0), (0, sampLen)]:
+            arr = arcpy.Array([arcpy.Point(x, y), arcpy.Point(x + dx, y + dy)])
+            line = arcpy.Polyline(arr, sr)
+            geoLen = line.getLength("GEODESIC", "METERS")
+            if geoLen > 0:
+               maxDist = max(maxDist, abs(1000.0 - geoLen)/geoLen)
+   printMsg('Maximum scale distortion of %s over data extent is %.6f' % (sr.name, maxDist))
+   distortionCache[key] = maxDist
+   return maxDist
+
+def getBufferMethod(inFeats, method = "AUTO", tolerance = 0.001):
+   '''Returns the buffer method ("PLANAR" or "GEODESIC") to use for the input features. If the method is "AUTO", planar is chosen if the scale distortion of the projection over the data extent is within tolerance; otherwise geodesic is chosen. Features in a geographic coordinate system always get geodesic buffers.
+   Parameters:
+   - inFeats = input features
+   - method = "PLANAR", "GEODESIC", or "AUTO"
+   - tolerance = maximum acceptable relative scale distortion for planar buffers (e.g., 0.001 allows an error of 1 meter for a 1000-meter buffer)
+   '''
+   method = method.upper()
+   if method != "AUTO":
+      return method
+   distortion = measureDistortion(inFeats)
+   if distortion is not None and distortion <= tolerance:
+      return "PLANAR"
+   else:
+      return "GEODESIC"
+
+def arcTolerance(dist, arcSegs):
+   '''Returns the generalization tolerance that reduces a buffer arc of the specified radius to approximately the specified number of segments per quarter circle. This is the maximum gap between the arc and a chord spanning 1/arcSegs of a quarter circle.
+   Parameters:
+   - dist = buffer distance, either a number or a measurement string such as "100 METERS"
+   - arcSegs = number of segments per quarter circle
+   '''
+   if type(dist) == str:
+      num, units, meas = multiMeasure(dist, 1)
+   else:
+      num, units = dist, ""
+   tol = abs(num)*(1 - math.cos(math.pi/(4*arcSegs)))
+   return ("%s %s" % (tol, units)).strip()
+
+def BufferFeats(inFeats, outFeats, dist, dissolve = "NONE", method = "PLANAR", arcSegs = None, tolerance = 0.001):
+   '''Buffers features, reusing a memoized result if one is available. Note that memoized results carry geometry only, not attributes.
+   Parameters:
+   - inFeats = input features
+   - outFeats = output buffered features
+   - dist = buffer distance
+   - dissolve = dissolve option for the buffer tool
+   - method = "PLANAR", "GEODESIC", or "AUTO" (see getBufferMethod)
+   - arcSegs = optional number of segments per quarter circle. If set, the whole buffer output is generalized (Douglas-Peucker, with Generalize) at the tolerance that reduces buffer arcs to approximately that resolution, trading vertex count for speed in subsequent steps. This is not a segment count: straight edges and other detail within the tolerance are simplified too, and arcs end up with roughly, not exactly, arcSegs segments. If None, the output is left as produced by the buffer tool.
+   - tolerance = maximum acceptable scale distortion for the "AUTO" method
+   '''
+   method = getBufferMethod(inFeats, method, tolerance)
+   (hit, memoKey) = memoFetch("BUFFER", inFeats, [dist, dissolve, method, arcSegs], outFeats)
+   if not hit:
+      arcpy.Buffer_analysis(inFeats, outFeats, dist, "FULL", "ROUND", dissolve, "", method)
+      if arcSegs:
+         arcpy.Generalize_edit(outFeats, arcTolerance(dist, arcSegs))
+      memoStore(memoKey, outFeats)
+   return outFeats
+
+def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory", buffMethod = "GEODESIC", arcSegs = None, buffTol = 0.001):
+   '''If a positive number is entered for the dilation distance, features are expanded outward by the specified distance, then shrunk back in by the same distance. This causes nearby features to coalesce. If a negative number is entered for the dilation distance, features are first shrunk, then expanded. This eliminates narrow portions of existing features, thereby simplifying them. It can also break narrow "bridges" between features that were formerly coalesced.
+   
+   Buffers are planar or geodesic depending on buffMethod (geodesic by default, as before this option was added); with "AUTO", planar buffers are used if the projection's scale distortion over the data extent is within buffTol. If arcSegs is set, each buffer output is generalized at the tolerance that reduces arcs to approximately that many segments per quarter circle. See BufferFeats.'''
    
    # If it's a string, parse dilation distance and get the negative
    if type(dilDist) == str:
@@ -218,6 +1003,12 @@ def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
       arcpy.AddError("You need to enter a non-zero value for the dilation distance")
       raise arcpy.ExecuteError   
 
+   # Reuse memoized result, if available
+   buffMethod = getBufferMethod(inFeats, buffMethod, buffTol)
+   (hit, memoKey) = memoFetch("COALESCE", inFeats, [meas, buffMethod, arcSegs], outFeats)
+   if hit:
+      return outFeats
+
    # Set parameters. Dissolve parameter depends on dilation distance.
    if origDist > 0:
       dissolve1 = "ALL"
@@ -228,7 +1019,7 @@ def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
 
    # Process: Buffer
    Buff1 = scratchGDB + os.sep + "Buff1"
-   arcpy.Buffer_analysis(inFeats, Buff1, meas, "FULL", "ROUND", dissolve1, "", "GEODESIC")
+   BufferFeats(inFeats, Buff1, meas, dissolve1, buffMethod, arcSegs)
 
    # Process: Clean Features
    Clean_Buff1 = scratchGDB + os.sep + "CleanBuff1"
@@ -245,10 +1036,11 @@ def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
 
    # Process: Buffer
    Buff2 = scratchGDB + os.sep + "NegativeBuffer"
-   arcpy.Buffer_analysis(Clean_Buff1_ng, Buff2, negMeas, "FULL", "ROUND", dissolve2, "", "GEODESIC")
+   BufferFeats(Clean_Buff1_ng, Buff2, negMeas, dissolve2, buffMethod, arcSegs)
 
    # Process: Clean Features to get final dilated features
    CleanFeatures(Buff2, outFeats)
+   memoStore(memoKey, outFeats)
       
    # Cleanup
    if scratchGDB == "in_memory":
@@ -256,7 +1048,8 @@ def Coalesce(inFeats, dilDist, outFeats, scratchGDB = "in_memory"):
       
    return outFeats
    
-def ShrinkWrap(inFeats, dilDist, outFeats, smthMulti = 8, scratchGDB = "in_memory"):
+def ShrinkWrap(inFeats, dilDist, outFeats, smthMulti = 8, scratchGDB = "in_memory", buffMethod = "GEODESIC", arcSegs = None, buffTol = 0.001):
+   # The buffMethod, arcSegs and buffTol parameters are passed to the smoothing (Coalesce) steps; see Coalesce.
    # Parse dilation distance, and increase it to get smoothing distance
    smthMulti = float(smthMulti)
    origDist, units, meas = multiMeasure(dilDist, 1)
@@ -267,6 +1060,13 @@ def ShrinkWrap(inFeats, dilDist, outFeats, smthMulti = 8, scratchGDB = "in_memor
       arcpy.AddError("You need to enter a positive, non-zero value for the dilation distance")
       raise arcpy.ExecuteError   
 
+   # Reuse memoized result, if available
+   buffMethod = getBufferMethod(inFeats, buffMethod, buffTol)
+   (hit, memoKey) = memoFetch("SHRINKWRAP", inFeats, [meas, smthMulti, buffMethod, arcSegs], outFeats)
+   if hit:
+      arcpy.AddMessage('Shrinkwrapping: reusing memoized result')
+      return outFeats
+
    #tmpWorkspace = arcpy.env.scratchGDB
    #arcpy.AddMessage("Additional critical temporary products will be stored here: %s" % tmpWorkspace)
    
@@ -304,7 +1104,7 @@ def ShrinkWrap(inFeats, dilDist, outFeats, smthMulti = 8, scratchGDB = "in_memor
    #arcpy.AddMessage("Buffering features...")
    #buffFeats = tmpWorkspace + os.sep + "buffFeats"
    buffFeats = scratchGDB + os.sep + "buffFeats"
-   arcpy.Buffer_analysis (dissFeats, buffFeats, meas, "", "", "ALL")
+   BufferFeats(dissFeats, buffFeats, meas, "ALL")
    trashList.append(buffFeats)
 
    # Process:  Explode Multiparts
@@ -321,7 +1121,7 @@ def ShrinkWrap(inFeats, dilDist, outFeats, smthMulti = 8, scratchGDB = "in_memor
 
    # Loop through the exploded buffer features
    counter = 1
-   with arcpy.da.SearchCursor(explFeats, ["SHAPE@"]) as myFeats:
+   with BulkWriter(outFeats) as outWriter, arcpy.da.SearchCursor(explFeats, ["SHAPE@"]) as myFeats:
       for Feat in myFeats:
          arcpy.AddMessage('Working on shrink feature %s' % str(counter))
          featSHP = Feat[0]
@@ -341,14 +1141,14 @@ def ShrinkWrap(inFeats, dilDist, outFeats, smthMulti = 8, scratchGDB = "in_memor
          
          # Process:  Coalesce features (expand)
          coalFeats = scratchGDB + os.sep + 'coalFeats'
-         Coalesce("dissFeatsLyr", smthMeas, coalFeats, scratchGDB)
+         Coalesce("dissFeatsLyr", smthMeas, coalFeats, scratchGDB, buffMethod, arcSegs)
          # Increasing the dilation distance improves smoothing and reduces the "dumbbell" effect. However, it can also cause some wonkiness which needs to be corrected in the next steps.
          trashList.append(coalFeats)
          
          # Merge coalesced feature with original features, and coalesce again.
          mergeFeats = scratchGDB + os.sep + 'mergeFeats'
          arcpy.Merge_management([coalFeats, "dissFeatsLyr"], mergeFeats, "")
-         Coalesce(mergeFeats, "5 METERS", coalFeats, scratchGDB)
+         Coalesce(mergeFeats, "5 METERS", coalFeats, scratchGDB, buffMethod, arcSegs)
          
          # Eliminate gaps
          noGapFeats = scratchGDB + os.sep + "noGapFeats"
@@ -356,11 +1156,13 @@ def ShrinkWrap(inFeats, dilDist, outFeats, smthMulti = 8, scratchGDB = "in_memor
          
          # Process:  Append the final geometry to the ShrinkWrap feature class
          arcpy.AddMessage("Appending feature...")
-         arcpy.Append_management(noGapFeats, outFeats, "NO_TEST", "", "")
+         outWriter.addFeats(noGapFeats)
          
          counter +=1
          del Feat
 
+   memoStore(memoKey, outFeats)
+
    # Cleanup
    if scratchGDB == "in_memory":
       garbagePickup(trashList)
@@ -2,7 +2,7 @@
 # EssentialConSites.py
 # Version:  ArcGIS 10.3 / Python 2.7
 # Creation Date: 2018-02-21
-# Last Edit: 2019-06-28
+# Last Edit: 2026-10-19
 # Creator:  Kirsten R. Hazler and Roy Gilb
 # ---------------------------------------------------------------------------
 
@@ -13,171 +13,187 @@ from Helper import *
 arcpy.env.overwriteOutput = True
 
 ### HELPER FUNCTIONS ###
-def TabulateBMI(procEOs, conslands, bmiValue, fldName):
-   '''A helper function called by the AttributeEOs function; tabulates the percentage of each EO covered by conservation lands with specified BMI value.
+def TabulateLandClasses(procEOs, classLands, fldZone = "EO_ID"):
+   '''A helper function called by the AttributeEOs function; tabulates the percentage of each EO covered by several classes of conservation lands with a single overlay. The subsets of conservation lands are merged into one feature class with a LANDCLASS field, and intersected with the EOs once. Returns a dictionary relating each class to a dictionary of percentages by EO (keyed by the normalized zone field value); EOs not intersecting a class are omitted.
    Parameters:
    - procEOs: Feature class with processed EOs
-   - conslands: Feature class with conservation lands, flattened by BMI level
-   - bmiValue: The value of BMI used to select subset of conservation lands
-   - fldName: The output field name to be used to store percent of EO covered by selected conservation lands
+   - classLands: List of tuples (conslands, where_clause, classValue), each giving a feature class of conservation lands, the where clause selecting the subset of interest, and the class value to assign to it
+   - fldZone: The field identifying EOs
    '''
    scratchGDB = arcpy.env.scratchGDB
-   printMsg("Tabulating intersection of EOs with conservation lands of specified BMI...")
-   where_clause = '"BMI" = \'%s\'' %bmiValue
-   arcpy.MakeFeatureLayer_management (conslands, "lyr_bmi", where_clause)
-   TabInter_bmi = scratchGDB + os.sep + "TabInter_bmi"
-   arcpy.TabulateIntersection_analysis(procEOs, "EO_ID", "lyr_bmi", TabInter_bmi)
-   arcpy.AddField_management(TabInter_bmi, fldName, "DOUBLE")
-   arcpy.CalculateField_management(TabInter_bmi, fldName, "!PERCENTAGE!", "PYTHON")
-   arcpy.JoinField_management(procEOs, "EO_ID", TabInter_bmi, "EO_ID", fldName)
+   printMsg("Tabulating intersection of EOs with conservation land classes...")
+   classFeats = []
+   for (i, (conslands, where_clause, classValue)) in enumerate(classLands):
+      tmpLands = "in_memory" + os.sep + "tmpLands%s" % i
+      arcpy.Select_analysis(conslands, tmpLands, where_clause)
+      arcpy.AddField_management(tmpLands, "LANDCLASS", "TEXT", "", "", 10)
+      arcpy.CalculateField_management(tmpLands, "LANDCLASS", "'%s'" % classValue, "PYTHON")
+      classFeats.append(tmpLands)
+   mergeLands = "in_memory" + os.sep + "mergeLands"
+   arcpy.Merge_management(classFeats, mergeLands)
+   TabInter = scratchGDB + os.sep + "TabInter_lands"
+   arcpy.TabulateIntersection_analysis(procEOs, fldZone, mergeLands, TabInter, "LANDCLASS")
+   
+   pctDict = dict([(classValue, {}) for (conslands, where_clause, classValue) in classLands])
+   with arcpy.da.SearchCursor(TabInter, [fldZone, "LANDCLASS", "PERCENTAGE"]) as cursor:
+      for row in cursor:
+         pctDict[row[1]][normKey(row[0])] = row[2]
+   garbagePickup(classFeats + [mergeLands])
+   return pctDict
 
-def addRanks(table, sort_field, order = 'ASCENDING', rank_field='RANK', thresh = 5, threshtype = 'ABS', rounding = None):
-   '''A helper function called by ScoreEOs and BuildPortfolio functions; ranks records by one specified sorting field.
+def rankValues(vals, groups = None, order = 'ASCENDING', thresh = 5, threshtype = 'ABS', rounding = None):
+   '''A helper function called by ScoreEOs and BuildPortfolio; ranks an array of values within groups, all groups at once. Within each group, distinct values are sorted, and the rank increases each time a value differs from the value that started the current rank by more than the threshold. Returns an array of ranks, with NaN where values are null.
    Parameters:
-   - table: the input table to which ranks will be added
-   - sort_field: the input field on which ranks will be based
+   - vals: array of values to rank, with NaN for nulls
+   - groups: optional sequence of group keys (e.g. ELCODE), one per value. If None, all values are ranked together.
    - order: controls the sorting order. Assumes ascending order unless "DESC" or "DESCENDING" is entered.
-   - rank_field: the name of the new field that will be created to contain the ranks
    - thresh: the amount by which sorted values must differ to be ranked differently. 
    - threshtype: determines whether the threshold is an absolute value ("ABS") or a percentage ("PER")
    - rounding: determines whether sorted values are to be rounded prior to ranking, and by how much. Must be an integer or None. With rounding = 2, 1234.5678 and 1234.5690 are treated as the equivalent number for ranking purposes. With rounding = -1, 11 and 12 are treated as equivalents for ranking.
    '''
-   valList = unique_values(table, sort_field)
+   vals = numpy.asarray(vals, dtype = numpy.float64)
+   ranks = numpy.ones(len(vals))*numpy.nan
    if rounding <> None:
-      valList = [round(val, rounding) for val in valList]
+      # Round each distinct value with the builtin round (half away from zero), as numpy.round rounds half to even
+      (u, inv) = numpy.unique(vals, return_inverse = True)
+      vals = numpy.array([round(v, rounding) for v in u.tolist()], dtype = numpy.float64)[inv]
+   if groups is None:
+      gid = numpy.zeros(len(vals), dtype = numpy.int64)
+   else:
+      keys = {}
+      gid = numpy.array([keys.setdefault(g, len(keys)) for g in groups], dtype = numpy.int64)
+   valid = numpy.flatnonzero(~numpy.isnan(vals))
+   if len(valid) == 0:
+      return ranks
+   
+   # Sort distinct values within groups, in ranking order
    if order == "DESC" or order == "DESCENDING":
-      valList.reverse()
-   printMsg('Values in order are: %s' % str(valList))
-   rankDict = {}
-   rank = 1
-   sortVal = valList[0]
-   
-   #printMsg('Setting up ranking dictionary...')
-   for v in valList:
-      if threshtype == "PER":
-         diff = 100*abs(v - sortVal)/sortVal
-      else:
-         diff = abs(v-sortVal)
-      if diff > thresh:
-         #printMsg('Difference is greater than threshold, so updating values.')
-         sortVal = v
-         rank += 1
-      else:
-         #printMsg('Difference is less than or equal to threshold, so maintaining values.')
-         pass
-      rankDict[v] = rank
-   printMsg('Ranking dictionary (value:rank) is as follows: %s' %str(rankDict))
-   
-   #printMsg('Writing ranks to table...')
-   if not arcpy.ListFields(table, rank_field):
-      arcpy.AddField_management(table, rank_field, "SHORT")
-   codeblock = '''def rankVals(val, rankDict, rounding):
-      if rounding <> None:
-         val = round(val,rounding)
-      rank = rankDict[val]
-      return rank'''
-   expression = "rankVals(!%s!, %s, %s)" %(sort_field, rankDict, rounding)
-   arcpy.CalculateField_management(table, rank_field, expression, "PYTHON_9.3", codeblock)
-   #printMsg('Finished ranking.')
-   return
-      
-def updateTiers(in_procEOs, elcode, availSlots, rankFld):
-   '''A helper function called by ScoreEOs. Updates tier levels, specifically bumping "Choice" records up to "Priority" or down to "Surplus".
-   Parameters:
-   - in_procEOs: input processed EOs (i.e., out_procEOs from the AttributeEOs function)
-   - elcode: the element code to be processed
-   - availSlots: available slots remaining to be filled in the EO portfolio
-   - rankFld: the ranking field used to determine which record(s) should fill the available slots
-   '''
-   r = 1
-   while availSlots > 0:
-      where_clause1 = '"ELCODE" = \'%s\' AND "TIER" = \'Choice\' AND "%s" <= %s' %(elcode, rankFld, str(r))
-      where_clause2 = '"ELCODE" = \'%s\' AND "TIER" = \'Choice\' AND "%s" > %s' %(elcode, rankFld, str(r))
-      arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_choiceEO", where_clause1)
-      c = countFeatures("lyr_choiceEO")
-      #printMsg('Current rank: %s' % str(r))
-      #printMsg('Available slots: %s' % str(availSlots))
-      #printMsg('Features counted: %s' % str(c))
-      if c == 0:
-         #print "Nothing to work with here. Moving on."
-         break
-      elif c < availSlots:
-         #printMsg('Filling some slots')
-         arcpy.CalculateField_management("lyr_choiceEO", "TIER", "'Priority'", "PYTHON")
-         availSlots -= c
-         r += 1
-      elif c == availSlots:
-         #printMsg('Filling all slots')
-         arcpy.CalculateField_management("lyr_choiceEO", "TIER", "'Priority'", "PYTHON")
-         arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_surplusEO", where_clause2)
-         arcpy.CalculateField_management("lyr_surplusEO", "TIER", "'Surplus'", "PYTHON")
-         availSlots -= c
-         break
-      else:
-         #printMsg('Unable to differentiate; moving on to next criteria.')
-         arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_surplusEO", where_clause2)
-         arcpy.CalculateField_management("lyr_surplusEO", "TIER", "'Surplus'", "PYTHON")
-         break
-   return availSlots
+      w = -vals[valid]
+   else:
+      w = vals[valid]
+   srt = numpy.lexsort((w, gid[valid]))
+   (g, w) = (gid[valid][srt], w[srt])
+   new = numpy.concatenate([[True], (g[1:] != g[:-1]) | (w[1:] != w[:-1])])
+   uid = numpy.cumsum(new) - 1
+   ug = g[new]
+   uv = vals[valid][srt][new]
+   n = len(uv)
+   groupStart = numpy.flatnonzero(numpy.concatenate([[True], ug[1:] != ug[:-1]]))
+   groupEnd = numpy.concatenate([groupStart[1:], [n]])
+   
+   # Find the values starting each rank, for all groups at once. Differences from the value starting a rank only grow along the sorted values, so the next one is found by a binary search.
+   isStart = numpy.zeros(n, dtype = bool)
+   anchor = groupStart.copy()
+   end = groupEnd.copy()
+   while len(anchor) > 0:
+      isStart[anchor] = True
+      a = uv[anchor]
+      (lo, hi) = (anchor + 1, end.copy())
+      while True:
+         active = lo < hi
+         if not active.any():
+            break
+         mid = (lo + hi)//2
+         m = numpy.minimum(mid, n - 1)
+         with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            if threshtype == "PER":
+               diff = 100*numpy.abs(uv[m] - a)/a
+            else:
+               diff = numpy.abs(uv[m] - a)
+         over = diff > thresh
+         hi = numpy.where(active & over, mid, hi)
+         lo = numpy.where(active & ~over, mid + 1, lo)
+      more = lo < end
+      anchor = lo[more]
+      end = end[more]
+   
+   # Number the ranks within each group
+   cum = numpy.cumsum(isStart)
+   uRank = cum - cum[groupStart][numpy.repeat(numpy.arange(len(groupStart)), groupEnd - groupStart)] + 1
+   ranks[valid[srt]] = uRank[uid]
+   return ranks
 
-def updateSlots(in_procEOs, elcode, availSlots, rankFld):
-   '''A helper function called by BuildPortfolio. Updates portfolio status for EOs, specifically adding records to the portfolio.
+def allocateSlots(groups, ranks, slotDict):
+   '''A helper function called by ScoreEOs and BuildPortfolio; fills the available slots for each group (e.g. ELCODE) in rank order, all groups in one pass. Within a group, records are taken rank by rank while they fit in the remaining slots. If the records of one rank would more than fill the remaining slots, the tie cannot be broken, so they are left as they are, and only records of lower priority (higher rank) are excluded. If the slots are filled exactly, the records of lower priority are also excluded. Taking stops at a missing rank. Returns a tuple (status, remaining): an array with 1 for records filling slots, -1 for records excluded, and 0 for records left as they are; and a dictionary of slots remaining per group.
    Parameters:
-   - in_procEOs: input processed EOs (i.e., out_procEOs from the AttributeEOs function, further processed by the ScoreEOs function)
-   - elcode: the element code to be processed
-   - availSlots: available slots remaining to be filled in the EO portfolio
-   - rankFld: the ranking field used to determine which record(s) should fill the available slots
+   - groups: sequence of group keys, one per record
+   - ranks: array of ranks, with NaN for nulls (never taken or excluded)
+   - slotDict: dictionary of available slots per group; groups not in the dictionary have none
    '''
-   r = 1
-   while availSlots > 0:
-      where_clause1 = '"ELCODE" = \'%s\' AND "TIER" = \'Choice\' AND "PORTFOLIO" = 0 AND "%s" <= %s' %(elcode, rankFld, str(r))
-      where_clause2 = '"ELCODE" = \'%s\' AND "TIER" = \'Choice\' AND "PORTFOLIO" = 0 AND "%s" > %s' %(elcode, rankFld, str(r))
-      arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_choiceEO", where_clause1)
-      c = countFeatures("lyr_choiceEO")
-      #printMsg('Current rank: %s' % str(r))
-      #printMsg('Available slots: %s' % str(availSlots))
-      #printMsg('Features counted: %s' % str(c))
-      if c == 0:
-         #print "Nothing to work with here. Moving on."
-         break
-      elif c < availSlots:
-         #printMsg('Filling some slots')
-         arcpy.CalculateField_management("lyr_choiceEO", "PORTFOLIO", "1", "PYTHON")
-         availSlots -= c
-         r += 1
-      elif c == availSlots:
-         #printMsg('Filling all slots')
-         arcpy.CalculateField_management("lyr_choiceEO", "PORTFOLIO", "1", "PYTHON")
-         availSlots -= c
-         break
-      else:
-         #printMsg('Unable to differentiate; moving on to next criteria.')
-         break
-   return availSlots
+   ranks = numpy.asarray(ranks, dtype = numpy.float64)
+   status = numpy.zeros(len(ranks), dtype = numpy.int8)
+   remaining = dict(slotDict)
+   keys = {}
+   gid = numpy.array([keys.setdefault(g, len(keys)) for g in groups], dtype = numpy.int64)
+   gSlots = numpy.zeros(len(keys))
+   for (g, k) in keys.items():
+      gSlots[k] = slotDict.get(g, 0)
+   valid = numpy.flatnonzero(~numpy.isnan(ranks) & (gSlots[gid] > 0))
+   if len(valid) == 0:
+      return (status, remaining)
+   
+   # Count records per rank within groups
+   srt = numpy.lexsort((ranks[valid], gid[valid]))
+   (g, r) = (gid[valid][srt], ranks[valid][srt])
+   new = numpy.concatenate([[True], (g[1:] != g[:-1]) | (r[1:] != r[:-1])])
+   uid = numpy.cumsum(new) - 1
+   (ug, ur) = (g[new], r[new])
+   cnt = numpy.bincount(uid)
+   groupStart = numpy.flatnonzero(numpy.concatenate([[True], ug[1:] != ug[:-1]]))
+   groupLen = numpy.diff(numpy.concatenate([groupStart, [len(ug)]]))
+   first = numpy.repeat(groupStart, groupLen)
+   def groupCumsum(x):
+      c = numpy.cumsum(x)
+      return c - (c[first] - x[first])
+   
+   # Ranks are taken in sequence from 1, stopping at the first missing rank
+   pos = numpy.arange(len(ug)) - first
+   inSeq = groupCumsum((ur != pos + 1).astype(numpy.int64)) == 0
+   taken = groupCumsum(cnt)
+   S = gSlots[ug]
+   hit = inSeq & (taken >= S)
+   hitCum = groupCumsum(hit.astype(numpy.int64))
+   firstHit = hit & (hitCum == 1)
+   
+   uStatus = numpy.zeros(len(ug), dtype = numpy.int8)
+   uStatus[inSeq & (hitCum == 0)] = 1
+   uStatus[firstHit & (taken == S)] = 1
+   uStatus[(hitCum >= 1) & ~firstHit] = -1
+   status[valid[srt]] = uStatus[uid]
+   
+   # Slots remaining per group
+   filled = numpy.bincount(ug, weights = cnt*(uStatus == 1), minlength = len(keys))
+   inv = dict([(k, g) for (g, k) in keys.items()])
+   for k in numpy.unique(ug):
+      remaining[inv[k]] = gSlots[k] - filled[k]
+   return (status, remaining)
 
-def UpdatePortfolio(in_procEOs,in_ConSites,in_sumTab):
-   '''A helper function called by BuildPortfolio. Selects ConSites intersecting EOs in the EO portfolio, and adds them to the ConSite portfolio. Then selects "Choice" EOs intersecting ConSites in the portfolio, and adds them to the EO portfolio (bycatch). Finally, updates the summary table to indicate how many EOs of each element are in the different tier classes, and how many are included in the current portfolio.
+def UpdatePortfolio(in_procEOs,in_ConSites,in_sumTab,pairs):
+   '''A helper function called by BuildPortfolio. Adds ConSites intersecting EOs in the EO portfolio to the ConSite portfolio. Then adds "Choice" EOs intersecting ConSites in the portfolio to the EO portfolio (bycatch). Finally, updates the summary table to indicate how many EOs of each element are in the different tier classes, and how many are included in the current portfolio.
    Parameters:
    - in_procEOs: input feature class of processed EOs (i.e., out_procEOs from the AttributeEOs function, further processed by the ScoreEOs function)
    - in_ConSites: input Conservation Site boundaries
    - in_sumTab: input table summarizing number of included EOs per element (i.e., out_sumTab from the AttributeEOs function.
+   - pairs: tuple (eoOIDs, csOIDs) of intersecting EOs and ConSites, from SpatialPairs
    '''
-   # Intersect ConSites with subset of EOs, and set PORTFOLIO to 1
-   where_clause = '"ChoiceRANK" < 4 OR "PORTFOLIO" = 1' 
-   arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_EO", where_clause)
-   arcpy.MakeFeatureLayer_management (in_ConSites, "lyr_CS")
-   arcpy.SelectLayerByLocation_management ("lyr_CS", "INTERSECT", "lyr_EO", 0, "NEW_SELECTION", "NOT_INVERT")
-   arcpy.CalculateField_management("lyr_CS", "PORTFOLIO", 1, "PYTHON_9.3")
-   arcpy.CalculateField_management("lyr_EO", "PORTFOLIO", 1, "PYTHON_9.3")
+   eoCols = readColumns(in_procEOs, ["TIER", "ChoiceRANK", "PORTFOLIO"])
+   csCols = readColumns(in_ConSites, ["PORTFOLIO"])
+   eoIdx = oidPositions(eoCols["OID@"], pairs[0])
+   csIdx = oidPositions(csCols["OID@"], pairs[1])
+   eoPort = numpy.nan_to_num(eoCols["PORTFOLIO"])
+   csPort = numpy.nan_to_num(csCols["PORTFOLIO"])
+   
+   # ConSites intersecting the subset of EOs, and the EOs themselves, go in the portfolio
+   seed = (eoCols["ChoiceRANK"] < 4) | (eoPort == 1)
+   csPort[csIdx[seed[eoIdx]]] = 1
+   eoPort[seed] = 1
    printMsg('ConSites portfolio updated')
    
-   # Intersect Choice EOs with Portfolio ConSites, and set PORTFOLIO to 1
-   where_clause = '"TIER" = \'Choice\''
-   arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_EO", where_clause)
-   where_clause = '"PORTFOLIO" = 1'
-   arcpy.MakeFeatureLayer_management (in_ConSites, "lyr_CS", where_clause)
-   arcpy.SelectLayerByLocation_management ("lyr_EO", "INTERSECT", "lyr_CS", 0, "NEW_SELECTION", "NOT_INVERT")
-   arcpy.CalculateField_management("lyr_EO", "PORTFOLIO", 1, "PYTHON_9.3")
+   # Choice EOs intersecting Portfolio ConSites go in the portfolio
+   choice = numpy.array([t == 'Choice' for t in eoCols["TIER"]], dtype = bool)
+   eoPort[eoIdx[choice[eoIdx] & (csPort[csIdx] == 1)]] = 1
+   writeColumns(in_procEOs, eoCols["OID@"], {"PORTFOLIO": eoPort})
+   writeColumns(in_ConSites, csCols["OID@"], {"PORTFOLIO": csPort})
    printMsg('EOs portfolio updated')
    
    # Fill in counter fields
@@ -206,93 +222,56 @@ def UpdatePortfolio(in_procEOs,in_ConSites,in_sumTab):
    #printMsg('Field "PORTFOLIO" joined to table %s.' %in_sumTab)
 
 
+# Lookup tables for B-ranks. The individual B-rank (IBR) of an EO is looked up by EO-rank and G-rank, or for other G-ranks, by EO-rank and S-rank (None = any other S-rank).
+ibrByGrank = {"A": {"G1": "B1", "G2": "B2", "G3": "B2"},
+              "B": {"G1": "B2", "G2": "B2", "G3": "B3"},
+              "C": {"G1": "B2", "G2": "B3", "G3": "B4"},
+              "D": {"G1": "B2", "G2": "B3", "G3": "B4"}}
+ibrBySrank = {"A": {"S1": "B3", "S2": "B4", None: "B5"},
+              "B": {"S1": "B4", None: "B5"},
+              "C": {"S1": "B5", "S2": "B5", None: "BU"},
+              "D": {None: "BU"}}
+ibrScores = {"B1": 256, "B2": 64, "B3": 16, "B4": 4, "B5": 1}
+
+def ibrLookup(grank, srank, eorank, fstat, sstat, elcode):
+   '''A helper function called by getBRANK; returns the individual B-rank (IBR) of an EO from the lookup tables. Communities (CEGL elcodes) that would otherwise be unranked ("BU") get "B5", as do listed species with S-rank S1 or S2 and EO-rank D.'''
+   if eorank not in ibrByGrank:
+      return "BU"
+   if grank in ibrByGrank[eorank]:
+      return ibrByGrank[eorank][grank]
+   if eorank == "D" and (fstat in ("LT%", "LE%") or sstat in ("LT", "LE")) and (srank in ("S1", "S2")):
+      return "B5"
+   ibr = ibrBySrank[eorank].get(srank, ibrBySrank[eorank][None])
+   if ibr == "BU" and elcode and elcode[:4] == "CEGL":
+      return "B5"
+   return ibr
+
+def siteBRANKs(ibrSums, ibrMaxs):
+   '''A helper function called by getBRANK; returns a list of site B-ranks from arrays of the sums and maximums of the IBR scores of the EOs in each site (NaN for sites without EOs). The site gets the lower of the B-rank from the sum and the B-rank from the maximum, i.e. the B-rank from the maximum caps the site's B-rank.'''
+   ibrSums = numpy.asarray(ibrSums, dtype = numpy.float64)
+   ibrMaxs = numpy.asarray(ibrMaxs, dtype = numpy.float64)
+   # Rank numbers (1 = B1), with 0 for null
+   sumRank = numpy.where(numpy.isnan(ibrSums), 0, 5 - numpy.searchsorted([4, 16, 64, 256], numpy.nan_to_num(ibrSums), side = 'right'))
+   maxRank = numpy.where(numpy.isnan(ibrMaxs), 0, 4 - numpy.searchsorted([4, 16, 64], numpy.nan_to_num(ibrMaxs), side = 'right'))
+   siteRank = numpy.maximum(sumRank, maxRank)
+   return [None if r == 0 else "B%s" % r for r in siteRank]
+
 ### MAIN FUNCTIONS ###   
 
 def getBRANK(in_EOs, in_ConSites):
    '''Automates the assignment of B-ranks to conservation sites
    NOTE: Should only be run on one site type at a time, with type-specific inputs. Needs to run in foreground so tables update attributes. Best to close attribute tables prior to running.
    '''
-   ### For the EOs, calculate the IBR (individual B-rank)
-   printMsg('Creating and calculating IBR field for EOs...')
+   ### For the EOs, calculate the IBR (individual B-rank) and IBR score
+   printMsg('Creating and calculating IBR and IBR_SCORE fields for EOs...')
    arcpy.AddField_management(in_EOs, "IBR", "TEXT", 2)
+   arcpy.AddField_management(in_EOs, "IBR_SCORE", "LONG")
    # Searches elcodes for "CEGL" so it can treat communities a little differently than species.
    # Should it do the same for "ONBCOLONY" bird colonies?
-   codeblock = '''def ibr(grank, srank, eorank, fstat, sstat, elcode):
-      if eorank == "A":
-         if grank == "G1":
-            return "B1"
-         elif grank in ("G2", "G3"):
-            return "B2"
-         else:
-            if srank == "S1":
-               return "B3"
-            elif srank == "S2":
-               return "B4"
-            else:
-               return "B5"
-      elif eorank == "B":
-         if grank in ("G1", "G2"):
-            return "B2"
-         elif grank == "G3":
-            return "B3"
-         else:
-            if srank == "S1":
-               return "B4"
-            else:
-               return "B5"
-      elif eorank == "C":
-         if grank == "G1":
-            return "B2"
-         elif grank == "G2":
-            return "B3"
-         elif grank == "G3":
-            return "B4"
-         else:
-            if srank in ("S1", "S2"):
-               return "B5"
-            elif elcode[:4] == "CEGL":
-               return "B5"
-            else:
-               return "BU"
-      elif eorank == "D":
-         if grank == "G1":
-            return "B2"
-         elif grank == "G2":
-            return "B3"
-         elif grank == "G3":
-            return "B4"
-         else:
-            if (fstat in ("LT%", "LE%") or sstat in ("LT", "LE")) and (srank in ("S1", "S2")):
-               return "B5"
-            elif elcode[:4] == "CEGL":
-               return "B5"
-            else:
-               return "BU"
-      else:
-         return "BU"
-   '''
-   expression = "ibr(!BIODIV_GRANK!, !BIODIV_SRANK!, !BIODIV_EORANK!, !FEDSTAT!, !SPROT!, !ELCODE!)"
-   arcpy.CalculateField_management(in_EOs, "IBR", expression, "PYTHON_9.3", codeblock)
-   
-   ### For the EOs, calculate the IBR score
-   printMsg('Creating and calculating IBR_SCORE field for EOs...')
-   arcpy.AddField_management(in_EOs, "IBR_SCORE", "LONG")
-   codeblock = '''def score(ibr):
-      if ibr == "B1":
-         return 256
-      elif ibr == "B2":
-         return 64
-      elif ibr == "B3":
-         return 16
-      elif ibr == "B4":
-         return 4
-      elif ibr == "B5":
-         return 1
-      else:
-         return 0
-   '''
-   expression = "score(!IBR!)"
-   arcpy.CalculateField_management(in_EOs, "IBR_SCORE", expression, "PYTHON_9.3", codeblock)
+   eoCols = readColumns(in_EOs, ["BIODIV_GRANK", "BIODIV_SRANK", "BIODIV_EORANK", "FEDSTAT", "SPROT", "ELCODE"])
+   ibr = [ibrLookup(*vals) for vals in zip(eoCols["BIODIV_GRANK"], eoCols["BIODIV_SRANK"], eoCols["BIODIV_EORANK"], eoCols["FEDSTAT"], eoCols["SPROT"], eoCols["ELCODE"])]
+   ibrScore = [ibrScores.get(b, 0) for b in ibr]
+   writeColumns(in_EOs, eoCols["OID@"], {"IBR": ibr, "IBR_SCORE": ibrScore})
    
    ### For the ConSites, calculate the B-rank and flag if it conflicts with previous B-rank
    printMsg('Adding several fields to ConSites...')
@@ -301,75 +280,31 @@ def getBRANK(in_EOs, in_ConSites):
    arcpy.AddField_management(in_ConSites, "AUTO_BRANK", "TEXT", 2)
    arcpy.AddField_management(in_ConSites, "FLAG_BRANK", "LONG")
 
-   # Calculate B-rank scores 
-   printMsg('Calculating B-rank sums and maximums in loop...')
-   arcpy.MakeFeatureLayer_management (in_EOs, "eo_lyr")
+   # Calculate B-rank scores from the EOs intersecting each site
+   printMsg('Calculating B-rank sums and maximums...')
+   (eoOIDs, siteOIDs) = SpatialPairs(in_EOs, in_ConSites)
+   scoreDict = dict(zip(eoCols["OID@"], ibrScore))
+   (sites, stats) = groupStats(siteOIDs, [scoreDict[oid] for oid in eoOIDs])
+   siteIndex = dict([(oid, k) for (k, oid) in enumerate(sites)])
+   
+   csCols = readColumns(in_ConSites, ["SITEID", "BRANK"])
+   ibrSum = numpy.ones(len(csCols["OID@"]))*numpy.nan
+   ibrMax = numpy.ones(len(csCols["OID@"]))*numpy.nan
    failList = []
-   with arcpy.da.UpdateCursor (in_ConSites, ["SHAPE@", "SITEID", "IBR_SUM", "IBR_MAX"]) as cursor:
-      for row in cursor:
-         myShp = row[0]
-         siteID = row[1]
-         arcpy.SelectLayerByLocation_management ("eo_lyr", "INTERSECT", myShp, "", "NEW_SELECTION")
-         c = countSelectedFeatures("eo_lyr")
-         if c > 0:
-            arr = arcpy.da.TableToNumPyArray ("eo_lyr",["IBR_SCORE"], skip_nulls=True)
-            
-            row[2] = arr["IBR_SCORE"].sum() 
-            row[3] = arr["IBR_SCORE"].max() 
-
-            cursor.updateRow(row)
-            # printMsg("Site %s: Completed"%siteID)
-         else:
-            printMsg("Site %s: Failed"%siteID)
-            failList.append(siteID)
-         
-   # Determine B-rank based on the sum of IBRs
-   printMsg('Calculating site B-ranks from sums and maximums of individual B-ranks...')
-   codeblock = '''def brank(sum, max):
-      if sum == None:
-         sumRank = None
-      elif sum < 4:
-         sumRank = "B5"
-      elif sum < 16:
-         sumRank = "B4"
-      elif sum < 64:
-         sumRank = "B3"
-      elif sum < 256:
-         sumRank = "B2"
-      else:
-         sumRank = "B1"
-      
-      if max == None:
-         maxRank = None
-      elif max < 4:
-         maxRank = "B4"
-      elif max < 16:
-         maxRank = "B3"
-      elif max < 64:
-         maxRank = "B2"
+   for (i, oid) in enumerate(csCols["OID@"]):
+      k = siteIndex.get(oid)
+      if k is None:
+         printMsg("Site %s: Failed" % csCols["SITEID"][i])
+         failList.append(csCols["SITEID"][i])
       else:
-         maxRank = "B1"
-
-      if sumRank < maxRank:
-         return maxRank
-      else:
-         return sumRank
-      '''
-   
-   expression= "brank(!IBR_SUM!,!IBR_MAX!)"
-   arcpy.CalculateField_management(in_ConSites, "AUTO_BRANK", expression, "PYTHON_9.3", codeblock)
-   
-   printMsg('Calculating flag status...')
-   codeblock = '''def flag(brank, auto_brank):
-      if auto_brank == None:
-         return None
-      elif brank == auto_brank:
-         return 0
-      else:
-         return 1
-   '''
-   expression = "flag(!BRANK!, !AUTO_BRANK!)"
-   arcpy.CalculateField_management(in_ConSites, "FLAG_BRANK", expression, "PYTHON_9.3", codeblock)
+         ibrSum[i] = stats["SUM"][k]
+         ibrMax[i] = stats["MAX"][k]
+   
+   # Determine B-rank based on the sum of IBRs, and flag status
+   printMsg('Calculating site B-ranks from sums and maximums of individual B-ranks...')
+   autoBrank = siteBRANKs(ibrSum, ibrMax)
+   flag = [None if a is None else int(b != a) for (a, b) in zip(autoBrank, csCols["BRANK"])]
+   writeColumns(in_ConSites, csCols["OID@"], {"IBR_SUM": ibrSum, "IBR_MAX": ibrMax, "AUTO_BRANK": autoBrank, "FLAG_BRANK": flag})
 
    if len(failList) > 0:
       printMsg("Processing incomplete for some sites %s"%failList)
@@ -388,164 +323,134 @@ def AttributeEOs(in_ProcFeats, in_eoReps, in_sppExcl, in_eoSelOrder, in_consLand
    - out_procEOs: Output EOs with TIER scores and other attributes.
    - out_sumTab: Output table summarizing number of included EOs per element'''
    
-   scratchGDB = arcpy.env.scratchGDB
-   
    # Dissolve procedural features on EO_ID
    printMsg("Dissolving procedural features by EO...")
    arcpy.Dissolve_management(in_ProcFeats, out_procEOs, ["SF_EOID", "ELCODE", "SNAME", "BIODIV_GRANK", "SRANK", "BIODIV_EORANK", "FEDSTAT", "SPROT"], [["SFID", "COUNT"]], "MULTI_PART")
    
-   # Make EO_ID into string to match EO reps - FFS why do I have to do this??
-   arcpy.AddField_management(out_procEOs, "EO_ID", "TEXT", "", "", 20)
-   arcpy.CalculateField_management(out_procEOs, "EO_ID", "!SF_EOID!", "PYTHON")
-   
-   # Join some fields
-   printMsg("Joining fields from EO reps...")
-   arcpy.JoinField_management(out_procEOs, "EO_ID", in_eoReps, "EO_ID", ["EORANK", "RND_GRANK", "LASTOBS"])
-   arcpy.JoinField_management(out_procEOs, "EORANK", in_eoSelOrder, "EORANK", "SEL_ORDER")
-      
-   # Add and calculate some fields
+   # Load keyed tables once; all joins are done in memory, matching keys whether stored as numbers or text
+   printMsg("Loading EO reps, EO rank selection order, and species exclusions...")
+   repFlds = ["EORANK", "RND_GRANK", "LASTOBS"]
+   repDict = loadKeyed(in_eoReps, "EO_ID", repFlds)
+   orderDict = loadKeyed(in_eoSelOrder, "EORANK", ["SEL_ORDER"])
+   exclDict = loadKeyed(in_sppExcl, "ELCODE", [])
+   eoCols = readColumns(out_procEOs, ["SF_EOID", "ELCODE"])
+   eoKeys = [normKey(v) for v in eoCols["SF_EOID"]]
+   n = len(eoKeys)
+   
+   # Joined fields: EO_ID (as text, to match EO reps), EORANK, RND_GRANK, LASTOBS, and SEL_ORDER
+   outCols = {"EO_ID": eoKeys}
+   for (j, fld) in enumerate(repFlds):
+      outCols[fld] = [repDict[k][j] if k in repDict else None for k in eoKeys]
+   outCols["SEL_ORDER"] = [orderDict.get(normKey(r), (None,))[0] for r in outCols["EORANK"]]
    
    # Field: OBSYEAR
    printMsg("Calculating OBSYEAR field...")
-   arcpy.AddField_management(out_procEOs, "OBSYEAR", "SHORT")
-   codeblock = '''def truncDate(lastobs):
+   def truncDate(lastobs):
       try:
          year = int(lastobs[:4])
       except:
          year = 0
-      return year'''
-   expression = "truncDate(!LASTOBS!)"
-   arcpy.CalculateField_management(out_procEOs, "OBSYEAR", expression, "PYTHON_9.3", codeblock)
+      return year
+   outCols["OBSYEAR"] = [truncDate(v) for v in outCols["LASTOBS"]]
    
    # Field: NEW_GRANK
    printMsg("Calculating NEW_GRANK field...")
-   arcpy.AddField_management(out_procEOs, "NEW_GRANK", "TEXT", "", "", 2)
-   codeblock = '''def reclass(granks):
-      if (granks == "T1"):
-         return "G1"
-      elif granks == "T2":
-         return "G2"
-      elif granks == "T3":
-         return "G3"
-      elif granks == "T4":
-         return "G4"
-      elif granks in ("T5","GH","GNA","GNR","GU","TNR","TX","") or granks == None:
+   granks = {"T1": "G1", "T2": "G2", "T3": "G3", "T4": "G4"}
+   def reclass(grank):
+      if grank in ("T5","GH","GNA","GNR","GU","TNR","TX","") or grank == None:
          return "G5"
-      else:
-         return granks'''
-   expression = "reclass(!RND_GRANK!)"
-   arcpy.CalculateField_management(out_procEOs, "NEW_GRANK", expression, "PYTHON_9.3", codeblock)
-   
-   # Field: EXCLUSION
-   arcpy.AddField_management(out_procEOs, "EXCLUSION", "TEXT", "", "", 20) # This will be calculated below by groups
+      return granks.get(grank, grank)
+   outCols["NEW_GRANK"] = [reclass(v) for v in outCols["RND_GRANK"]]
    
-   # Set EXCLUSION value for low EO ranks
-   codeblock = '''def reclass(order):
-      if order == 0 or order == None:
-         return "Low EO Rank"
-      else:
-         return "Keep"'''
-   expression = "reclass(!SEL_ORDER!)"
-   arcpy.CalculateField_management(out_procEOs, "EXCLUSION", expression, "PYTHON_9.3", codeblock)
-
-   # Set EXCLUSION value for species exclusions
+   # Field: EXCLUSION, for low EO ranks and species exclusions
    printMsg("Excluding certain species...")
-   arcpy.MakeFeatureLayer_management (out_procEOs, "lyr_EO")
-   arcpy.AddJoin_management ("lyr_EO", "ELCODE", in_sppExcl, "ELCODE", "KEEP_COMMON")
-   arcpy.CalculateField_management("lyr_EO", "EXCLUSION", "'Species Exclusion'", "PYTHON")
+   exclusion = []
+   for i in range(n):
+      if normKey(eoCols["ELCODE"][i]) in exclDict:
+         exclusion.append("Species Exclusion")
+      elif outCols["SEL_ORDER"][i] == 0 or outCols["SEL_ORDER"][i] == None:
+         exclusion.append("Low EO Rank")
+      else:
+         exclusion.append("Keep")
 
-   # Tabulate intersection of EOs with military land where BMI > '2'
-   printMsg("Tabulating intersection of EOs with military lands...")
-   where_clause = '"MATYPE" IN (\'Military Installation\', \'Military Recreation Area\', \'NASA Facility\', \'sold - Military Installation\', \'surplus - Military Installation\') AND "BMI" > \'2\''
-   arcpy.MakeFeatureLayer_management (in_consLands, "lyr_Military", where_clause)
-   TabInter_mil = scratchGDB + os.sep + "TabInter_mil"
-   arcpy.TabulateIntersection_analysis (out_procEOs, "EO_ID", "lyr_Military", TabInter_mil)
-   
-   # Field: PERCENT_MIL
-   arcpy.AddField_management(TabInter_mil, "PERCENT_MIL", "DOUBLE")
-   arcpy.CalculateField_management(TabInter_mil, "PERCENT_MIL", "!PERCENTAGE!", "PYTHON")
-   arcpy.JoinField_management(out_procEOs, "EO_ID", TabInter_mil, "EO_ID", "PERCENT_MIL")
+   # Tabulate intersection of EOs with military land where BMI > '2', and with conservation lands of each BMI value, in one overlay
+   milTypes = "'Military Installation', 'Military Recreation Area', 'NASA Facility', 'sold - Military Installation', 'surplus - Military Installation'"
+   classLands = [(in_consLands, '"MATYPE" IN (%s) AND "BMI" > \'2\'' % milTypes, "MIL")]
+   for bmi in ["1", "2", "3", "4"]:
+      classLands.append((in_consLands_flat, '"BMI" = \'%s\'' % bmi, "BMI" + bmi))
+   pctDict = TabulateLandClasses(out_procEOs, classLands, "SF_EOID")
+   
+   # Fields: PERCENT_MIL, PERCENT_bmi1 to PERCENT_bmi4, and BMI_score
+   printMsg("Calculating additional fields...")
+   pctCols = {"PERCENT_MIL": "MIL", "PERCENT_bmi1": "BMI1", "PERCENT_bmi2": "BMI2", "PERCENT_bmi3": "BMI3", "PERCENT_bmi4": "BMI4"}
+   for fld in pctCols:
+      pcts = pctDict[pctCols[fld]]
+      outCols[fld] = numpy.array([pcts.get(k, numpy.nan) for k in eoKeys], dtype = numpy.float64)
+   bmiPcts = [numpy.nan_to_num(outCols["PERCENT_bmi%s" % bmi]) for bmi in [1, 2, 3, 4]]
+   outCols["BMI_score"] = numpy.floor((8*bmiPcts[0] + 4*bmiPcts[1] + 2*bmiPcts[2] + 1*bmiPcts[3])/8)
    
    # Set EXCLUSION value for Military exclusions
-   where_clause = '"EXCLUSION" = \'Keep\' and "PERCENT_MIL" > 25'
-   arcpy.MakeFeatureLayer_management (out_procEOs, "lyr_EO", where_clause)
-   arcpy.CalculateField_management("lyr_EO", "EXCLUSION", "'Military Exclusion'", "PYTHON")
-   
-   # Tabulate Intersection of EOs with conservation lands of specified BMI values
-   printMsg("Tabulating intersection of EOs with BMI-1 lands...")
-   TabulateBMI(out_procEOs, in_consLands_flat, "1", "PERCENT_bmi1")
-
-   printMsg("Tabulating intersection of EOs with BMI-2 lands...")
-   TabulateBMI(out_procEOs, in_consLands_flat, "2", "PERCENT_bmi2")
-   
-   printMsg("Tabulating intersection of EOs with BMI-3 lands...")
-   TabulateBMI(out_procEOs, in_consLands_flat, "3", "PERCENT_bmi3")
-   
-   printMsg("Tabulating intersection of EOs with BMI-4 lands...")
-   TabulateBMI(out_procEOs, in_consLands_flat, "4", "PERCENT_bmi4")
-
-   printMsg("Calculating additional fields...")
-   # Field: BMI_score
-   arcpy.AddField_management(out_procEOs, "BMI_score", "DOUBLE")
-   codeblock = '''def score(bmi1, bmi2, bmi3, bmi4):
-      parmVals = {1:bmi1, 2:bmi2, 3:bmi3, 4:bmi4}
-      for key in parmVals:
-         if not parmVals[key]:
-            parmVals[key] = 0.0
-      score = int((8*parmVals[1] + 4*parmVals[2] + 2*parmVals[3] + 1*parmVals[4])/8)
-      return score'''
-   expression = 'score(!PERCENT_bmi1!, !PERCENT_bmi2!, !PERCENT_bmi3!, !PERCENT_bmi4!)'
-   arcpy.CalculateField_management(out_procEOs, "BMI_score", expression, "PYTHON_9.3", codeblock)
+   for i in range(n):
+      if exclusion[i] == "Keep" and outCols["PERCENT_MIL"][i] > 25:
+         exclusion[i] = "Military Exclusion"
+   outCols["EXCLUSION"] = exclusion
    
    # Field: ysnNAP
-   arcpy.AddField_management(out_procEOs, "ysnNAP", "SHORT")
-   arcpy.CalculateField_management(out_procEOs, "ysnNAP", 0, "PYTHON")
-   arcpy.MakeFeatureLayer_management(out_procEOs, "lyr_EO")
    where_clause = '"MATYPE" = \'State Natural Area Preserve\''
    arcpy.MakeFeatureLayer_management(in_consLands, "lyr_NAP", where_clause) 
-   arcpy.SelectLayerByLocation_management("lyr_EO", "INTERSECT", "lyr_NAP", "", "NEW_SELECTION", "NOT_INVERT")
-   arcpy.CalculateField_management("lyr_EO", "ysnNAP", 1, "PYTHON")
-   #arcpy.SelectLayerByAttribute_management("lyr_EO", "CLEAR_SELECTION")
+   napOIDs = set(SpatialPairs(out_procEOs, "lyr_NAP")[0])
+   outCols["ysnNAP"] = [1 if oid in napOIDs else 0 for oid in eoCols["OID@"]]
    
-   # Get subset of EOs to summarize based on EXCLUSION field
-   where_clause = '"EXCLUSION" = \'Keep\''
-   arcpy.MakeFeatureLayer_management (out_procEOs, "lyr_EO", where_clause)
-      
-   # Summarize to get count of EOs per element
+   # Count EOs per element, for EOs to keep
    printMsg("Summarizing...")
-   arcpy.Statistics_analysis("lyr_EO", out_sumTab, [["EO_ID", "COUNT"]], ["ELCODE", "NEW_GRANK"])
-   
-   # Add more info to summary table
-   # Field: TARGET
-   arcpy.AddField_management(out_sumTab, "TARGET", "SHORT")
-   codeblock = '''def target(grank, count):
+   counts = {}
+   for i in range(n):
+      if exclusion[i] == "Keep":
+         key = (eoCols["ELCODE"][i], outCols["NEW_GRANK"][i])
+         counts[key] = counts.get(key, 0) + 1
+   
+   # Fields: TARGET and TIER, per element
+   def target(grank, count):
       if grank in ('G1', 'G2'):
          initTarget = 5
       else:
          initTarget = 2
-      if count < initTarget:
-         target = count
-      else:
-         target = initTarget
-      return target'''
-   expression =  "target(!NEW_GRANK!, !COUNT_EO_ID!)" 
-   arcpy.CalculateField_management(out_sumTab, "TARGET", expression, "PYTHON_9.3", codeblock)
-   
-   # Field: TIER
-   printMsg("Assigning initial tiers...")
-   arcpy.AddField_management(out_sumTab, "TIER", "TEXT", "", "", 25)
-   codeblock = '''def calcTier(grank, count):
+      return min(count, initTarget)
+   def calcTier(grank, count):
       if count == 1:
          return "Irreplaceable"
       elif ((grank in ("G1","G2")) and (count <= 5)) or ((grank in ("G3","G4","G5")) and (count <= 2)) :
          return "Essential"
       else:
-         return "Choice"'''
-   expression = "calcTier(!NEW_GRANK!, !COUNT_EO_ID!)"
-   arcpy.CalculateField_management(out_sumTab, "TIER", expression, "PYTHON_9.3", codeblock)
+         return "Choice"
+   tierDict = {}
+   for key in sorted(counts):
+      tierDict.setdefault(key[0], calcTier(key[1], counts[key]))
+   
+   # Field: TIER, for EOs to keep
+   printMsg("Assigning initial tiers...")
+   outCols["TIER"] = [tierDict.get(eoCols["ELCODE"][i]) if exclusion[i] == "Keep" else None for i in range(n)]
    
-   # Join the TIER field to the EO table
-   arcpy.JoinField_management("lyr_EO", "ELCODE", out_sumTab, "ELCODE", "TIER")
+   # Write all joined and derived fields in one pass
+   printMsg("Writing EO attributes...")
+   arcpy.AddField_management(out_procEOs, "EO_ID", "TEXT", "", "", 20)
+   addFieldsLike(out_procEOs, in_eoReps, repFlds)
+   addFieldsLike(out_procEOs, in_eoSelOrder, ["SEL_ORDER"])
+   newFlds = [("OBSYEAR", "SHORT", ""), ("NEW_GRANK", "TEXT", 2), ("EXCLUSION", "TEXT", 20), ("PERCENT_MIL", "DOUBLE", ""), ("PERCENT_bmi1", "DOUBLE", ""), ("PERCENT_bmi2", "DOUBLE", ""), ("PERCENT_bmi3", "DOUBLE", ""), ("PERCENT_bmi4", "DOUBLE", ""), ("BMI_score", "DOUBLE", ""), ("ysnNAP", "SHORT", ""), ("TIER", "TEXT", 25)]
+   for (fld, fldType, fldLen) in newFlds:
+      arcpy.AddField_management(out_procEOs, fld, fldType, "", "", fldLen)
+   writeColumns(out_procEOs, eoCols["OID@"], outCols)
+   
+   # Summary table of EOs to keep, with TARGET and TIER
+   where_clause = '"EXCLUSION" = \'Keep\''
+   arcpy.MakeFeatureLayer_management (out_procEOs, "lyr_EO", where_clause)
+   arcpy.Statistics_analysis("lyr_EO", out_sumTab, [["EO_ID", "COUNT"]], ["ELCODE", "NEW_GRANK"])
+   arcpy.AddField_management(out_sumTab, "TARGET", "SHORT")
+   arcpy.AddField_management(out_sumTab, "TIER", "TEXT", "", "", 25)
+   sumCols = readColumns(out_sumTab, ["NEW_GRANK", "COUNT_EO_ID"])
+   grankList = sumCols["NEW_GRANK"]
+   countList = sumCols["COUNT_EO_ID"]
+   writeColumns(out_sumTab, sumCols["OID@"], {"TARGET": [target(g, c) for (g, c) in zip(grankList, countList)], "TIER": [calcTier(g, c) for (g, c) in zip(grankList, countList)]})
    
    printMsg("EO attribution complete")
    return (out_procEOs, out_sumTab)
@@ -564,7 +469,7 @@ def ScoreEOs(in_procEOs, in_sumTab, out_sortedEOs):
    in_procEOs = tmpEOs
    
    # Add ranking fields
-   for fld in ['RANK_eo', 'RANK_nap', 'RANK_bmi', 'RANK_year']:
+   for fld in ['RANK_eo', 'RANK_nap', 'RANK_bmi', 'RANK_year', 'ChoiceRANK']:
       arcpy.AddField_management(in_procEOs, fld, "SHORT")
    
    # Get subset of choice elements
@@ -575,78 +480,51 @@ def ScoreEOs(in_procEOs, in_sumTab, out_sortedEOs):
    targetDict = TabToDict("choiceTab", "ELCODE", "TARGET")
    #print targetDict
    
-   # Loop through the dictionary and process each ELCODE
-   for key in targetDict:
-      elcode = key
-      printMsg('Working on elcode %s...' %key)
-      try:
-         # Get subset of EOs to process
-         Slots = targetDict[key]
-         where_clause = '"ELCODE" = \'%s\' AND "TIER" = \'Choice\'' %elcode
-         arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_EO", where_clause)
-         currentCount = countFeatures("lyr_EO")
-         print 'There are %s "Choice" features with this elcode' % str(currentCount)
-               
-         # Rank by EO-rank (selection order)
-         printMsg('Updating tiers based on EO-rank...')
-         addRanks("lyr_EO", "SEL_ORDER", "", rank_field='RANK_eo', thresh = 0.5, threshtype = "ABS")
-         availSlots = updateTiers("lyr_EO", elcode, Slots, "RANK_eo")
-         Slots = availSlots
-      
-         # Rank by presence on NAP
-         if Slots == 0:
-            pass
-         else:
-            printMsg('Updating tiers based on presence on NAP...')
-            arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_EO", where_clause)
-            addRanks("lyr_EO", "ysnNAP", "DESC", rank_field='RANK_nap', thresh = 0.5, threshtype = "ABS")
-            availSlots = updateTiers("lyr_EO", elcode, Slots, "RANK_nap")
-            Slots = availSlots
-         
-         # Rank by BMI score
-         if Slots == 0:
-            pass
-         else:
-            printMsg('Updating tiers based on BMI score...')
-            arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_EO", where_clause)
-            addRanks("lyr_EO", "BMI_score", "DESC", rank_field='RANK_bmi', thresh = 5, threshtype = "ABS")
-            availSlots = updateTiers("lyr_EO", elcode, Slots, "RANK_bmi")
-            Slots = availSlots
-         
-         # Rank by last observation year
-         if Slots == 0:
-            pass
-         else:
-            printMsg('Updating tiers based on last observation...')
-            arcpy.MakeFeatureLayer_management (in_procEOs, "lyr_EO", where_clause)
-            addRanks("lyr_EO", "OBSYEAR", "DESC", rank_field='RANK_year', thresh = 3, threshtype = "ABS")
-            availSlots = updateTiers("lyr_EO", elcode, Slots, "RANK_year")
-            Slots = availSlots
-            if Slots > 0:
-               printMsg('No more criteria available for differentiation; Choice ties remain.')
-      except:
-         printWrng('There was a problem processing elcode %s.' %elcode)
-         tback()
-   # Sort
+   # Read EO attributes once; all ranking and tier updates are done in memory
+   printMsg('Reading EO attributes...')
+   eoCols = readColumns(in_procEOs, ["ELCODE", "TIER", "SEL_ORDER", "ysnNAP", "BMI_score", "OBSYEAR"])
+   tiers = list(eoCols["TIER"])
+   
+   # Ranking criteria, in order: (field, order, rank field, threshold, description)
+   criteria = [("SEL_ORDER", "ASCENDING", "RANK_eo", 0.5, "EO-rank"), 
+               ("ysnNAP", "DESC", "RANK_nap", 0.5, "presence on NAP"), 
+               ("BMI_score", "DESC", "RANK_bmi", 5, "BMI score"), 
+               ("OBSYEAR", "DESC", "RANK_year", 3, "last observation")]
+   rankCols = {}
+   for crit in criteria:
+      rankCols[crit[2]] = numpy.ones(len(tiers))*numpy.nan
+   
+   # Rank by each criterion in turn, for all elements with slots still to fill
+   slotDict = dict(targetDict)
+   for (k, (fld, order, rankFld, thresh, desc)) in enumerate(criteria):
+      todo = set([e for e in slotDict if k == 0 or slotDict[e] > 0])
+      if not todo:
+         break
+      members = [i for i in range(len(tiers)) if tiers[i] == 'Choice' and eoCols["ELCODE"][i] in todo]
+      printMsg('Updating tiers based on %s, for %s elements...' % (desc, len(todo)))
+      elcodes = [eoCols["ELCODE"][i] for i in members]
+      rankCols[rankFld][members] = rankValues(eoCols[fld][members], elcodes, order, thresh, "ABS")
+      (status, remaining) = allocateSlots(elcodes, rankCols[rankFld][members], dict([(e, slotDict[e]) for e in todo]))
+      for (i, st) in zip(members, status):
+         if st == 1:
+            tiers[i] = 'Priority'
+         elif st == -1:
+            tiers[i] = 'Surplus'
+      slotDict.update(remaining)
+   tied = sorted([e for e in slotDict if slotDict[e] > 0])
+   if tied:
+      printMsg('No more criteria available for differentiation; Choice ties remain for these elements: %s' % str(tied))
+   
    # Field: ChoiceRANK
    printMsg("Assigning final ranks...")
-   arcpy.AddField_management(in_procEOs, "ChoiceRANK", "SHORT")
-   codeblock = '''def calcRank(tier):
-      if tier == "Irreplaceable":
-         return 1
-      elif tier == "Essential":
-         return 2
-      elif tier == "Priority":
-         return 3
-      elif tier == "Choice":
-         return 4
-      elif tier == "Surplus":
-         return 5
-      else:
-         return 6'''
-   expression = "calcRank(!TIER!)"
-   arcpy.CalculateField_management(in_procEOs, "ChoiceRANK", expression, "PYTHON_9.3", codeblock)
+   tierRanks = {"Irreplaceable": 1, "Essential": 2, "Priority": 3, "Choice": 4, "Surplus": 5}
+   rankCols["ChoiceRANK"] = [tierRanks.get(t, 6) for t in tiers]
+   rankCols["TIER"] = tiers
+   
+   # Write all ranks and tiers in one pass
+   writeColumns(in_procEOs, eoCols["OID@"], rankCols)
    
+   # Sort
    arcpy.Sort_management(in_procEOs, out_sortedEOs, [["ELCODE", "ASCENDING"], ["ChoiceRANK", "ASCENDING"],["RANK_eo", "ASCENDING"], ["RANK_nap", "ASCENDING"], ["RANK_bmi", "ASCENDING"], ["RANK_year", "ASCENDING"]])
 
    printMsg("Attribution and sorting complete.")
@@ -666,6 +544,7 @@ def BuildPortfolio(in_sortedEOs, out_sortedEOs, in_sumTab, out_sumTab, in_ConSit
       - NEW_EO: overwrite existing EO picks, but keep previous ConSite picks
       - NEW_CS: overwrite existing ConSite picks, but keep previous EO picks
       - UPDATE: Update portfolio but keep existing picks for both EOs and ConSites
+   The intersecting EO/ConSite pairs are found once, and saved to a table named like out_ConSites with the suffix "_eoPairs" (fields EO_OID and CS_OID, the ObjectIDs in out_sortedEOs and out_ConSites).
    '''
    
    # Make copies of inputs
@@ -704,67 +583,48 @@ def BuildPortfolio(in_sortedEOs, out_sortedEOs, in_sumTab, out_sumTab, in_ConSit
    else:
       printMsg('Portfolio picks maintained for ConSites')
       
+   # Find intersecting EOs and ConSites once; all further overlays are done with the pair list
+   printMsg('Finding intersections between EOs and ConSites...')
+   pairs = SpatialPairs(in_sortedEOs, in_ConSites)
+   
    if build == 'NEW':
       # Add "EO_CONSVALUE" field to in_sortedEOs, and calculate
       arcpy.AddField_management(in_sortedEOs, "EO_CONSVALUE", "SHORT")
-      codeblock = '''def calcConsVal(tier):
-         if tier == "Irreplaceable":
-            return 125
-         elif tier == "Essential":
-            return 25
-         elif tier == "Priority":
-            return 5
-         elif tier == "Choice":
-            return 1
-         else:
-            return 0'''
-      expression = "calcConsVal(!TIER!)"
-      arcpy.CalculateField_management(in_sortedEOs, "EO_CONSVALUE", expression, "PYTHON_9.3", codeblock)
+      consVals = {"Irreplaceable": 125, "Essential": 25, "Priority": 5, "Choice": 1}
+      eoCols = readColumns(in_sortedEOs, ["TIER"])
+      eoVals = numpy.array([consVals.get(t, 0) for t in eoCols["TIER"]], dtype = numpy.float64)
+      writeColumns(in_sortedEOs, eoCols["OID@"], {"EO_CONSVALUE": eoVals})
       printMsg('EO_CONSVALUE field set')
       
-      # Add "CS_CONSVALUE" field to in_ConSites, and calculate
-      printMsg('Looping through ConSites to sum conservation values of EOs...')
+      # Add "CS_CONSVALUE" field to in_ConSites, and calculate as the sum of conservation values of intersecting EOs
       arcpy.AddField_management(in_ConSites, "CS_CONSVALUE", "SHORT")
-      arcpy.MakeFeatureLayer_management (in_sortedEOs, "lyr_EO")
-      with arcpy.da.UpdateCursor(in_ConSites, ["SHAPE@", "CS_CONSVALUE"]) as mySites:
-         for site in mySites:
-            myShp = site[0]
-            arcpy.SelectLayerByLocation_management("lyr_EO", "INTERSECT", myShp, "", "NEW_SELECTION", "NOT_INVERT")
-            c = countSelectedFeatures("lyr_EO")
-            if c > 0:
-               #printMsg('%s EOs selected' % str(c))
-               myArray = arcpy.da.TableToNumPyArray ("lyr_EO", "EO_CONSVALUE")
-               mySum = myArray["EO_CONSVALUE"].sum()
-            else:
-               #printMsg('No EOs selected')
-               mySum = 0
-            site[1] = mySum
-            mySites.updateRow(site)
+      csCols = readColumns(in_ConSites, [])
+      eoIdx = oidPositions(eoCols["OID@"], pairs[0])
+      csIdx = oidPositions(csCols["OID@"], pairs[1])
+      csVals = numpy.bincount(csIdx, weights = eoVals[eoIdx], minlength = len(csCols["OID@"]))
+      writeColumns(in_ConSites, csCols["OID@"], {"CS_CONSVALUE": csVals})
       printMsg('CS_CONSVALUE field set')
       
       # Add "CS_AREA_HA" field to in_ConSites, and calculate
       arcpy.AddField_management(in_ConSites, "CS_AREA_HA", "DOUBLE")
       expression = '!SHAPE_Area!/10000'
       arcpy.CalculateField_management(in_ConSites, "CS_AREA_HA", expression, "PYTHON_9.3")
-   UpdatePortfolio(in_sortedEOs,in_ConSites,in_sumTab)
-   
-   # Spatial Join EOs to ConSites, and join relevant field back to EOs
-   for fld in ["CS_CONSVALUE", "CS_AREA_HA"]:
-      try: 
-         arcpy.DeleteField_management (in_sortedEOs, fld)
-      except:
-         pass
-   joinFeats = in_sortedEOs + '_csJoin'
-   fldmap1 = 'EO_ID "EO_ID" true true false 20 Text 0 0 ,First,#,%s,EO_ID,-1,-1'%in_sortedEOs
-   fldmap2 = 'CS_CONSVALUE "CS_CONSVALUE" true true false 2 Short 0 0 ,Max,#,%s,CS_CONSVALUE,-1,-1' %in_ConSites
-   fldmap3 = 'CS_AREA_HA "CS_AREA_HA" true true false 4 Double 0 0 ,Max,#,%s,CS_AREA_HA,-1,-1' %in_ConSites
-   field_mapping="""%s;%s;%s""" %(fldmap1,fldmap2,fldmap3)
-   
-   printMsg('Performing spatial join between EOs and ConSites...')
-   arcpy.SpatialJoin_analysis(in_sortedEOs, in_ConSites, joinFeats, "JOIN_ONE_TO_ONE", "KEEP_ALL", field_mapping, "INTERSECT")
+   UpdatePortfolio(in_sortedEOs,in_ConSites,in_sumTab,pairs)
+   
+   # Join the maximum values of intersecting ConSites back to EOs
+   printMsg('Joining ConSite values to EOs...')
+   for (fld, fldType) in [("CS_CONSVALUE", "SHORT"), ("CS_AREA_HA", "DOUBLE")]:
+      arcpy.AddField_management(in_sortedEOs, fld, fldType)
+   eoCols = readColumns(in_sortedEOs, [])
+   csCols = readColumns(in_ConSites, ["CS_CONSVALUE", "CS_AREA_HA"])
+   eoIdx = oidPositions(eoCols["OID@"], pairs[0])
+   csIdx = oidPositions(csCols["OID@"], pairs[1])
+   joinCols = {}
    for fld in ["CS_CONSVALUE", "CS_AREA_HA"]:
-      arcpy.JoinField_management (in_sortedEOs, "EO_ID", joinFeats, "EO_ID", fld)
-   #printMsg('Field "CS_CONSVALUE" joined to table %s.' %in_sortedEOs)
+      (groups, results) = groupStats(eoIdx, csCols[fld][csIdx], ["MAX"])
+      joinCols[fld] = numpy.ones(len(eoCols["OID@"]))*numpy.nan
+      joinCols[fld][groups] = results["MAX"]
+   writeColumns(in_sortedEOs, eoCols["OID@"], joinCols)
 
    # Make a data dictionary relating ELCODE to available slots, where portfolio still not filled 
    printMsg('Finding ELCODES for which portfolio is still not filled...')
@@ -779,43 +639,40 @@ def BuildPortfolio(in_sortedEOs, out_sortedEOs, in_sumTab, out_sumTab, in_ConSit
          slots = target - portfolio
          slotDict[elcode] = slots
    
-   # Loop through dictionary and rank remaining choices to fill remaining slots
-   for elcode in slotDict:
-      printMsg('Working on %s...' %elcode)
-      try:
-         Slots = slotDict[elcode]
-         printMsg('There are still %s slots to fill.' %str(int(Slots)))
-         where_clause = '"ELCODE" = \'%s\' and "TIER" = \'Choice\' and "PORTFOLIO" = 0' %elcode
-         arcpy.MakeFeatureLayer_management (in_sortedEOs, "lyr_EO", where_clause)
-         c = countFeatures("lyr_EO")
-         printMsg('There are %s features where %s.' %(str(int(c)), where_clause))
-
-         # Rank by CS_CONSVALUE
-         printMsg('Filling slots based on CS_CONSVALUE...')
-         addRanks("lyr_EO", "CS_CONSVALUE", "DESC", rank_field='RANK_csVal', thresh = 0.5, threshtype = "ABS")
-         availSlots = updateSlots("lyr_EO", elcode, Slots, "RANK_csVal")
-         Slots = availSlots
-         
-         # Rank by CS_AREA_HA
-         printMsg('Filling slots based on CS_AREA_HA...')
-         addRanks("lyr_EO", "CS_AREA_HA", "DESC", rank_field='RANK_area', thresh = 0.5, threshtype = "ABS", rounding = 1)
-         availSlots = updateSlots("lyr_EO", elcode, Slots, "RANK_area")
-         Slots = availSlots
-         if Slots > 0:
-            printMsg('No more criteria available for differentiation; Choice ties remain.')
-         
-      except:
-         printWrng('There was a problem processing elcode %s.' %elcode)  
-         tback()        
+   # Rank remaining choices to fill remaining slots, for all elements at once
+   printMsg('There are %s elements with slots still to fill.' % str(len(slotDict)))
+   eoCols = readColumns(in_sortedEOs, ["ELCODE", "TIER", "PORTFOLIO", "CS_CONSVALUE", "CS_AREA_HA", "RANK_csVal", "RANK_area"])
+   portfolio = eoCols["PORTFOLIO"].copy()
+   rankCols = {"RANK_csVal": eoCols["RANK_csVal"].copy(), "RANK_area": eoCols["RANK_area"].copy()}
+   for (fld, rankFld, rounding) in [("CS_CONSVALUE", "RANK_csVal", None), ("CS_AREA_HA", "RANK_area", 1)]:
+      printMsg('Filling slots based on %s...' % fld)
+      members = [i for i in range(len(portfolio)) if eoCols["ELCODE"][i] in slotDict and eoCols["TIER"][i] == 'Choice' and portfolio[i] == 0]
+      elcodes = [eoCols["ELCODE"][i] for i in members]
+      rankCols[rankFld][members] = rankValues(eoCols[fld][members], elcodes, "DESC", 0.5, "ABS", rounding)
+      (status, slotDict) = allocateSlots(elcodes, rankCols[rankFld][members], slotDict)
+      portfolio[numpy.array(members, dtype = numpy.int64)[status == 1]] = 1
+   tied = sorted([e for e in slotDict if slotDict[e] > 0])
+   if tied:
+      printMsg('No more criteria available for differentiation; Choice ties remain for these elements: %s' % str(tied))
+   rankCols["PORTFOLIO"] = portfolio
+   writeColumns(in_sortedEOs, eoCols["OID@"], rankCols)
 
-   UpdatePortfolio(in_sortedEOs,in_ConSites,in_sumTab)
+   UpdatePortfolio(in_sortedEOs,in_ConSites,in_sumTab,pairs)
    
    # Create final outputs
-   arcpy.Sort_management(in_sortedEOs, out_sortedEOs, [["ELCODE", "ASCENDING"], ["ChoiceRANK", "ASCENDING"], ["RANK_eo", "ASCENDING"], ["RANK_nap", "ASCENDING"], ["RANK_bmi", "ASCENDING"], ["RANK_year", "ASCENDING"], ["RANK_csVal", "ASCENDING"], ["RANK_area", "ASCENDING"], ["PORTFOLIO", "DESCENDING"]])
+   eoOIDs = SortKeepOIDs(in_sortedEOs, out_sortedEOs, [["ELCODE", "ASCENDING"], ["ChoiceRANK", "ASCENDING"], ["RANK_eo", "ASCENDING"], ["RANK_nap", "ASCENDING"], ["RANK_bmi", "ASCENDING"], ["RANK_year", "ASCENDING"], ["RANK_csVal", "ASCENDING"], ["RANK_area", "ASCENDING"], ["PORTFOLIO", "DESCENDING"]])
    
-   arcpy.Sort_management(in_ConSites, out_ConSites, [["CS_CONSVALUE", "DESCENDING"]])
+   csOIDs = SortKeepOIDs(in_ConSites, out_ConSites, [["CS_CONSVALUE", "DESCENDING"]])
    
    arcpy.CopyRows_management(in_sumTab, out_sumTab)
+   
+   # Save the EO/ConSite pairs alongside the outputs, keyed by the output ObjectIDs
+   pairTab = out_ConSites + '_eoPairs'
+   pairArr = numpy.array(zip([eoOIDs[k] for k in pairs[0]], [csOIDs[k] for k in pairs[1]]), dtype = [("EO_OID", numpy.int32), ("CS_OID", numpy.int32)])
+   if arcpy.Exists(pairTab):
+      arcpy.Delete_management(pairTab)
+   arcpy.da.NumPyArrayToTable(pairArr, pairTab)
+   printMsg('EO/ConSite pairs saved to %s' % pairTab)
       
    printMsg('Conservation sites prioritized and portfolio summary updated.')
    
@@ -2,7 +2,7 @@
 # ProcBRANK.py
 # Version:  ArcGIS 10.3 / Python 2.7
 # Creation Date: 2019-06-20
-# Last Edit: 2019-06-25
+# Last Edit: 2026-10-19
 # Creator:  Kirsten R. Hazler
 # ---------------------------------------------------------------------------
 
@@ -10,253 +10,105 @@
 import Helper
 from Helper import *
 
+# Lookup tables for B-ranks. The individual B-rank (IBR) of an EO is looked up by EO-rank and G-rank, or for other G-ranks, by EO-rank and S-rank (None = any other S-rank).
+ibrByGrank = {"A": {"G1": "B1", "G2": "B2", "G3": "B2"},
+              "B": {"G1": "B2", "G2": "B2", "G3": "B3"},
+              "C": {"G1": "B2", "G2": "B3", "G3": "B4"},
+              "D": {"G1": "B2", "G2": "B3", "G3": "B4"}}
+ibrBySrank = {"A": {"S1": "B3", "S2": "B4", "S3": "B5", None: "BU"},
+              "B": {"S1": "B4", "S2": "B5", "S3": "B5", None: "BU"},
+              "C": {"S1": "B5", "S2": "B5", None: "BU"},
+              "D": {None: "BU"}}
+ibrScores = {"B1": 256, "B2": 64, "B3": 16, "B4": 4, "B5": 1}
+
+def ibrLookup(grank, srank, eorank, fstat, sstat, tier = None):
+   '''Returns the individual B-rank (IBR) of an EO from the lookup tables. Listed species with S-rank S1 or S2 and EO-rank D get "B5". If the tier is supplied, "Irreplaceable" EOs are ranked as if they were G1.'''
+   if tier == "Irreplaceable":
+      grank = "G1"
+   if eorank not in ibrByGrank:
+      return "BU"
+   if grank in ibrByGrank[eorank]:
+      return ibrByGrank[eorank][grank]
+   if eorank == "D" and (fstat in ("LT%", "LE%") or sstat in ("LT", "LE")) and (srank in ("S1", "S2")):
+      return "B5"
+   return ibrBySrank[eorank].get(srank, ibrBySrank[eorank][None])
+
+def siteBRANKs(ibrSums, ibrMaxs = None):
+   '''Returns a list of site B-ranks from an array of the sums of the IBR scores of the EOs in each site (NaN for sites without EOs). If an array of the maximums is also supplied, the site gets the lower of the B-rank from the sum and the B-rank from the maximum, i.e. the B-rank from the maximum caps the site's B-rank.'''
+   ibrSums = numpy.asarray(ibrSums, dtype = numpy.float64)
+   # Rank numbers (1 = B1), with 0 for null
+   siteRank = numpy.where(numpy.isnan(ibrSums), 0, 5 - numpy.searchsorted([4, 16, 64, 256], numpy.nan_to_num(ibrSums), side = 'right'))
+   if ibrMaxs is not None:
+      ibrMaxs = numpy.asarray(ibrMaxs, dtype = numpy.float64)
+      maxRank = numpy.where(numpy.isnan(ibrMaxs), 0, 4 - numpy.searchsorted([4, 16, 64], numpy.nan_to_num(ibrMaxs), side = 'right'))
+      siteRank = numpy.where(numpy.isnan(ibrMaxs), 0, numpy.maximum(siteRank, maxRank))
+   return [None if r == 0 else "B%s" % r for r in siteRank]
+
 def getBRANK(in_EOs, in_ConSites):
    '''Automates the assignment of B-ranks to conservation sites
    
    '''
 
-   ### For the EOs, calculate the IBR (individual B-rank)
-   printMsg('Creating and calculating IBR fields for EOs...')
-   arcpy.AddField_management(in_EOs, "IBR_1", "TEXT", 2)
-   codeblock1 = '''def ibr(grank, srank, eorank, fstat, sstat):
-      if eorank == "A":
-         if grank == "G1":
-            return "B1"
-         elif grank in ("G2", "G3"):
-            return "B2"
-         else:
-            if srank == "S1":
-               return "B3"
-            elif srank == "S2":
-               return "B4"
-            elif srank == "S3":
-               return "B5"
-            else:
-               return "BU"
-      elif eorank == "B":
-         if grank in ("G1", "G2"):
-            return "B2"
-         elif grank == "G3":
-            return "B3"
-         else:
-            if srank == "S1":
-               return "B4"
-            elif srank in ("S2", "S3"):
-               return "B5"
-            else:
-               return "BU"
-      elif eorank == "C":
-         if grank == "G1":
-            return "B2"
-         elif grank == "G2":
-            return "B3"
-         elif grank == "G3":
-            return "B4"
-         else:
-            if srank in ("S1", "S2"):
-               return "B5"
-            else:
-               return "BU"
-      elif eorank == "D":
-         if grank == "G1":
-            return "B2"
-         elif grank == "G2":
-            return "B3"
-         elif grank == "G3":
-            return "B4"
-         else:
-            if (fstat in ("LT%", "LE%") or sstat in ("LT", "LE")) and (srank in ("S1", "S2")):
-               return "B5"
-            else:
-               return "BU"
-      else:
-         return "BU"
-   '''
-   expression1 = "ibr(!BIODIV_GRANK!, !SRANK!, !BIODIV_EORANK!, !FEDSTAT!, !SPROT!)"
-   arcpy.CalculateField_management(in_EOs, "IBR_1", expression1, "PYTHON_9.3", codeblock1)
-   
-   arcpy.AddField_management(in_EOs, "IBR_2", "TEXT", 2)
-   codeblock2 = '''def ibr(tier, grank, srank, eorank, fstat, sstat):
-      if eorank == "A":
-         if grank == "G1" or tier == "Irreplaceable":
-            return "B1"
-         elif grank in ("G2", "G3"):
-            return "B2"
-         else:
-            if srank == "S1":
-               return "B3"
-            elif srank == "S2":
-               return "B4"
-            elif srank == "S3":
-               return "B5"
-            else:
-               return "BU"
-      elif eorank == "B":
-         if grank in ("G1", "G2") or tier == "Irreplaceable":
-            return "B2"
-         elif grank == "G3":
-            return "B3"
-         else:
-            if srank == "S1":
-               return "B4"
-            elif srank in ("S2", "S3"):
-               return "B5"
-            else:
-               return "BU"
-      elif eorank == "C":
-         if grank == "G1" or tier == "Irreplaceable":
-            return "B2"
-         elif grank == "G2":
-            return "B3"
-         elif grank == "G3":
-            return "B4"
-         else:
-            if srank in ("S1", "S2"):
-               return "B5"
-            else:
-               return "BU"
-      elif eorank == "D":
-         if grank == "G1" or tier == "Irreplaceable":
-            return "B2"
-         elif grank == "G2":
-            return "B3"
-         elif grank == "G3":
-            return "B4"
-         else:
-            if (fstat in ("LT%", "LE%") or sstat in ("LT", "LE")) and (srank in ("S1", "S2")):
-               return "B5"
-            else:
-               return "BU"
-      else:
-         return "BU"
-   '''
-   expression2 = "ibr(!TIER!,!BIODIV_GRANK!, !SRANK!, !BIODIV_EORANK!, !FEDSTAT!, !SPROT!)"
-   arcpy.CalculateField_management(in_EOs, "IBR_2", expression2, "PYTHON_9.3", codeblock2)
-   
-   ### For the EOs, calculate the IBR score
-   printMsg('Creating and calculating IBR_SCORE fields for EOs...')
-   arcpy.AddField_management(in_EOs, "IBR_SCORE1", "LONG")
-   arcpy.AddField_management(in_EOs, "IBR_SCORE2", "LONG")
-   codeblock = '''def score(ibr):
-      if ibr == "B1":
-         return 256
-      elif ibr == "B2":
-         return 64
-      elif ibr == "B3":
-         return 16
-      elif ibr == "B4":
-         return 4
-      elif ibr == "B5":
-         return 1
-      else:
-         return 0
-   '''
-   expression1 = "score(!IBR_1!)"
-   arcpy.CalculateField_management(in_EOs, "IBR_SCORE1", expression1, "PYTHON_9.3", codeblock)
-   expression2 = "score(!IBR_2!)"
-   arcpy.CalculateField_management(in_EOs, "IBR_SCORE2", expression2, "PYTHON_9.3", codeblock)
+   ### For the EOs, calculate the IBR (individual B-rank) and IBR scores, without (1) and with (2) the EO tier
+   printMsg('Creating and calculating IBR and IBR_SCORE fields for EOs...')
+   for fld in ["IBR_1", "IBR_2"]:
+      arcpy.AddField_management(in_EOs, fld, "TEXT", 2)
+   for fld in ["IBR_SCORE1", "IBR_SCORE2"]:
+      arcpy.AddField_management(in_EOs, fld, "LONG")
+   eoCols = readColumns(in_EOs, ["BIODIV_GRANK", "SRANK", "BIODIV_EORANK", "FEDSTAT", "SPROT", "TIER"])
+   eoVals = zip(eoCols["BIODIV_GRANK"], eoCols["SRANK"], eoCols["BIODIV_EORANK"], eoCols["FEDSTAT"], eoCols["SPROT"])
+   ibr1 = [ibrLookup(*vals) for vals in eoVals]
+   ibr2 = [ibrLookup(*(vals + (tier,))) for (vals, tier) in zip(eoVals, eoCols["TIER"])]
+   score1 = [ibrScores.get(b, 0) for b in ibr1]
+   score2 = [ibrScores.get(b, 0) for b in ibr2]
+   writeColumns(in_EOs, eoCols["OID@"], {"IBR_1": ibr1, "IBR_2": ibr2, "IBR_SCORE1": score1, "IBR_SCORE2": score2})
    
    ### For the ConSites, calculate the B-rank and flag if it conflicts with previous B-rank
    printMsg('Adding several fields to ConSites...')
-   arcpy.AddField_management(in_ConSites, "IBR_SUM1", "LONG")
-   arcpy.AddField_management(in_ConSites, "IBR_SUM2", "LONG")
-   arcpy.AddField_management(in_ConSites, "IBR_MAX1", "LONG")
-   arcpy.AddField_management(in_ConSites, "IBR_MAX2", "LONG")
-   arcpy.AddField_management(in_ConSites, "AUTO_BRANK_1A", "TEXT", 2)
-   arcpy.AddField_management(in_ConSites, "FLAG_BRANK_1A", "LONG")
-   arcpy.AddField_management(in_ConSites, "AUTO_BRANK_1B", "TEXT", 2)
-   arcpy.AddField_management(in_ConSites, "FLAG_BRANK_1B", "LONG")
-   arcpy.AddField_management(in_ConSites, "AUTO_BRANK_2A", "TEXT", 2)
-   arcpy.AddField_management(in_ConSites, "FLAG_BRANK_2A", "LONG")
-   arcpy.AddField_management(in_ConSites, "AUTO_BRANK_2B", "TEXT", 2)
-   arcpy.AddField_management(in_ConSites, "FLAG_BRANK_2B", "LONG")
-
-   arcpy.MakeFeatureLayer_management (in_EOs, "eo_lyr")
+   for fld in ["IBR_SUM1", "IBR_SUM2", "IBR_MAX1", "IBR_MAX2"]:
+      arcpy.AddField_management(in_ConSites, fld, "LONG")
+   for v in ["1A", "1B", "2A", "2B"]:
+      arcpy.AddField_management(in_ConSites, "AUTO_BRANK_%s" % v, "TEXT", 2)
+      arcpy.AddField_management(in_ConSites, "FLAG_BRANK_%s" % v, "LONG")
    
-   # Calculate B-rank scores 
-   printMsg('Calculating B-rank sums and maximums in loop...')
+   # Calculate B-rank scores from the EOs intersecting each site
+   printMsg('Calculating B-rank sums and maximums...')
+   (eoOIDs, siteOIDs) = SpatialPairs(in_EOs, in_ConSites)
+   eoIndex = dict([(oid, k) for (k, oid) in enumerate(eoCols["OID@"])])
+   pairIdx = [eoIndex[oid] for oid in eoOIDs]
+   (sites, stats1) = groupStats(siteOIDs, numpy.array(score1, dtype = numpy.float64)[pairIdx])
+   (sites, stats2) = groupStats(siteOIDs, numpy.array(score2, dtype = numpy.float64)[pairIdx])
+   siteIndex = dict([(oid, k) for (k, oid) in enumerate(sites)])
+   
+   csCols = readColumns(in_ConSites, ["SITEID", "BRANK"])
+   nSites = len(csCols["OID@"])
+   outCols = {}
+   for fld in ["IBR_SUM1", "IBR_SUM2", "IBR_MAX1", "IBR_MAX2"]:
+      outCols[fld] = numpy.ones(nSites)*numpy.nan
    failList = []
-   with arcpy.da.UpdateCursor (in_ConSites, ["SHAPE@", "SITEID", "IBR_SUM1", "IBR_SUM2", "IBR_MAX1", "IBR_MAX2"]) as cursor:
-      for row in cursor:
-         myShp = row[0]
-         siteID = row[1]
-         arcpy.SelectLayerByLocation_management ("eo_lyr", "INTERSECT", myShp, "", "NEW_SELECTION")
-         c = countSelectedFeatures("eo_lyr")
-         if c > 0:
-            arr = arcpy.da.TableToNumPyArray ("eo_lyr",["IBR_SCORE1", "IBR_SCORE2"], skip_nulls=True)
-            
-            row[2] = arr["IBR_SCORE1"].sum() 
-            row[3] = arr["IBR_SCORE2"].sum() 
-            row[4] = arr["IBR_SCORE1"].max() 
-            row[5] = arr["IBR_SCORE2"].max() 
-            cursor.updateRow(row)
-            printMsg("Site %s: Completed"%siteID)
-         else:
-            printMsg("Site %s: Failed"%siteID)
-            failList.append(siteID)
+   for (i, oid) in enumerate(csCols["OID@"]):
+      k = siteIndex.get(oid)
+      if k is None:
+         printMsg("Site %s: Failed"%csCols["SITEID"][i])
+         failList.append(csCols["SITEID"][i])
+      else:
+         outCols["IBR_SUM1"][i] = stats1["SUM"][k]
+         outCols["IBR_SUM2"][i] = stats2["SUM"][k]
+         outCols["IBR_MAX1"][i] = stats1["MAX"][k]
+         outCols["IBR_MAX2"][i] = stats2["MAX"][k]
+   printMsg('%s sites completed' % str(nSites - len(failList)))
          
-   # Determine B-rank based on the sum of IBRs
+   # Determine B-rank based on the sum of IBRs, with (B) and without (A) the maximum, and flag status
    printMsg('Calculating site B-ranks from sums and maximums of individual B-ranks...')
-   codeblockA = '''def brank(val):
-      if val == None:
-         return None
-      elif val < 4:
-         return "B5"
-      elif val < 16:
-         return "B4"
-      elif val < 64:
-         return "B3"
-      elif val < 256:
-         return "B2"
-      else:
-         return "B1"
-      '''
-   
-   codeblockB = '''def brank(sumRank, max):
-      if max == None:
-         return None
-      elif max < 4:
-         maxRank = "B4"
-      elif max < 16:
-         maxRank = "B3"
-      elif max < 64:
-         maxRank = "B2"
-      else:
-         maxRank = "B1"
-
-      if sumRank < maxRank:
-         return maxRank
-      else:
-         return sumRank
-      '''
-   
-   expression1A = "brank(!IBR_SUM1!)"
-   arcpy.CalculateField_management(in_ConSites, "AUTO_BRANK_1A", expression1A, "PYTHON_9.3", codeblockA)
-   expression2A = "brank(!IBR_SUM2!)"
-   arcpy.CalculateField_management(in_ConSites, "AUTO_BRANK_2A", expression2A, "PYTHON_9.3", codeblockA)
-   
-   expression1B = "brank(!AUTO_BRANK_1A!,!IBR_MAX1!)"
-   arcpy.CalculateField_management(in_ConSites, "AUTO_BRANK_1B", expression1B, "PYTHON_9.3", codeblockB)
-   expression2B = "brank(!AUTO_BRANK_2A!,!IBR_MAX2!)"
-   arcpy.CalculateField_management(in_ConSites, "AUTO_BRANK_2B", expression2B, "PYTHON_9.3", codeblockB)
+   outCols["AUTO_BRANK_1A"] = siteBRANKs(outCols["IBR_SUM1"])
+   outCols["AUTO_BRANK_2A"] = siteBRANKs(outCols["IBR_SUM2"])
+   outCols["AUTO_BRANK_1B"] = siteBRANKs(outCols["IBR_SUM1"], outCols["IBR_MAX1"])
+   outCols["AUTO_BRANK_2B"] = siteBRANKs(outCols["IBR_SUM2"], outCols["IBR_MAX2"])
    
    printMsg('Calculating flag status...')
-   codeblock = '''def flag(brank, auto_brank):
-      if auto_brank == None:
-         return None
-      elif brank == auto_brank:
-         return 0
-      else:
-         return 1
-   '''
-   expression1A = "flag(!BRANK!, !AUTO_BRANK_1A!)"
-   arcpy.CalculateField_management(in_ConSites, "FLAG_BRANK_1A", expression1A, "PYTHON_9.3", codeblock)
-   expression1B = "flag(!BRANK!, !AUTO_BRANK_1B!)"
-   arcpy.CalculateField_management(in_ConSites, "FLAG_BRANK_1B", expression1B, "PYTHON_9.3", codeblock)
-   expression2A = "flag(!BRANK!, !AUTO_BRANK_2A!)"
-   arcpy.CalculateField_management(in_ConSites, "FLAG_BRANK_2A", expression2A, "PYTHON_9.3", codeblock)
-   expression2B = "flag(!BRANK!, !AUTO_BRANK_2B!)"
-   arcpy.CalculateField_management(in_ConSites, "FLAG_BRANK_2B", expression2B, "PYTHON_9.3", codeblock)
+   for v in ["1A", "1B", "2A", "2B"]:
+      outCols["FLAG_BRANK_%s" % v] = [None if a is None else int(b != a) for (a, b) in zip(outCols["AUTO_BRANK_%s" % v], csCols["BRANK"])]
+   writeColumns(in_ConSites, csCols["OID@"], outCols)
 
    if len(failList) > 0:
       printMsg("Processing incomplete for some sites %s"%failList)
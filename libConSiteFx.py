@@ -2,7 +2,7 @@
 # libConSiteFx.py
 # Version:  ArcGIS 10.3.1 / Python 2.7.8
 # Creation Date: 2017-08-08
-# Last Edit: 2019-06-26
+# Last Edit: 2026-10-18
 # Creator:  Kirsten R. Hazler
 
 # Summary:
@@ -88,15 +88,30 @@ def CullEraseFeats (inEraseFeats, in_Feats, fld_SFID, PerCov, outEraseFeats, scr
    
    return outEraseFeats
    
-def CullFrags (inFrags, in_PF, searchDist, outFrags):
+def CullFrags (inFrags, in_PF, searchDist, outFrags, prepPF = None):
    '''For ConSite creation: Culls SBB or ConSite fragments farther than specified search distance from 
-   Procedural Features'''
-   
-   # Process: Near
-   arcpy.Near_analysis(inFrags, in_PF, searchDist, "NO_LOCATION", "NO_ANGLE", "PLANAR")
+   Procedural Features. If a list of prepared PF geometries (see PreparedGeom) is supplied, distances are checked in memory instead of with the Near tool.'''
+   
+   if prepPF is not None:
+      # Process: Check distances against prepared geometries
+      dist = linearDistance(searchDist, arcpy.Describe(inFrags).spatialReference)
+      keepOIDs = []
+      with arcpy.da.SearchCursor(inFrags, ["OID@", "SHAPE@"]) as cursor:
+         for row in cursor:
+            if row[1] is None:
+               continue
+            frag = PreparedGeom(row[1])
+            for pf in prepPF:
+               if pf.withinDistance(frag, dist):
+                  keepOIDs.append(row[0])
+                  break
+      WhereClause = oidWhere(inFrags, keepOIDs)
+   else:
+      # Process: Near
+      arcpy.Near_analysis(inFrags, in_PF, searchDist, "NO_LOCATION", "NO_ANGLE", "PLANAR")
+      WhereClause = '"NEAR_FID" <> -1'
 
    # Process: Make Feature Layer
-   WhereClause = '"NEAR_FID" <> -1'
    arcpy.MakeFeatureLayer_management(inFrags, "Frags_lyr", WhereClause)
 
    # Process: Clean Features
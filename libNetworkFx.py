@@ -0,0 +1,608 @@
+# ----------------------------------------------------------------------------------------
+# libNetworkFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-18
+# Last Edit: 2026-10-18
+# Creator:  Kirsten R. Hazler
+
+# Summary:
+# A native network tracer for delineating Stream Conservation Units (SCUs), as an alternative to the Network Analyst service-area solves in CreateSCU.py. A directed graph is built from the NHDFlowline endpoints (flowlines are digitized in the direction of flow), and upstream or downstream traces are run from all SCU points at once with a bounded, multi-source Dijkstra search. The same restrictions as those defined in VA_HydroNet.gdb are applied, and DamWeir lines act as barriers. Outputs are line segments with cumulative lengths, equivalent to the non-overlapping "Lines" output of a service area solve.
+
+# Usage Tips:
+# The core functions only need numpy, so they also run without ArcGIS (e.g., on Linux). Reading the NHD requires arcpy or, failing that, GDAL/OGR. Writing feature classes requires arcpy.
+# Build the graph once with GetGraph (or BuildHydroGraph_scu in CreateSCU.py); it is saved to disk and memory-mapped on later use, and rebuilt automatically when the NHD source changes.
+
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, sys, heapq, json
+import numpy
+try:
+   import arcpy
+   from Helper import printMsg, printWrng, BulkWriter
+except:
+   arcpy = None
+   def printMsg(msg):
+      print(msg)
+   def printWrng(msg):
+      print('Warning: %s' % msg)
+try:
+   import shapely
+   from shapely.strtree import STRtree
+   hasShapely2 = hasattr(STRtree, 'query_nearest')
+except:
+   hasShapely2 = False
+
+# Network restrictions, as defined in the HydroNet. FType restrictions exclude flowline types; FCode restrictions exclude flowline subtypes. Each restriction has a bit in the per-edge restriction mask, so restrictions can be changed without rebuilding the graph.
+restrictFTypes = {"NoCanalDitches": 336, "NoConnectors": 334, "NoPipelines": 428, "NoUndergroundConduits": 420, "NoCoastline": 566}
+restrictFCodes = {"NoEphemeral": 46007}
+restrictBits = ["NoCanalDitches", "NoConnectors", "NoPipelines", "NoUndergroundConduits", "NoEphemeral", "NoCoastline"]
+defaultRestrictions = "NoCanalDitches;NoConnectors;NoPipelines;NoUndergroundConduits;NoEphemeral;NoCoastline"
+
+# Version of the on-disk graph format. Saved graphs with a different version are rebuilt.
+graphVersion = 1
+
+# Fields of the trace output
+traceDtype = [('FacilityID', 'i8'), ('EdgeID', 'i8'), ('SourceOID', 'i8'), ('FromM', 'f8'), ('ToM', 'f8'), ('FromCumul_Length', 'f8'), ('ToCumul_Length', 'f8')]
+
+### Graph construction ###
+def restrictionMask(ftype, fcode):
+   '''Returns an array of restriction bitmasks, one per edge (see restrictBits)'''
+   ftype = numpy.asarray(ftype)
+   fcode = numpy.asarray(fcode)
+   rmask = numpy.zeros(len(ftype), dtype = numpy.uint8)
+   for (bit, r) in enumerate(restrictBits):
+      if r in restrictFTypes:
+         hit = (ftype == restrictFTypes[r])
+      else:
+         hit = (fcode == restrictFCodes[r])
+      rmask[hit] |= numpy.uint8(1 << bit)
+   return rmask
+
+def setRestrictions(graph, restrictions = defaultRestrictions):
+   '''Sets the edges blocked by the specified restrictions (names separated by ';'; other names, e.g. "FlowDownOnly", are ignored). Returns the number of blocked edges.'''
+   bits = 0
+   for r in [r.strip() for r in restrictions.split(';')]:
+      if r in restrictBits:
+         bits |= 1 << restrictBits.index(r)
+   graph['blocked'] = (graph['rmask'] & numpy.uint8(bits)) != 0
+   for key in ['_treeTrue', '_treeFalse']:
+      graph.pop(key, None)
+   return int(graph['blocked'].sum())
+
+def buildGraph(vxy, vEdge, eoid, ftype, fcode, restrictions = defaultRestrictions, snapTol = 0.01, cellSize = 1000.0):
+   '''Builds a directed graph from flowline vertices. Returns the graph as a dictionary of numpy arrays:
+   - xy, vm, vedge, vstart: vertex coordinates, vertex measures (distance along the edge), the edge of each vertex, and the index of the first vertex of each edge (with a final entry for the end)
+   - efrom, eto, elen: from node, to node, and length of each edge
+   - eoid, ftype, fcode, rmask: ObjectID, FType, FCode, and restriction bitmask of each edge
+   - blocked: True for edges excluded by the current restrictions (not saved; see setRestrictions)
+   - downPtr, downIdx: edges leaving each node (CSR format), for downstream traces
+   - upPtr, upIdx: edges entering each node (CSR format), for upstream traces
+   - bEdge, bPos: barrier locations, as edge and measure, sorted by edge
+   - grid, cellPtr, cellSeg: grid spatial index of segments (see buildSegmentIndex)
+   Parameters:
+   - vxy = N x 2 array of vertex coordinates, in digitized order
+   - vEdge = array of the edge index (0, 1, 2...) of each vertex; all vertices of an edge must be consecutive
+   - eoid = array of source ObjectIDs, one per edge
+   - ftype = array of FType values, one per edge
+   - fcode = array of FCode values, one per edge
+   - restrictions = restriction names separated by ';'
+   - snapTol = tolerance for matching line endpoints to nodes, in map units
+   - cellSize = cell size of the segment spatial index, in map units
+   '''
+   vxy = numpy.asarray(vxy, dtype = numpy.float64)
+   vEdge = numpy.asarray(vEdge, dtype = numpy.int64)
+   nE = len(eoid)
+   nV = len(vxy)
+   counts = numpy.bincount(vEdge, minlength = nE)
+   vstart = numpy.zeros(nE + 1, dtype = numpy.int64)
+   vstart[1:] = numpy.cumsum(counts)
+
+   # Vertex measures along each edge
+   seg = numpy.hypot(numpy.diff(vxy[:,0]), numpy.diff(vxy[:,1]))
+   seg[vEdge[1:] != vEdge[:-1]] = 0.0
+   cs = numpy.zeros(nV)
+   cs[1:] = numpy.cumsum(seg)
+   vm = cs - cs[vstart[:-1]][vEdge]
+   elen = vm[vstart[1:] - 1]
+
+   # Nodes from matching endpoints
+   ends = numpy.vstack([vxy[vstart[:-1]], vxy[vstart[1:] - 1]])
+   keys = numpy.round(ends/snapTol).astype(numpy.int64)
+   # Number the distinct keys in sorted order (numpy.unique needs NumPy 1.13 to work on rows)
+   srt = numpy.lexsort((keys[:,1], keys[:,0]))
+   new = numpy.ones(len(keys), dtype = bool)
+   new[1:] = (keys[srt][1:] != keys[srt][:-1]).any(axis = 1)
+   inv = numpy.empty(len(keys), dtype = numpy.int64)
+   inv[srt] = numpy.cumsum(new) - 1
+   efrom = inv[:nE]
+   eto = inv[nE:]
+   nN = int(new.sum())
+
+   # Adjacency
+   downIdx = numpy.argsort(efrom, kind = 'mergesort')
+   downPtr = numpy.searchsorted(efrom[downIdx], numpy.arange(nN + 1))
+   upIdx = numpy.argsort(eto, kind = 'mergesort')
+   upPtr = numpy.searchsorted(eto[upIdx], numpy.arange(nN + 1))
+
+   graph = {'xy': vxy, 'vm': vm, 'vedge': vEdge, 'vstart': vstart, 'efrom': efrom, 'eto': eto, 'elen': elen, 'eoid': numpy.asarray(eoid, dtype = numpy.int64), 'ftype': numpy.asarray(ftype), 'fcode': numpy.asarray(fcode), 'rmask': restrictionMask(ftype, fcode), 'downPtr': downPtr, 'downIdx': downIdx, 'upPtr': upPtr, 'upIdx': upIdx, 'bEdge': numpy.zeros(0, dtype = numpy.int64), 'bPos': numpy.zeros(0)}
+   numBlocked = setRestrictions(graph, restrictions)
+   buildSegmentIndex(graph, cellSize)
+   printMsg('Built network graph with %s edges and %s nodes (%s edges restricted)' % (nE, nN, numBlocked))
+   return graph
+
+def buildSegmentIndex(graph, cellSize = 1000.0):
+   '''Builds a grid spatial index of the line segments in the graph. Segment i runs from vertex i to vertex i + 1. The index consists of:
+   - grid: array of (x origin, y origin, cell size, number of columns, number of rows)
+   - cellPtr, cellSeg: segments in each cell (CSR format), with cells numbered by column*rows + row
+   The cell size is increased if needed to keep the number of cells manageable.
+   '''
+   xy = graph['xy']
+   vEdge = graph['vedge']
+   segs = numpy.nonzero(vEdge[1:] == vEdge[:-1])[0]
+   x0, y0 = xy[:,0].min(), xy[:,1].min()
+   width, height = xy[:,0].max() - x0, xy[:,1].max() - y0
+   while (width/cellSize + 1)*(height/cellSize + 1) > 2e7:
+      cellSize *= 2
+   nx = int(width/cellSize) + 1
+   ny = int(height/cellSize) + 1
+   
+   # Cell ranges covered by each segment's bounding box
+   ax, bx = xy[segs, 0], xy[segs + 1, 0]
+   ay, by = xy[segs, 1], xy[segs + 1, 1]
+   ix0 = ((numpy.minimum(ax, bx) - x0)/cellSize).astype(numpy.int64)
+   ix1 = ((numpy.maximum(ax, bx) - x0)/cellSize).astype(numpy.int64)
+   iy0 = ((numpy.minimum(ay, by) - y0)/cellSize).astype(numpy.int64)
+   iy1 = ((numpy.maximum(ay, by) - y0)/cellSize).astype(numpy.int64)
+   w = ix1 - ix0 + 1
+   n = w*(iy1 - iy0 + 1)
+   rep = numpy.repeat(numpy.arange(len(segs)), n)
+   k = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n) - n, n)
+   cells = (ix0[rep] + k % w[rep])*ny + (iy0[rep] + k // w[rep])
+   order = numpy.argsort(cells, kind = 'mergesort')
+   graph['cellSeg'] = segs[rep[order]]
+   graph['cellPtr'] = numpy.searchsorted(cells[order], numpy.arange(nx*ny + 1))
+   graph['grid'] = numpy.array([x0, y0, cellSize, nx, ny], dtype = numpy.float64)
+   return graph
+
+def nearestOnSegments(graph, segs, px, py):
+   '''Returns the distances from points to segments, and the measures of the closest positions along the segments' edges. The points (px, py) and segments may be scalars or matching arrays.'''
+   xy = graph['xy']
+   vm = graph['vm']
+   x0 = xy[segs, 0]
+   y0 = xy[segs, 1]
+   dx = xy[segs + 1, 0] - x0
+   dy = xy[segs + 1, 1] - y0
+   len2 = dx*dx + dy*dy
+   len2[len2 == 0] = 1e-12
+   t = numpy.clip(((px - x0)*dx + (py - y0)*dy)/len2, 0.0, 1.0)
+   d = numpy.hypot(x0 + t*dx - px, y0 + t*dy - py)
+   m = vm[segs] + t*(vm[segs + 1] - vm[segs])
+   return (d, m)
+
+def snapGrid(graph, pxy, tolerance, excludeBlocked = True, chunkSize = 2000):
+   '''Snaps points to the closest eligible segments using the grid index. All candidate point-segment pairs for a chunk of points are generated and measured at once. Returns (edge, measure, distance) arrays; unsnapped points get an edge of -1.'''
+   n = len(pxy)
+   outEdge = -numpy.ones(n, dtype = numpy.int64)
+   outPos = numpy.zeros(n)
+   outDist = numpy.ones(n)*numpy.inf
+   (x0, y0, cellSize, nx, ny) = graph['grid']
+   nx, ny = int(nx), int(ny)
+   cellPtr = numpy.asarray(graph['cellPtr'])
+   cellSeg = graph['cellSeg']
+   vEdge = graph['vedge']
+   for c0 in range(0, n, chunkSize):
+      pts = pxy[c0:c0 + chunkSize]
+      # Cell ranges within tolerance of each point
+      ix0 = numpy.clip(numpy.floor((pts[:,0] - tolerance - x0)/cellSize).astype(numpy.int64), 0, nx - 1)
+      ix1 = numpy.clip(numpy.floor((pts[:,0] + tolerance - x0)/cellSize).astype(numpy.int64), 0, nx - 1)
+      iy0 = numpy.clip(numpy.floor((pts[:,1] - tolerance - y0)/cellSize).astype(numpy.int64), 0, ny - 1)
+      iy1 = numpy.clip(numpy.floor((pts[:,1] + tolerance - y0)/cellSize).astype(numpy.int64), 0, ny - 1)
+      # Point-column pairs; each column contributes a contiguous run of cells (rows iy0 to iy1)
+      w = ix1 - ix0 + 1
+      pc = numpy.repeat(numpy.arange(len(pts)), w)
+      col = ix0[pc] + (numpy.arange(w.sum()) - numpy.repeat(numpy.cumsum(w) - w, w))
+      lo = cellPtr[col*ny + iy0[pc]]
+      hi = cellPtr[col*ny + iy1[pc] + 1]
+      cnt = hi - lo
+      # Point-segment pairs
+      pp = numpy.repeat(pc, cnt)
+      if len(pp) == 0:
+         continue
+      segs = cellSeg[numpy.repeat(lo, cnt) + (numpy.arange(cnt.sum()) - numpy.repeat(numpy.cumsum(cnt) - cnt, cnt))]
+      if excludeBlocked:
+         ok = ~graph['blocked'][vEdge[segs]]
+         pp, segs = pp[ok], segs[ok]
+         if len(pp) == 0:
+            continue
+      (d, m) = nearestOnSegments(graph, segs, pts[pp, 0], pts[pp, 1])
+      # Closest pair for each point
+      order = numpy.lexsort((d, pp))
+      first = numpy.ones(len(order), dtype = bool)
+      first[1:] = pp[order][1:] != pp[order][:-1]
+      best = order[first]
+      hit = d[best] <= tolerance
+      idx = c0 + pp[best][hit]
+      outEdge[idx] = vEdge[segs[best][hit]]
+      outPos[idx] = m[best][hit]
+      outDist[idx] = d[best][hit]
+   return (outEdge, outPos, outDist)
+
+def snapTree(graph, pxy, tolerance, excludeBlocked = True):
+   '''Snaps points to the closest eligible edges using a shapely (version 2 or later) STRtree of the flowlines. The tree is cached with the graph. Returns (edge, measure, distance) arrays; unsnapped points get an edge of -1.'''
+   key = '_tree%s' % bool(excludeBlocked)
+   if key not in graph:
+      if excludeBlocked:
+         edges = numpy.nonzero(~graph['blocked'])[0]
+      else:
+         edges = numpy.arange(len(graph['elen']))
+      lines = shapely.linestrings(numpy.asarray(graph['xy']), indices = numpy.asarray(graph['vedge']))
+      lines = lines[edges]
+      graph[key] = (STRtree(lines), lines, edges)
+   (tree, lines, edges) = graph[key]
+   n = len(pxy)
+   outEdge = -numpy.ones(n, dtype = numpy.int64)
+   outPos = numpy.zeros(n)
+   outDist = numpy.ones(n)*numpy.inf
+   pts = shapely.points(pxy)
+   (pairs, dists) = tree.query_nearest(pts, max_distance = tolerance, return_distance = True, all_matches = False)
+   (pi, ti) = pairs
+   outEdge[pi] = edges[ti]
+   outPos[pi] = shapely.line_locate_point(lines[ti], pts[pi])
+   outDist[pi] = dists
+   return (outEdge, outPos, outDist)
+
+def SnapPoints(graph, pxy, tolerance = 500.0, excludeBlocked = True, method = "AUTO"):
+   '''Snaps points to the network, at the closest position on the closest eligible edge, as AddLocations does with "MATCH_TO_CLOSEST". Returns a tuple of arrays (edge, measure, distance, failed): the edge ID, measure along the edge, and snap distance for each point, plus the indices of points that could not be snapped within the tolerance (these get an edge of -1).
+   Parameters:
+   - graph = network graph from buildGraph
+   - pxy = N x 2 array of point coordinates
+   - tolerance = search tolerance, in map units
+   - excludeBlocked = if True, points are not snapped to restricted edges
+   - method = "TREE" (shapely STRtree), "GRID" (the graph's grid index), or "AUTO" (TREE if shapely 2 is available, otherwise GRID)
+   '''
+   pxy = numpy.asarray(pxy, dtype = numpy.float64).reshape(-1, 2)
+   method = method.upper()
+   if method == "AUTO":
+      method = "TREE" if hasShapely2 else "GRID"
+   if method == "TREE":
+      (edge, pos, dist) = snapTree(graph, pxy, tolerance, excludeBlocked)
+   else:
+      (edge, pos, dist) = snapGrid(graph, pxy, tolerance, excludeBlocked)
+   failed = numpy.nonzero(edge < 0)[0]
+   return (edge, pos, dist, failed)
+
+def addBarriers(graph, bxy, tolerance = 100.0):
+   '''Adds barriers at the closest network positions to the specified points (e.g., DamWeir line midpoints). Barriers farther than the tolerance from the network are dropped. Returns the number of barriers added.'''
+   (bEdge, bPos, bDist, failed) = SnapPoints(graph, bxy, tolerance, False)
+   keep = bEdge >= 0
+   bEdge = numpy.concatenate([graph['bEdge'], bEdge[keep]])
+   bPos = numpy.concatenate([graph['bPos'], bPos[keep]])
+   order = numpy.lexsort((bPos, bEdge))
+   graph['bEdge'] = bEdge[order]
+   graph['bPos'] = bPos[order]
+   return int(keep.sum())
+
+def edgeBarriers(graph, e):
+   '''Returns the measures of any barriers on edge e'''
+   lo = numpy.searchsorted(graph['bEdge'], e, 'left')
+   hi = numpy.searchsorted(graph['bEdge'], e, 'right')
+   return graph['bPos'][lo:hi]
+
+### Saving and loading ###
+# Graphs are saved as a directory of .npy files plus a manifest, and loaded as read-only memory maps, so loading is nearly instant and the arrays can be shared by several processes. The manifest records a version stamp of the NHD source; a saved graph is rebuilt if the stamp no longer matches.
+savedArrays = ['xy', 'vm', 'vedge', 'vstart', 'efrom', 'eto', 'elen', 'eoid', 'ftype', 'fcode', 'rmask', 'downPtr', 'downIdx', 'upPtr', 'upIdx', 'bEdge', 'bPos', 'grid', 'cellPtr', 'cellSeg']
+
+def sourceStamp(nhdFlowline):
+   '''Returns a version stamp for the NHD source: the format version, the source path, and the latest modification time of the files in its workspace (ignoring lock files, which are written whenever the workspace is read)'''
+   wksp = os.path.dirname(nhdFlowline)
+   while wksp and not os.path.isdir(wksp):
+      wksp = os.path.dirname(wksp)
+   mtime = 0
+   if wksp:
+      for f in os.listdir(wksp):
+         if f.endswith('.lock'):
+            continue
+         mtime = max(mtime, int(os.path.getmtime(os.path.join(wksp, f))))
+   return {'version': graphVersion, 'source': os.path.abspath(nhdFlowline), 'modified': mtime}
+
+def SaveGraph(graph, graphDir, stamp = None):
+   '''Saves a graph to a directory as .npy files, with a manifest containing the version stamp. The manifest is written last, so a partially written graph is never loaded.'''
+   if not os.path.exists(graphDir):
+      os.makedirs(graphDir)
+   manifest = os.path.join(graphDir, 'manifest.json')
+   if os.path.exists(manifest):
+      os.remove(manifest)
+   for name in savedArrays:
+      numpy.save(os.path.join(graphDir, name + '.npy'), numpy.ascontiguousarray(graph[name]))
+   info = dict(stamp or {'version': graphVersion})
+   info['arrays'] = savedArrays
+   with open(manifest, 'w') as f:
+      json.dump(info, f, indent = 1)
+   printMsg('Saved network graph to %s' % graphDir)
+   return graphDir
+
+def LoadGraph(graphDir, stamp = None, restrictions = defaultRestrictions):
+   '''Loads a saved graph as read-only memory maps. Returns None if there is no saved graph, or if its version stamp does not match the specified stamp.'''
+   manifest = os.path.join(graphDir, 'manifest.json')
+   if not os.path.exists(manifest):
+      return None
+   with open(manifest) as f:
+      info = json.load(f)
+   if info.get('version') != graphVersion:
+      return None
+   if stamp is not None:
+      for k in stamp:
+         if info.get(k) != stamp[k]:
+            printMsg('Saved network graph is out of date with its source.')
+            return None
+   graph = {}
+   for name in info['arrays']:
+      graph[name] = numpy.load(os.path.join(graphDir, name + '.npy'), mmap_mode = 'r')
+   setRestrictions(graph, restrictions)
+   return graph
+
+def defaultGraphDir(nhdFlowline):
+   '''Returns the default location for the saved graph: a folder named "HydroGraph" alongside the flowlines' geodatabase'''
+   gdb = os.path.dirname(nhdFlowline)
+   while gdb and not gdb.lower().endswith('.gdb'):
+      gdb = os.path.dirname(gdb)
+   return os.path.join(os.path.dirname(gdb or os.path.dirname(nhdFlowline)), 'HydroGraph')
+
+def GetGraph(nhdFlowline, graphDir = None, restrictions = defaultRestrictions):
+   '''Loads the saved graph for the NHD flowlines if it is current, or else builds it (see GraphFromNHD) and saves it.
+   Parameters:
+   - nhdFlowline = NHDFlowline feature class
+   - graphDir = directory for the saved graph. If None, a folder named "HydroGraph" alongside the flowlines' geodatabase is used.
+   - restrictions = restriction names separated by ';'
+   '''
+   if graphDir is None:
+      graphDir = defaultGraphDir(nhdFlowline)
+   stamp = sourceStamp(nhdFlowline)
+   graph = LoadGraph(graphDir, stamp, restrictions)
+   if graph is not None:
+      printMsg('Loaded network graph from %s' % graphDir)
+      return graph
+   graph = GraphFromNHD(nhdFlowline, None, restrictions)
+   SaveGraph(graph, graphDir, stamp)
+   return LoadGraph(graphDir, None, restrictions)
+
+### Tracing ###
+def traceNetwork(graph, srcID, srcEdge, srcPos, direction = "DOWN", maxDist = 3218.0, breaks = None):
+   '''Traces the network upstream or downstream from multiple facilities at once, to a maximum distance. Where traces from different facilities would overlap, each portion of the network is assigned to the closest facility (as with the NON_OVERLAP option for service areas). Traces stop at restricted edges and barriers.
+   Returns a structured array of trace segments (see traceDtype), one per facility per edge per break interval. Measures (FromM, ToM) are along the edge in its digitized direction; cumulative lengths are from the facility.
+   Parameters:
+   - graph = network graph from buildGraph
+   - srcID = array of facility IDs
+   - srcEdge = array of edges on which facilities are located (from SnapPoints); facilities with an edge of -1 are skipped
+   - srcPos = array of facility measures along the edges
+   - direction = "DOWN" (with flow) or "UP" (against flow)
+   - maxDist = maximum trace distance
+   - breaks = optional list of break distances at which segments are split, e.g. [1609, 3218]
+   '''
+   down = direction.upper() == "DOWN"
+   elen = graph['elen']
+   blocked = graph['blocked']
+   if down:
+      ptr, idx, endNode = graph['downPtr'], graph['downIdx'], graph['eto']
+   else:
+      ptr, idx, endNode = graph['upPtr'], graph['upIdx'], graph['efrom']
+   hasBarriers = len(graph['bEdge']) > 0
+
+   def travelBarriers(e):
+      # Barrier positions in travel coordinates (distance from the upstream end for downstream traces, and vice versa)
+      if not hasBarriers:
+         return []
+      b = edgeBarriers(graph, e)
+      if not down:
+         b = elen[e] - b
+      return sorted(b)
+
+   entries = {} # edge -> list of (travel coordinate, distance, facility ID)
+   heap = []
+   def enterEdge(e, t, d, fid):
+      entries.setdefault(e, []).append((t, d, fid))
+      for b in travelBarriers(e):
+         if b > t:
+            return
+      dEnd = d + elen[e] - t
+      if dEnd < maxDist:
+         heapq.heappush(heap, (dEnd, fid, endNode[e]))
+
+   # Start from each facility
+   for fid, e, m in zip(srcID, srcEdge, srcPos):
+      if e < 0 or blocked[e]:
+         continue
+      t = m if down else elen[e] - m
+      enterEdge(int(e), float(t), 0.0, fid)
+
+   # Bounded Dijkstra over nodes
+   settled = set()
+   while heap:
+      (d, fid, n) = heapq.heappop(heap)
+      if n in settled:
+         continue
+      settled.add(n)
+      for e in idx[ptr[n]:ptr[n + 1]]:
+         if not blocked[e]:
+            enterEdge(int(e), 0.0, d, fid)
+
+   # Sweep each reached edge to assign portions to the closest facility
+   breaks = sorted([b for b in (breaks or []) if 0 < b < maxDist])
+   pieces = []
+   def emit(e, fid, t0, t1, d0):
+      t1 = min(t1, t0 + maxDist - d0)
+      if t1 <= t0:
+         return
+      cuts = [t0] + [t0 + b - d0 for b in breaks if d0 < b < d0 + t1 - t0] + [t1]
+      for k in range(len(cuts) - 1):
+         a, b = cuts[k], cuts[k + 1]
+         if down:
+            m0, m1 = a, b
+         else:
+            m0, m1 = elen[e] - a, elen[e] - b
+         pieces.append((fid, e, graph['eoid'][e], m0, m1, d0 + a - t0, d0 + b - t0))
+
+   for e in sorted(entries):
+      events = [(t, 0, 0.0, None) for t in travelBarriers(e)] + [(t, 1, d, fid) for (t, d, fid) in entries[e]]
+      events.sort(key = lambda x: (x[0], x[1], x[2]))
+      cur = None # (facility ID, travel coordinate, distance) at start of current portion
+      for (t, kind, d, fid) in events:
+         if kind == 0:
+            if cur is not None:
+               emit(e, cur[0], cur[1], t, cur[2])
+            cur = None
+         else:
+            if cur is None or d < cur[2] + (t - cur[1]) - 1e-9:
+               if cur is not None:
+                  emit(e, cur[0], cur[1], t, cur[2])
+               cur = (fid, t, d)
+      if cur is not None:
+         emit(e, cur[0], cur[1], elen[e], cur[2])
+
+   return numpy.array(pieces, dtype = traceDtype)
+
+def pieceCoords(graph, e, m0, m1):
+   '''Returns the coordinates of the portion of edge e between measures m0 and m1, ordered from m0 to m1'''
+   a, b = graph['vstart'][e], graph['vstart'][e + 1]
+   m = graph['vm'][a:b]
+   x = graph['xy'][a:b]
+   lo, hi = min(m0, m1), max(m0, m1)
+   inner = (m > lo) & (m < hi)
+   pts = numpy.vstack([[numpy.interp(lo, m, x[:,0]), numpy.interp(lo, m, x[:,1])], x[inner], [numpy.interp(hi, m, x[:,0]), numpy.interp(hi, m, x[:,1])]])
+   if m0 > m1:
+      pts = pts[::-1]
+   return pts
+
+### Reading and writing data ###
+def readFlowlines(inFlowlines, where = None):
+   '''Reads flowlines into arrays suitable for buildGraph. Returns a tuple (vxy, vEdge, eoid, ftype, fcode). Only the first part of any multipart line is used. Uses arcpy if available, otherwise GDAL/OGR.
+   Parameters:
+   - inFlowlines = NHDFlowline feature class
+   - where = optional where clause to subset the flowlines
+   '''
+   coords = []
+   eoid = []
+   ftype = []
+   fcode = []
+   if arcpy is not None:
+      with arcpy.da.SearchCursor(inFlowlines, ["OID@", "FType", "FCode", "SHAPE@"], where) as cursor:
+         for row in cursor:
+            if row[3] is None:
+               continue
+            pts = [(p.X, p.Y) for p in row[3].getPart(0) if p]
+            if len(pts) < 2:
+               continue
+            coords.append(pts)
+            eoid.append(row[0])
+            ftype.append(row[1] if row[1] is not None else -1)
+            fcode.append(row[2] if row[2] is not None else -1)
+   else:
+      from osgeo import ogr
+      ds = ogr.Open(os.path.dirname(inFlowlines))
+      lyr = ds.GetLayerByName(os.path.basename(inFlowlines))
+      if where:
+         lyr.SetAttributeFilter(where)
+      for feat in lyr:
+         geom = feat.GetGeometryRef()
+         if geom is None:
+            continue
+         if geom.GetGeometryCount() > 0:
+            geom = geom.GetGeometryRef(0)
+         pts = [(p[0], p[1]) for p in geom.GetPoints()]
+         if len(pts) < 2:
+            continue
+         coords.append(pts)
+         eoid.append(feat.GetFID())
+         ftype.append(feat.GetField("FType") if feat.GetField("FType") is not None else -1)
+         fcode.append(feat.GetField("FCode") if feat.GetField("FCode") is not None else -1)
+   counts = [len(c) for c in coords]
+   vxy = numpy.array([p for c in coords for p in c], dtype = numpy.float64).reshape(-1, 2)
+   vEdge = numpy.repeat(numpy.arange(len(coords)), counts)
+   return (vxy, vEdge, numpy.array(eoid, dtype = numpy.int64), numpy.array(ftype), numpy.array(fcode))
+
+def readLineMidpoints(inLines, where = None):
+   '''Returns an N x 2 array of the midpoints of lines, e.g. DamWeir features used as barriers. Uses arcpy if available, otherwise GDAL/OGR.'''
+   pts = []
+   if arcpy is not None:
+      with arcpy.da.SearchCursor(inLines, ["SHAPE@"], where) as cursor:
+         for row in cursor:
+            if row[0] is not None:
+               p = row[0].positionAlongLine(0.5, True).firstPoint
+               pts.append((p.X, p.Y))
+   else:
+      from osgeo import ogr
+      ds = ogr.Open(os.path.dirname(inLines))
+      lyr = ds.GetLayerByName(os.path.basename(inLines))
+      if where:
+         lyr.SetAttributeFilter(where)
+      for feat in lyr:
+         geom = feat.GetGeometryRef()
+         if geom is None:
+            continue
+         if geom.GetGeometryCount() > 0:
+            geom = geom.GetGeometryRef(0)
+         linePts = numpy.array(geom.GetPoints())[:, :2]
+         seg = numpy.hypot(numpy.diff(linePts[:,0]), numpy.diff(linePts[:,1]))
+         cm = numpy.concatenate([[0], numpy.cumsum(seg)])
+         half = cm[-1]/2.0
+         pts.append((numpy.interp(half, cm, linePts[:,0]), numpy.interp(half, cm, linePts[:,1])))
+   return numpy.array(pts, dtype = numpy.float64).reshape(-1, 2)
+
+def GraphFromNHD(nhdFlowline, nhdLine = None, restrictions = defaultRestrictions):
+   '''Builds a network graph from NHD data, with the same restrictions and DamWeir barriers as the HydroNet service layers.
+   Parameters:
+   - nhdFlowline = NHDFlowline feature class
+   - nhdLine = NHDLine feature class, from which DamWeir (FType 343) features are used as barriers. If None, the NHDLine feature class in the same location as the flowlines is used, if it exists.
+   - restrictions = restriction names separated by ';'
+   '''
+   printMsg('Reading flowlines...')
+   (vxy, vEdge, eoid, ftype, fcode) = readFlowlines(nhdFlowline)
+   graph = buildGraph(vxy, vEdge, eoid, ftype, fcode, restrictions)
+   if nhdLine is None:
+      nhdLine = os.path.dirname(nhdFlowline) + os.sep + "NHDLine"
+      if arcpy is not None and not arcpy.Exists(nhdLine):
+         nhdLine = None
+   if nhdLine:
+      printMsg('Adding dam barriers...')
+      bxy = readLineMidpoints(nhdLine, "FType = 343")
+      numBarriers = addBarriers(graph, bxy)
+      printMsg('Added %s of %s dam barriers' % (numBarriers, len(bxy)))
+   return graph
+
+def TraceFacilities(graph, in_Points, out_Lines, direction = "DOWN", maxDist = 3218.0, breaks = None, tolerance = 500.0):
+   '''Traces the network from facility points and writes the trace segments to a line feature class, with the fields FacilityID (the ObjectID of the point), SourceOID (the ObjectID of the flowline), FromCumul_Length and ToCumul_Length. Requires arcpy.
+   Parameters:
+   - graph = network graph from buildGraph
+   - in_Points = input facility points
+   - out_Lines = output trace lines
+   - direction = "DOWN" or "UP"
+   - maxDist = maximum trace distance
+   - breaks = optional list of break distances at which lines are split
+   - tolerance = search tolerance for locating points on the network
+   '''
+   arr = arcpy.da.FeatureClassToNumPyArray(in_Points, ["OID@", "SHAPE@XY"])
+   fids = arr["OID@"]
+   pxy = arr["SHAPE@XY"]
+   (srcEdge, srcPos, srcDist, failed) = SnapPoints(graph, pxy, tolerance)
+   if len(failed) > 0:
+      printWrng('%s points could not be snapped to the network within %s map units, and were not traced. ObjectIDs: %s' % (len(failed), tolerance, str([int(f) for f in fids[failed]])))
+
+   printMsg('Tracing %s...' % direction.lower())
+   pieces = traceNetwork(graph, fids, srcEdge, srcPos, direction, maxDist, breaks)
+
+   printMsg('Writing %s trace segments...' % len(pieces))
+   sr = arcpy.Describe(in_Points).spatialReference
+   outDir = os.path.dirname(out_Lines)
+   outName = os.path.basename(out_Lines)
+   if arcpy.Exists(out_Lines):
+      arcpy.Delete_management(out_Lines)
+   arcpy.CreateFeatureclass_management (outDir, outName, "POLYLINE", "", "", "", sr)
+   for (fld, fldType) in [("FacilityID", "LONG"), ("SourceOID", "LONG"), ("FromCumul_Length", "DOUBLE"), ("ToCumul_Length", "DOUBLE")]:
+      arcpy.AddField_management(out_Lines, fld, fldType)
+   with BulkWriter(out_Lines) as writer:
+      for p in pieces:
+         pts = pieceCoords(graph, p['EdgeID'], p['FromM'], p['ToM'])
+         line = arcpy.Polyline(arcpy.Array([arcpy.Point(x, y) for (x, y) in pts]), sr)
+         writer.add(line, {"FacilityID": int(p['FacilityID']), "SourceOID": int(p['SourceOID']), "FromCumul_Length": float(p['FromCumul_Length']), "ToCumul_Length": float(p['ToCumul_Length'])})
+   return out_Lines
@@ -0,0 +1,1017 @@
+# ----------------------------------------------------------------------------------------
+# libRasterFx.py
+# Version:  ArcGIS 10.3.1 / Python 2.7.8
+# Creation Date: 2026-10-18
+# Last Edit: 2026-10-19
+# Creator:  Kirsten R. Hazler
+
+# Summary:
+# Native raster functions, which need no Spatial Analyst license. The main one is a D8 flow-length engine for delineating catchment buffers around Stream Conservation Units (SCUs), as an alternative to the Spatial Analyst tools (Watershed, FlowLength, Con, etc.) used in CreateFlowBuffers_scu. A window of the flow direction raster is read into a numpy array, SCU polygons are rasterized as sinks, and the downstream flow distance to the sinks is computed by a breadth-first search up the reverse flow tree. Cells that never reach a sink are outside the (truncated) upstream watershed, so no separate watershed step is needed. The resulting cell masks are traced into polygons in memory, dropping fragments not connected to the SCU. There is also a zonal statistics engine for overlapping polygons.
+
+# Usage Tips:
+# The core functions only need numpy, so they also run without ArcGIS. Reading and writing rasters and features requires arcpy, but not the Spatial Analyst extension.
+# Open large rasters as a TiledRaster, so that windows for many features are served from a shared tile cache rather than clipped one by one.
+# For repeated runs over the same flow direction raster, build a FlowIndex once; catchment and flow-length queries on it are array slices rather than traversals.
+# Flow direction codes are the ESRI D8 codes: 1 = E, 2 = SE, 4 = S, 8 = SW, 16 = W, 32 = NW, 64 = N, 128 = NE. Any other value (including NoData) is treated as having no outflow.
+
+# ----------------------------------------------------------------------------------------
+
+# Import modules
+import os, sys, math, hashlib, json
+import numpy
+from collections import OrderedDict
+try:
+   import arcpy
+   from Helper import printMsg, printWrng
+except:
+   arcpy = None
+   def printMsg(msg):
+      print(msg)
+   def printWrng(msg):
+      print('Warning: %s' % msg)
+
+# D8 codes, with the (row, column) offset to the downstream cell. Rows increase southward.
+d8Offsets = [(1, 0, 1), (2, 1, 1), (4, 1, 0), (8, 1, -1), (16, 0, -1), (32, -1, -1), (64, -1, 0), (128, -1, 1)]
+
+### D8 flow routing ###
+def d8Targets(fdir, cellSize):
+   '''Returns a tuple (target, step) of flat arrays: the flat index of the downstream cell for each cell (-1 where there is no outflow, or flow leaves the window), and the flow length to it.
+   Parameters:
+   - fdir = 2D array of D8 flow direction codes
+   - cellSize = cell size in map units
+   '''
+   (nRows, nCols) = fdir.shape
+   f = fdir.ravel()
+   idxType = numpy.int32 if f.size < 2**31 else numpy.int64
+   target = -numpy.ones(f.size, dtype = idxType)
+   step = numpy.zeros(f.size, dtype = numpy.float64)
+   for (code, dr, dc) in d8Offsets:
+      idx = numpy.flatnonzero(f == code)
+      if len(idx) == 0:
+         continue
+      r = idx // nCols + dr
+      c = idx % nCols + dc
+      ok = (r >= 0) & (r < nRows) & (c >= 0) & (c < nCols)
+      target[idx[ok]] = (r[ok]*nCols + c[ok]).astype(idxType)
+      if dr != 0 and dc != 0:
+         step[idx[ok]] = cellSize*math.sqrt(2.0)
+      else:
+         step[idx[ok]] = cellSize
+   return (target, step)
+
+def donorIndex(target):
+   '''Builds the reverse flow tree. Returns a tuple (order, ptr) such that the cells draining directly into cell i are order[ptr[i]:ptr[i+1]].'''
+   valid = numpy.flatnonzero(target >= 0)
+   order = valid[numpy.argsort(target[valid], kind = 'mergesort')]
+   counts = numpy.bincount(target[valid], minlength = len(target))
+   ptr = numpy.concatenate([[0], numpy.cumsum(counts)])
+   return (order, ptr)
+
+def donorsOf(cells, order, ptr):
+   '''Returns a tuple (donors, receivers): all cells draining directly into the specified cells, with the cell each one drains into'''
+   starts = ptr[cells]
+   lens = ptr[cells + 1] - starts
+   total = int(lens.sum())
+   if total == 0:
+      empty = numpy.zeros(0, dtype = order.dtype)
+      return (empty, empty)
+   offs = numpy.repeat(starts - numpy.concatenate([[0], numpy.cumsum(lens)[:-1]]), lens) + numpy.arange(total)
+   return (order[offs], numpy.repeat(cells, lens))
+
+def FlowLabels(fdir, labels, cellSize, maxDist = None):
+   '''Labels each cell with the first sink it drains into, and computes the downstream flow distance to it, in a single breadth-first search up the reverse flow tree from all sinks at once. Returns a tuple (lab, dist, drains): lab is a 2D array of sink labels (0 where a cell drains to no sink within maxDist), dist is a 2D array of flow distances (sinks are 0, and unlabelled cells are NaN), and drains is an N x 2 array of the distinct label pairs (a, b) where the outflow of sink a reaches sink b within maxDist.
+   Parameters:
+   - fdir = 2D array of D8 flow direction codes
+   - labels = 2D integer array of sink labels, 0 for cells that are not sinks
+   - cellSize = cell size in map units
+   - maxDist = if set, the search stops at this distance
+   '''
+   (target, step) = d8Targets(fdir, cellSize)
+   lab = labels.ravel().copy()
+   sinkIdx = numpy.flatnonzero(lab > 0)
+   
+   sinkTarget = target[sinkIdx]
+   target[sinkIdx] = -1
+   
+   (order, ptr) = donorIndex(target)
+   dist = numpy.ones(target.size)*numpy.nan
+   dist[sinkIdx] = 0.0
+   frontier = sinkIdx
+   while len(frontier) > 0:
+      (donors, receivers) = donorsOf(frontier, order, ptr)
+      d = dist[receivers] + step[donors]
+      keep = numpy.isnan(dist[donors])
+      if maxDist is not None:
+         # Distance only increases upstream, so pruning here is exact
+         keep &= (d <= maxDist)
+      frontier = donors[keep]
+      dist[frontier] = d[keep]
+      lab[frontier] = lab[receivers[keep]]
+   
+   # Find sinks whose outflow reaches other sinks
+   ok = sinkTarget >= 0
+   a = lab[sinkIdx[ok]]
+   b = lab[sinkTarget[ok]]
+   hit = (b > 0) & (b != a)
+   if hit.any():
+      # Distinct pairs, sorted (numpy.unique needs NumPy 1.13 to work on rows)
+      drains = numpy.array(sorted(set(zip(a[hit].tolist(), b[hit].tolist()))), dtype = lab.dtype)
+   else:
+      drains = numpy.zeros((0, 2), dtype = lab.dtype)
+   return (lab.reshape(fdir.shape), dist.reshape(fdir.shape), drains)
+
+def FlowDistance(fdir, sinks, cellSize, maxDist = None):
+   '''Computes the downstream flow distance from each cell to the sink cells along the D8 flow path (see FlowLabels). This is equivalent to FlowLength (DOWNSTREAM) on a flow direction raster with the sinks burned in as NoData, masked to the Watershed of the sinks. Returns a 2D array of distances; sinks are 0, and cells not draining to a sink (or beyond maxDist) are NaN.
+   Parameters:
+   - fdir = 2D array of D8 flow direction codes
+   - sinks = 2D boolean array marking the sink cells
+   - cellSize = cell size in map units
+   - maxDist = if set, the search stops at this distance
+   '''
+   return FlowLabels(fdir, sinks.astype(numpy.int8), cellSize, maxDist)[1]
+
+### Upstream index ###
+class FlowIndex(object):
+   '''A precomputed index of the D8 flow tree of a whole flow direction raster, for answering catchment and flow-length queries without traversing the tree. Cells are numbered in depth-first (preorder) sequence up the reverse flow tree from each outlet, so the cells draining to any cell c (including c) are exactly those numbered pre[c] to pre[c] + size[c] - 1. The downstream flow distance to the outlet is stored in the same sequence, so the flow distance from each upstream cell down to c is a slice minus a constant. The index is saved as .npy files in a directory, and memory-mapped when opened, so it can be built once for the statewide raster and shared by many runs.
+   
+   Open an existing index with FlowIndex(indexDir), or build one with FlowIndex.build. The index records a version stamp of the flow direction raster it was built from (see TiledRaster.sourceStamp); an index opened with a different stamp is refused.
+   Parameters:
+   - indexDir = directory containing the index files
+   - stamp = optional version stamp of the flow direction raster. If supplied and it does not match the stamp of the index, a ValueError is raised.
+   '''
+   arrays = ["pre", "size", "order", "dist"]
+   bytesPerCell = 60
+   
+   def __init__(self, indexDir, stamp = None):
+      self.indexDir = indexDir
+      with open(os.path.join(indexDir, 'info.json')) as f:
+         info = json.load(f)
+      if stamp is not None and info.get("stamp") != stamp:
+         raise ValueError("Flow index in %s is out of date with its flow direction raster" % indexDir)
+      if arcpy is not None:
+         sr = arcpy.SpatialReference()
+         sr.loadFromString(info["sr"])
+         info["sr"] = sr
+      self.info = info
+      for a in self.arrays:
+         setattr(self, a, numpy.load(os.path.join(indexDir, a + '.npy'), mmap_mode = 'r'))
+   
+   @classmethod
+   def build(cls, in_FlowDir, indexDir):
+      '''Builds an index from a D8 flow direction raster (or a TiledRaster of it), saves it to a directory, and returns it opened.
+      The whole raster is processed in memory at once, not in tiles. Peak memory use is about 60 bytes per cell (see bytesPerCell; the flow directions, plus flat arrays of targets, step lengths, donors, preorder numbers, sizes and distances), e.g. about 6 GB for a raster of 100 million cells. 32-bit ArcGIS Desktop cannot address this for rasters of more than about 30 million cells, so build large indexes with 64-bit Python (e.g. with 64-bit background geoprocessing installed).'''
+      if not isinstance(in_FlowDir, TiledRaster):
+         in_FlowDir = TiledRaster(in_FlowDir)
+      info = in_FlowDir.info
+      window = (info["left"], info["top"], info["nRows"], info["nCols"])
+      nCells = info["nRows"]*info["nCols"]
+      printMsg('Reading %s x %s cells of flow direction; building the index needs about %.1f GB of memory...' % (info["nRows"], info["nCols"], nCells*cls.bytesPerCell/1024.0**3))
+      fdir = readWindow(in_FlowDir, info, window)
+      (target, step) = d8Targets(fdir, info["cellSize"])
+      del fdir
+      (pre, size, dist) = preorderIndex(target, step)
+      order = numpy.empty_like(pre)
+      order[pre] = numpy.arange(len(pre), dtype = pre.dtype)
+      
+      printMsg('Saving index to %s...' % indexDir)
+      if not os.path.exists(indexDir):
+         os.makedirs(indexDir)
+      numpy.save(os.path.join(indexDir, 'pre.npy'), pre)
+      numpy.save(os.path.join(indexDir, 'size.npy'), size)
+      numpy.save(os.path.join(indexDir, 'order.npy'), order)
+      numpy.save(os.path.join(indexDir, 'dist.npy'), dist[order])
+      sr = info["sr"]
+      if hasattr(sr, "exportToString"):
+         sr = sr.exportToString()
+      meta = dict(info)
+      meta["sr"] = str(sr)
+      meta["stamp"] = in_FlowDir.sourceStamp()
+      with open(os.path.join(indexDir, 'info.json'), 'w') as f:
+         json.dump(meta, f)
+      return cls(indexDir)
+   
+   def cellsOf(self, window, mask):
+      '''Returns the flat raster indices of the True cells of a 2D boolean array on a window (left, top, nRows, nCols) of the raster grid'''
+      cs = self.info["cellSize"]
+      r0 = int(round((self.info["top"] - window[1])/cs))
+      c0 = int(round((window[0] - self.info["left"])/cs))
+      (r, c) = numpy.nonzero(mask)
+      return (r + r0).astype(numpy.int64)*self.info["nCols"] + (c + c0)
+   
+   def upstream(self, cells, maxDist = None):
+      '''Returns a tuple (up, dist): the flat raster indices of all cells draining to a set of cells (including the cells themselves), and the downstream flow distance from each to the first cell of the set it reaches. This is equivalent to a Watershed of the cell set, followed by FlowLength (DOWNSTREAM) with the cells burned in as sinks.
+      Parameters:
+      - cells = flat raster indices of the sink cells
+      - maxDist = if set, only cells within this flow distance are returned
+      '''
+      cells = numpy.unique(cells)
+      starts = numpy.asarray(self.pre[cells], dtype = numpy.int64)
+      srt = numpy.argsort(starts, kind = 'mergesort')
+      cells = cells[srt]
+      starts = starts[srt]
+      ends = starts + self.size[cells]
+      base = self.dist[starts]
+      
+      # Intervals are nested or disjoint; split them into runs sharing the same innermost (i.e., nearest downstream) sink
+      (segStart, segEnd, segSink) = ([], [], [])
+      stack = []
+      cur = 0
+      for k in range(len(cells)):
+         s = starts[k]
+         while stack and ends[stack[-1]] <= s:
+            top = stack.pop()
+            if cur < ends[top]:
+               segStart.append(cur)
+               segEnd.append(ends[top])
+               segSink.append(top)
+            cur = ends[top]
+         if stack and cur < s:
+            segStart.append(cur)
+            segEnd.append(s)
+            segSink.append(stack[-1])
+         stack.append(k)
+         cur = s
+      while stack:
+         top = stack.pop()
+         if cur < ends[top]:
+            segStart.append(cur)
+            segEnd.append(ends[top])
+            segSink.append(top)
+         cur = ends[top]
+      
+      (up, dist) = ([], [])
+      for (a, b, k) in zip(segStart, segEnd, segSink):
+         d = self.dist[a:b] - base[k]
+         if maxDist is None:
+            up.append(self.order[a:b])
+            dist.append(d)
+         else:
+            keep = numpy.flatnonzero(d <= maxDist)
+            up.append(self.order[a:b][keep])
+            dist.append(d[keep])
+      if not up:
+         return (numpy.zeros(0, dtype = numpy.int64), numpy.zeros(0))
+      return (numpy.concatenate(up), numpy.concatenate(dist))
+
+def preorderIndex(target, step):
+   '''Numbers the cells of a flow tree in depth-first preorder, from each outlet up the reverse flow tree, one level at a time. Returns a tuple (pre, size, dist) of flat arrays: the preorder number of each cell, the number of cells draining to it (including itself), and its downstream flow distance to its outlet.
+   Parameters:
+   - target = flat array of downstream cells, -1 for outlets (see d8Targets)
+   - step = flat array of flow lengths to the downstream cells
+   '''
+   n = len(target)
+   (order, ptr) = donorIndex(target)
+   
+   # Breadth-first levels up from the outlets, keeping donors grouped by receiver
+   roots = numpy.flatnonzero(target < 0)
+   levels = []
+   frontier = roots
+   reached = len(roots)
+   while len(frontier) > 0:
+      (donors, receivers) = donorsOf(frontier, order, ptr)
+      if len(donors) == 0:
+         break
+      levels.append((donors, receivers))
+      reached += len(donors)
+      frontier = donors
+   if reached < n:
+      # Cells in flow loops never reach an outlet; each is indexed as its own outlet
+      seen = numpy.zeros(n, dtype = bool)
+      seen[roots] = True
+      for (donors, receivers) in levels:
+         seen[donors] = True
+      loops = numpy.flatnonzero(~seen)
+      printWrng('%s cells are in or drain into flow direction loops, and are treated as outlets' % len(loops))
+      roots = numpy.concatenate([roots, loops])
+   
+   # Count cells draining to each cell, from the top level down
+   size = numpy.ones(n, dtype = target.dtype)
+   for (donors, receivers) in reversed(levels):
+      brk = numpy.flatnonzero(numpy.diff(receivers)) + 1
+      starts = numpy.concatenate([[0], brk])
+      size[receivers[starts]] += numpy.add.reduceat(size[donors], starts)
+   
+   # Number the cells, each after its receiver and the earlier donors to the same receiver
+   pre = numpy.empty(n, dtype = target.dtype)
+   dist = numpy.empty(n, dtype = numpy.float64)
+   pre[roots] = numpy.cumsum(size[roots]) - size[roots]
+   dist[roots] = 0.0
+   for (donors, receivers) in levels:
+      s = size[donors]
+      cum = numpy.cumsum(s) - s
+      brk = numpy.concatenate([[True], receivers[1:] != receivers[:-1]])
+      first = numpy.maximum.accumulate(numpy.where(brk, numpy.arange(len(donors)), 0))
+      pre[donors] = pre[receivers] + 1 + cum - cum[first]
+      dist[donors] = dist[receivers] + step[donors]
+   return (pre, size, dist)
+
+### Rasterization ###
+def rasterizeRings(rings, left, top, cellSize, nRows, nCols):
+   '''Rasterizes polygon rings by scanline, using the even-odd rule at cell centers, so holes are honored. If no cell center falls inside the polygon (e.g. a sliver narrower than a cell), the cells containing the vertices are marked instead. Returns a 2D boolean array.
+   Parameters:
+   - rings = list of N x 2 arrays of ring coordinates
+   - left, top = coordinates of the upper left corner of the grid
+   - cellSize = cell size in map units
+   - nRows, nCols = grid dimensions
+   '''
+   mask = numpy.zeros((nRows, nCols), dtype = bool)
+   edges = []
+   for ring in rings:
+      ring = numpy.asarray(ring, dtype = numpy.float64)
+      if len(ring) < 3:
+         continue
+      if not numpy.array_equal(ring[0], ring[-1]):
+         ring = numpy.vstack([ring, ring[:1]])
+      edges.append(numpy.hstack([ring[:-1], ring[1:]]))
+   if not edges:
+      return mask
+   e = numpy.vstack(edges)
+   (x1, y1, x2, y2) = (e[:,0], e[:,1], e[:,2], e[:,3])
+   ylo = numpy.minimum(y1, y2)
+   yhi = numpy.maximum(y1, y2)
+
+   # Rows whose center line y satisfies ylo <= y < yhi
+   rFirst = numpy.floor((top - yhi)/cellSize - 0.5).astype(numpy.int64) + 1
+   rLast = numpy.floor((top - ylo)/cellSize - 0.5).astype(numpy.int64)
+   rFirst = numpy.maximum(rFirst, 0)
+   rLast = numpy.minimum(rLast, nRows - 1)
+   n = numpy.maximum(rLast - rFirst + 1, 0)
+   n[y1 == y2] = 0
+   total = int(n.sum())
+   if total > 0:
+      eIdx = numpy.repeat(numpy.arange(len(e)), n)
+      rows = numpy.repeat(rFirst, n) + numpy.arange(total) - numpy.repeat(numpy.cumsum(n) - n, n)
+      y = top - (rows + 0.5)*cellSize
+      x = x1[eIdx] + (y - y1[eIdx])*(x2[eIdx] - x1[eIdx])/(y2[eIdx] - y1[eIdx])
+      srt = numpy.lexsort((x, rows))
+      rows = rows[srt]
+      x = x[srt]
+
+      # Crossings pair up within each row; fill the cell centers between each pair
+      rr = rows[0::2]
+      c0 = numpy.clip(numpy.ceil((x[0::2] - left)/cellSize - 0.5), 0, nCols).astype(numpy.int64)
+      c1 = numpy.clip(numpy.ceil((x[1::2] - left)/cellSize - 0.5), 0, nCols).astype(numpy.int64)
+      # Span starts minus span ends per cell, via bincount (ufunc.at needs NumPy 1.8)
+      size = nRows*(nCols + 1)
+      diff = numpy.bincount(rr*(nCols + 1) + c0, minlength = size) - numpy.bincount(rr*(nCols + 1) + c1, minlength = size)
+      mask = numpy.cumsum(diff.reshape(nRows, nCols + 1), axis = 1)[:, :nCols] > 0
+
+   if not mask.any():
+      c = numpy.floor((e[:,0] - left)/cellSize).astype(numpy.int64)
+      r = numpy.floor((top - e[:,1])/cellSize).astype(numpy.int64)
+      ok = (r >= 0) & (r < nRows) & (c >= 0) & (c < nCols)
+      mask[r[ok], c[ok]] = True
+   return mask
+
+def rasterizeClip(rings, left, top, cellSize, nRows, nCols):
+   '''Rasterizes polygon rings (see rasterizeRings) on the part of a grid covering their bounding box, so that small polygons on a large grid are cheap. Returns a tuple (r0, c0, mask) giving the offset of the mask within the grid, or None if the polygon is off the grid.'''
+   if not rings:
+      return None
+   pts = numpy.vstack(rings)
+   c0 = max(int(math.floor((pts[:,0].min() - left)/cellSize)), 0)
+   c1 = min(int(math.ceil((pts[:,0].max() - left)/cellSize)), nCols)
+   r0 = max(int(math.floor((top - pts[:,1].max())/cellSize)), 0)
+   r1 = min(int(math.ceil((top - pts[:,1].min())/cellSize)), nRows)
+   if r1 <= r0 or c1 <= c0:
+      return None
+   mask = rasterizeRings(rings, left + c0*cellSize, top - r0*cellSize, cellSize, r1 - r0, c1 - c0)
+   return (r0, c0, mask)
+
+### Tiled raster access ###
+class TiledRaster(object):
+   '''Windowed access to a large raster. The raster is read in square tiles, which are kept in a least-recently-used cache within a memory bound, so that windows for nearby features reuse tiles already decoded. A window within a single tile is returned as a view of the cached tile, so it must not be modified. Sources are opened once with GDAL (e.g. GeoTIFF or IMG) if it is available, and otherwise read with arcpy. An optional on-disk tier stores decoded tiles as .npy files, which are memory-mapped on later use.
+   Parameters:
+   - in_Raster = input raster
+   - tileSize = tile width and height, in cells
+   - maxMB = memory bound for cached tiles, in megabytes
+   - nodata = value substituted for NoData cells. If NaN, cells are returned as floating point.
+   - cacheDir = optional directory for storing decoded tiles on disk, so that they can be reused in later runs
+   '''
+   def __init__(self, in_Raster, tileSize = 1024, maxMB = 256, nodata = 0, cacheDir = None):
+      self.path = in_Raster
+      if arcpy is not None:
+         self.path = arcpy.Describe(in_Raster).catalogPath
+      self.tileSize = tileSize
+      self.maxBytes = int(maxMB*1024*1024)
+      self.nodata = nodata
+      self.cache = OrderedDict()
+      self.curBytes = 0
+      self.hits = 0
+      self.diskHits = 0
+      self.misses = 0
+      self.ds = None
+      try:
+         from osgeo import gdal
+         self.ds = gdal.Open(self.path)
+      except:
+         self.ds = None
+      if self.ds is not None:
+         gt = self.ds.GetGeoTransform()
+         self.band = self.ds.GetRasterBand(1)
+         self.srcNodata = self.band.GetNoDataValue()
+         if arcpy is not None:
+            sr = arcpy.Describe(self.path).spatialReference
+         else:
+            sr = self.ds.GetProjection()
+         self.info = {"left": gt[0], "top": gt[3], "cellSize": gt[1], "nRows": self.ds.RasterYSize, "nCols": self.ds.RasterXSize, "sr": sr}
+      else:
+         self.info = rasterInfo(self.path)
+         self.srcNodata = arcpy.Raster(self.path).noDataValue
+      self.modified = self.sourceModified()
+      self.cacheDir = None
+      if cacheDir:
+         # Tiles are stored under a stamp of the source, so they are not reused if it changes
+         h = hashlib.sha1()
+         h.update(repr((os.path.abspath(self.path), self.modified, tileSize, repr(nodata))).encode('utf-8'))
+         self.cacheDir = os.path.join(cacheDir, h.hexdigest())
+         if not os.path.exists(self.cacheDir):
+            os.makedirs(self.cacheDir)
+   
+   def sourceModified(self):
+      '''Returns the latest modification time of the source, or of its workspace if it is not a file (ignoring lock files, which are written whenever the workspace is read)'''
+      path = self.path
+      while path and not os.path.exists(path):
+         path = os.path.dirname(path)
+      if not path:
+         return 0
+      if os.path.isdir(path):
+         return max([0] + [int(os.path.getmtime(os.path.join(path, f))) for f in os.listdir(path) if not f.endswith('.lock')])
+      return int(os.path.getmtime(path))
+   
+   def sourceStamp(self):
+      '''Returns a version stamp for the source: its path, latest modification time when opened, and grid (left, top, cellSize, nRows, nCols). If the source is in a geodatabase, the modification time is that of the geodatabase, so writing any output there also changes the stamp.'''
+      grid = [self.info[k] for k in ["left", "top", "cellSize", "nRows", "nCols"]]
+      return {"source": os.path.abspath(self.path), "modified": self.modified, "grid": grid}
+   
+   def readTile(self, tr, tc):
+      '''Reads and decodes a tile from the source'''
+      ts = self.tileSize
+      cs = self.info["cellSize"]
+      r0 = tr*ts
+      c0 = tc*ts
+      nr = min(ts, self.info["nRows"] - r0)
+      nc = min(ts, self.info["nCols"] - c0)
+      useNaN = isinstance(self.nodata, float) and math.isnan(self.nodata)
+      if self.ds is not None:
+         arr = self.band.ReadAsArray(c0, r0, nc, nr)
+      elif useNaN or self.srcNodata is None:
+         arr = arcpy.RasterToNumPyArray(self.path, arcpy.Point(self.info["left"] + c0*cs, self.info["top"] - (r0 + nr)*cs), nc, nr)
+      else:
+         return arcpy.RasterToNumPyArray(self.path, arcpy.Point(self.info["left"] + c0*cs, self.info["top"] - (r0 + nr)*cs), nc, nr, self.nodata)
+      if useNaN:
+         arr = arr.astype(numpy.float64)
+      if self.srcNodata is not None:
+         arr[arr == self.srcNodata] = self.nodata
+      return arr
+   
+   def tilePath(self, tr, tc):
+      return os.path.join(self.cacheDir, 'tile_%s_%s.npy' % (tr, tc))
+   
+   def getTile(self, tr, tc):
+      '''Returns a tile, from the cache if possible'''
+      key = (tr, tc)
+      if key in self.cache:
+         arr = self.cache.pop(key)
+         self.cache[key] = arr # Move to most-recently-used position
+         self.hits += 1
+         return arr
+      if self.cacheDir and os.path.exists(self.tilePath(tr, tc)):
+         arr = numpy.load(self.tilePath(tr, tc), mmap_mode = 'r')
+         self.diskHits += 1
+      else:
+         arr = self.readTile(tr, tc)
+         self.misses += 1
+         if self.cacheDir:
+            tmpPath = self.tilePath(tr, tc) + '.tmp'
+            with open(tmpPath, 'wb') as f:
+               numpy.save(f, arr)
+            if os.path.exists(self.tilePath(tr, tc)):
+               os.remove(self.tilePath(tr, tc))
+            os.rename(tmpPath, self.tilePath(tr, tc))
+      self.store(key, arr)
+      return arr
+   
+   def store(self, key, arr):
+      '''Adds a tile to the cache, evicting least-recently-used tiles as needed to stay within the memory bound'''
+      if arr.nbytes > self.maxBytes:
+         return
+      self.cache[key] = arr
+      self.curBytes += arr.nbytes
+      while self.curBytes > self.maxBytes:
+         oldKey, oldArr = self.cache.popitem(last = False)
+         self.curBytes -= oldArr.nbytes
+   
+   def read(self, window):
+      '''Returns a 2D array of the cells in a window (left, top, nRows, nCols) on the raster grid, as from rasterWindow'''
+      (left, top, nRows, nCols) = window
+      ts = self.tileSize
+      cs = self.info["cellSize"]
+      r0 = int(round((self.info["top"] - top)/cs))
+      c0 = int(round((left - self.info["left"])/cs))
+      if nRows <= 0 or nCols <= 0:
+         return numpy.zeros((max(nRows, 0), max(nCols, 0)), dtype = self.getTile(0, 0).dtype)
+      (tr0, tr1) = (r0//ts, (r0 + nRows - 1)//ts)
+      (tc0, tc1) = (c0//ts, (c0 + nCols - 1)//ts)
+      if tr0 == tr1 and tc0 == tc1:
+         tile = self.getTile(tr0, tc0)
+         return tile[r0 - tr0*ts:r0 - tr0*ts + nRows, c0 - tc0*ts:c0 - tc0*ts + nCols]
+      out = None
+      for tr in range(tr0, tr1 + 1):
+         for tc in range(tc0, tc1 + 1):
+            tile = self.getTile(tr, tc)
+            if out is None:
+               out = numpy.empty((nRows, nCols), dtype = tile.dtype)
+            # Overlap of the tile and the window, in raster cell coordinates
+            ra = max(r0, tr*ts)
+            rb = min(r0 + nRows, tr*ts + tile.shape[0])
+            ca = max(c0, tc*ts)
+            cb = min(c0 + nCols, tc*ts + tile.shape[1])
+            out[ra - r0:rb - r0, ca - c0:cb - c0] = tile[ra - tr*ts:rb - tr*ts, ca - tc*ts:cb - tc*ts]
+      return out
+   
+   def report(self):
+      '''Prints hit-rate statistics'''
+      lookups = self.hits + self.diskHits + self.misses
+      if lookups > 0:
+         rate = 100.0*(self.hits + self.diskHits)/lookups
+      else:
+         rate = 0.0
+      printMsg('Raster tile cache for %s: %s lookups, %s memory hits, %s disk hits, %s misses (hit rate %.1f%%). %s tiles (%.1f MB) held in memory.' % (os.path.basename(self.path), lookups, self.hits, self.diskHits, self.misses, rate, len(self.cache), self.curBytes/1048576.0))
+
+### Reading and writing data ###
+def geomRings(geom):
+   '''Returns the rings of an arcpy polygon geometry as a list of N x 2 arrays'''
+   rings = []
+   for part in geom:
+      pts = []
+      for pt in part:
+         if pt:
+            pts.append((pt.X, pt.Y))
+         elif pts:
+            # A null point separates an interior ring
+            rings.append(numpy.array(pts))
+            pts = []
+      if pts:
+         rings.append(numpy.array(pts))
+   return rings
+
+def rasterInfo(in_Raster):
+   '''Returns a dictionary of the grid properties of a raster (or TiledRaster): left, top, cellSize, nRows, nCols and sr. Requires arcpy, unless the input is a TiledRaster read with GDAL.'''
+   if isinstance(in_Raster, TiledRaster):
+      return in_Raster.info
+   desc = arcpy.Describe(in_Raster)
+   ext = desc.extent
+   cellSize = float(desc.meanCellWidth)
+   return {"left": ext.XMin, "top": ext.YMax, "cellSize": cellSize, "nRows": int(round((ext.YMax - ext.YMin)/cellSize)), "nCols": int(round((ext.XMax - ext.XMin)/cellSize)), "sr": desc.spatialReference}
+
+def rasterWindow(info, extent, pad = 0.0):
+   '''Returns a window (left, top, nRows, nCols) on the raster grid, covering the extent plus padding, clipped to the raster
+   Parameters:
+   - info = raster grid properties from rasterInfo
+   - extent = arcpy extent (or any object with XMin, YMin, XMax, YMax)
+   - pad = padding distance in map units
+   '''
+   cs = info["cellSize"]
+   c0 = max(int(math.floor((extent.XMin - pad - info["left"])/cs)), 0)
+   c1 = min(int(math.ceil((extent.XMax + pad - info["left"])/cs)), info["nCols"])
+   r0 = max(int(math.floor((info["top"] - extent.YMax - pad)/cs)), 0)
+   r1 = min(int(math.ceil((info["top"] - extent.YMin + pad)/cs)), info["nRows"])
+   return (info["left"] + c0*cs, info["top"] - r0*cs, max(r1 - r0, 0), max(c1 - c0, 0))
+
+def readWindow(in_Raster, info, window, nodata = 0):
+   '''Reads a window of a raster into a 2D array, with NoData set to the specified value. If the input is a TiledRaster, the window comes from its tile cache (and NoData is set as specified when it was opened); otherwise, this requires arcpy.'''
+   if isinstance(in_Raster, TiledRaster):
+      return in_Raster.read(window)
+   (left, top, nRows, nCols) = window
+   lowerLeft = arcpy.Point(left, top - nRows*info["cellSize"])
+   return arcpy.RasterToNumPyArray(in_Raster, lowerLeft, nCols, nRows, nodata)
+
+def FlowBufferGeom(geom, in_FlowDir, info, maxFlowDist, maxDist = None, smooth = 0):
+   '''Delineates the catchment buffer around a polygon, based on flow distance down to the polygon. Returns a polygon geometry, or None if the polygon is outside the flow direction raster. Requires arcpy, but not Spatial Analyst.
+   Parameters:
+   - geom = polygon geometry, in the coordinate system of the raster
+   - in_FlowDir = D8 flow direction raster, or a TiledRaster of it
+   - info = raster grid properties from rasterInfo
+   - maxFlowDist = maximum flow distance, in map units
+   - maxDist = if set, the buffer is also truncated at this straight-line distance from the polygon
+   - smooth = number of boundary smoothing iterations (see smoothMask)
+   '''
+   # A flow path no longer than maxFlowDist cannot leave a window padded by that distance
+   cs = info["cellSize"]
+   window = rasterWindow(info, geom.extent, maxFlowDist + cs)
+   (left, top, nRows, nCols) = window
+   if nRows == 0 or nCols == 0:
+      return None
+   fdir = readWindow(in_FlowDir, info, window)
+   sinks = rasterizeRings(geomRings(geom), left, top, cs, nRows, nCols)
+   dist = FlowDistance(fdir, sinks, cs, maxFlowDist)
+   mask = ~numpy.isnan(dist)
+   if maxDist is not None:
+      mask &= rasterizeRings(geomRings(geom.buffer(maxDist)), left, top, cs, nRows, nCols)
+   mask |= sinks
+   return maskToGeom(mask, info, window, sinks, smooth)
+
+def IndexedFlowBufferGeom(geom, index, maxFlowDist, maxDist = None, smooth = 0):
+   '''Delineates the catchment buffer around a polygon, as FlowBufferGeom, but from a precomputed FlowIndex, so no flow direction cells are read or traversed. Returns a polygon geometry, or None if the polygon is outside the raster. Requires arcpy, but not Spatial Analyst.
+   Parameters:
+   - geom = polygon geometry, in the coordinate system of the raster
+   - index = FlowIndex of the D8 flow direction raster
+   - maxFlowDist = maximum flow distance, in map units
+   - maxDist = if set, the buffer is also truncated at this straight-line distance from the polygon
+   - smooth = number of boundary smoothing iterations (see smoothMask)
+   '''
+   info = index.info
+   cs = info["cellSize"]
+   window = rasterWindow(info, geom.extent)
+   (left, top, nRows, nCols) = window
+   if nRows == 0 or nCols == 0:
+      return None
+   sinks = rasterizeRings(geomRings(geom), left, top, cs, nRows, nCols)
+   (up, dist) = index.upstream(index.cellsOf(window, sinks), maxFlowDist)
+   if len(up) == 0:
+      return None
+   
+   # Window covering the catchment and the polygon
+   rows = up // info["nCols"]
+   cols = up % info["nCols"]
+   r0 = int(round((info["top"] - top)/cs))
+   c0 = int(round((left - info["left"])/cs))
+   (ra, rb) = (min(rows.min(), r0), max(rows.max() + 1, r0 + nRows))
+   (ca, cb) = (min(cols.min(), c0), max(cols.max() + 1, c0 + nCols))
+   sub = (info["left"] + ca*cs, info["top"] - ra*cs, int(rb - ra), int(cb - ca))
+   mask = numpy.zeros((sub[2], sub[3]), dtype = bool)
+   mask[rows - ra, cols - ca] = True
+   if maxDist is not None:
+      mask &= rasterizeRings(geomRings(geom.buffer(maxDist)), sub[0], sub[1], cs, sub[2], sub[3])
+   src = numpy.zeros(mask.shape, dtype = bool)
+   src[r0 - ra:r0 - ra + nRows, c0 - ca:c0 - ca + nCols] = sinks
+   mask |= src
+   return maskToGeom(mask, info, sub, src, smooth)
+
+def MultiFlowBuffers(feats, in_FlowDir, info, maxFlowDist, maxDist = None, maxCells = 4000000, smooth = 0):
+   '''Delineates catchment buffers around many polygons at once, labelling each cell with the first polygon it drains into (see FlowLabels). Polygons are processed in tiles of roughly maxCells cells; each tile window is padded by maxFlowDist, and all polygons within the window act as sinks, so results do not depend on the tiling. Requires arcpy, but not Spatial Analyst.
+   
+   Unlike FlowBufferGeom run on each polygon separately, a cell draining through one polygon into another belongs only to the first. Returns a tuple (geomDict, overlaps, drains): a dictionary of {ID: buffer geometry}, a list of IDs of polygons sharing cells with other polygons, and a list of ID pairs (a, b) where polygon a drains into polygon b within maxFlowDist, so that b's buffer lacks the area upstream of a.
+   Parameters:
+   - feats = list of (ID, polygon geometry) tuples, in the coordinate system of the raster
+   - in_FlowDir = D8 flow direction raster, or a TiledRaster of it
+   - info = raster grid properties from rasterInfo
+   - maxFlowDist = maximum flow distance, in map units
+   - maxDist = if set, buffers are also truncated at this straight-line distance from their polygon
+   - maxCells = approximate maximum number of cells to process at once
+   - smooth = number of boundary smoothing iterations (see smoothMask)
+   '''
+   cs = info["cellSize"]
+   pad = maxFlowDist + cs
+   ids = [f[0] for f in feats]
+   geoms = [f[1] for f in feats]
+   ringsList = [geomRings(g) for g in geoms]
+   ext = numpy.array([(g.extent.XMin, g.extent.YMin, g.extent.XMax, g.extent.YMax) for g in geoms]).reshape(-1, 4)
+   
+   # Assign polygons to tiles by the centers of their extents
+   tileSize = max(math.sqrt(maxCells)*cs - 2*pad, 100*cs)
+   tx = numpy.floor((ext[:,0] + ext[:,2])/2/tileSize).astype(numpy.int64)
+   ty = numpy.floor((ext[:,1] + ext[:,3])/2/tileSize).astype(numpy.int64)
+   tiles = dict()
+   for (i, key) in enumerate(zip(tx, ty)):
+      tiles.setdefault(key, []).append(i)
+   printMsg('Processing %s features in %s tiles...' % (len(feats), len(tiles)))
+   
+   geomDict = dict()
+   overlaps = set()
+   drains = set()
+   for (t, members) in enumerate(sorted(tiles.values())):
+      members = numpy.array(members)
+      tileExt = arcpy.Extent(ext[members,0].min(), ext[members,1].min(), ext[members,2].max(), ext[members,3].max())
+      window = rasterWindow(info, tileExt, pad)
+      (left, top, nRows, nCols) = window
+      if nRows == 0 or nCols == 0:
+         continue
+      printMsg('Tile %s: %s features, %s x %s cells' % (t + 1, len(members), nRows, nCols))
+      fdir = readWindow(in_FlowDir, info, window)
+      
+      # Burn in all polygons in the window as labelled sinks
+      wx0 = left
+      wx1 = left + nCols*cs
+      wy0 = top - nRows*cs
+      wy1 = top
+      inWin = numpy.flatnonzero((ext[:,0] < wx1) & (ext[:,2] > wx0) & (ext[:,1] < wy1) & (ext[:,3] > wy0))
+      labels = numpy.zeros((nRows, nCols), dtype = numpy.int32)
+      cover = numpy.zeros((nRows, nCols), dtype = numpy.int32)
+      own = dict()
+      for i in inWin:
+         clip = rasterizeClip(ringsList[i], left, top, cs, nRows, nCols)
+         if clip is None:
+            continue
+         (r0, c0, m) = clip
+         sub = (slice(r0, r0 + m.shape[0]), slice(c0, c0 + m.shape[1]))
+         labels[sub][m] = i + 1
+         cover[sub] += m
+         own[i] = clip
+      (lab, dist, pairs) = FlowLabels(fdir, labels, cs, maxFlowDist)
+      for (a, b) in pairs:
+         drains.add((ids[a - 1], ids[b - 1]))
+      
+      # Extract the buffer for each polygon in the tile
+      for i in members:
+         if i not in own:
+            continue
+         (r0, c0, m) = own[i]
+         if (cover[r0:r0 + m.shape[0], c0:c0 + m.shape[1]][m] > 1).any():
+            overlaps.add(ids[i])
+         sub = rasterWindow(info, geoms[i].extent, pad)
+         sr0 = int(round((top - sub[1])/cs))
+         sc0 = int(round((sub[0] - left)/cs))
+         sl = (slice(sr0, sr0 + sub[2]), slice(sc0, sc0 + sub[3]))
+         mask = (lab[sl] == i + 1)
+         if maxDist is not None:
+            clip = rasterizeClip(geomRings(geoms[i].buffer(maxDist)), sub[0], sub[1], cs, sub[2], sub[3])
+            clipMask = numpy.zeros(mask.shape, dtype = bool)
+            if clip is not None:
+               (br0, bc0, bm) = clip
+               clipMask[br0:br0 + bm.shape[0], bc0:bc0 + bm.shape[1]] = bm
+            mask &= clipMask
+         src = numpy.zeros(mask.shape, dtype = bool)
+         src[r0 - sr0:r0 - sr0 + m.shape[0], c0 - sc0:c0 - sc0 + m.shape[1]] = m
+         mask |= src
+         geomDict[ids[i]] = maskToGeom(mask, info, sub, src, smooth)
+   
+   return (geomDict, sorted(overlaps), sorted(drains))
+
+### Vectorizing ###
+def labelComponents(mask):
+   '''Labels the 4-connected components of a 2D boolean array (cells touching only at corners are separate, as in RasterToPolygon), using union-find over the runs of cells in each row. Returns a tuple (labels, n): a 2D integer array of component labels (0 outside the mask) and the number of components.'''
+   (nRows, nCols) = mask.shape
+   padded = numpy.zeros((nRows, nCols + 2), dtype = numpy.int8)
+   padded[:, 1:-1] = mask
+   d = numpy.diff(padded, axis = 1)
+   (sr, sc) = numpy.nonzero(d == 1)
+   (er, ec) = numpy.nonzero(d == -1)
+   # Runs, in row order: row, start column, end column (exclusive)
+   nRuns = len(sr)
+   parent = list(range(nRuns))
+   def find(k):
+      while parent[k] != k:
+         parent[k] = parent[parent[k]]
+         k = parent[k]
+      return k
+   rowStart = numpy.searchsorted(sr, numpy.arange(nRows + 1))
+   for r in range(1, nRows):
+      (a0, a1) = (rowStart[r - 1], rowStart[r])
+      (b0, b1) = (rowStart[r], rowStart[r + 1])
+      i = a0
+      j = b0
+      while i < a1 and j < b1:
+         if sc[i] < ec[j] and sc[j] < ec[i]:
+            (ri, rj) = (find(i), find(j))
+            if ri != rj:
+               parent[max(ri, rj)] = min(ri, rj)
+         if ec[i] < ec[j]:
+            i += 1
+         else:
+            j += 1
+   roots = numpy.array([find(k) for k in range(nRuns)], dtype = numpy.int64)
+   (uniq, runLabel) = numpy.unique(roots, return_inverse = True)
+   labels = numpy.zeros((nRows, nCols), dtype = numpy.int32)
+   for k in range(nRuns):
+      labels[sr[k], sc[k]:ec[k]] = runLabel[k] + 1
+   return (labels, len(uniq))
+
+def shiftOr(mask):
+   '''Returns the 8-neighborhood dilation of a 2D boolean array'''
+   out = mask.copy()
+   out[1:, :] |= mask[:-1, :]
+   out[:-1, :] |= mask[1:, :]
+   tmp = out.copy()
+   out[:, 1:] |= tmp[:, :-1]
+   out[:, :-1] |= tmp[:, 1:]
+   return out
+
+def smoothMask(mask, iterations = 1):
+   '''Smooths the boundary of a 2D boolean array by a morphological closing followed by an opening (3 x 3 neighborhood), expanding then shrinking and shrinking then expanding, as with BoundaryClean using "TWO_WAY"'''
+   # Pad with empty cells, so the edges of the array are not treated as inside
+   p = iterations + 1
+   mask = numpy.pad(mask, p, 'constant')
+   for k in range(iterations):
+      mask = ~shiftOr(~shiftOr(mask))
+   for k in range(iterations):
+      mask = shiftOr(~shiftOr(~mask))
+   return mask[p:-p, p:-p]
+
+def traceRings(mask):
+   '''Traces the boundaries of a 2D boolean array into rings of cell corner coordinates (row, column), with the cells of the mask on the right, so exterior rings and holes run in opposite directions. Where two cells touch only at a corner, the rings are kept apart, and a ring touching itself at a corner is split there, so all rings are simple. Only corners where the boundary turns are kept. Returns a list of N x 2 integer arrays, each closed (first corner repeated at the end).'''
+   (nRows, nCols) = mask.shape
+   m = numpy.zeros((nRows + 2, nCols + 2), dtype = bool)
+   m[1:-1, 1:-1] = mask
+   # Directed boundary edges: start corner (row, col) and direction (0 = east, 1 = south, 2 = west, 3 = north), in padded coordinates with rows increasing southward
+   edges = []
+   (r, c) = numpy.nonzero(m[1:, :] & ~m[:-1, :]) # inside below: east along the top of the cell
+   edges.append((r + 1, c, 0))
+   (r, c) = numpy.nonzero(~m[1:, :] & m[:-1, :]) # inside above: west along the bottom of the cell
+   edges.append((r + 1, c + 1, 2))
+   (r, c) = numpy.nonzero(m[:, :-1] & ~m[:, 1:]) # inside left: south along the right side of the cell
+   edges.append((r, c + 1, 1))
+   (r, c) = numpy.nonzero(~m[:, :-1] & m[:, 1:]) # inside right: north along the left side of the cell
+   edges.append((r + 1, c + 1, 3))
+   er = numpy.concatenate([e[0] for e in edges])
+   ec = numpy.concatenate([e[1] for e in edges])
+   ed = numpy.concatenate([numpy.zeros(len(e[0]), dtype = numpy.int64) + e[2] for e in edges])
+   dr = numpy.array([0, 1, 0, -1])
+   dc = numpy.array([1, 0, -1, 0])
+   
+   # Index outgoing edges by start corner and direction
+   W = nCols + 3
+   outEdge = dict(zip(((er*W + ec)*4 + ed).tolist(), range(len(er))))
+   endCorner = ((er + dr[ed])*W + (ec + dc[ed])).tolist()
+   ed = ed.tolist()
+   used = [False]*len(ed)
+   rings = []
+   for start in range(len(ed)):
+      if used[start]:
+         continue
+      corners = []
+      e = start
+      while not used[e]:
+         used[e] = True
+         d = ed[e]
+         corner = endCorner[e]
+         # Prefer a right turn, then straight, then a left turn, which keeps corner-touching cells apart
+         for nd in [(d + 1) % 4, d, (d + 3) % 4]:
+            nxt = outEdge.get(corner*4 + nd)
+            if nxt is not None:
+               break
+         if nd != d:
+            corners.append(corner)
+         e = nxt
+      
+      # Split the ring where it touches itself, so each part is a simple ring
+      stack = []
+      pos = dict()
+      for corner in corners + corners[:1]:
+         k = pos.get(corner)
+         if k is None:
+            pos[corner] = len(stack)
+            stack.append(corner)
+            continue
+         loop = stack[k:] + [corner]
+         for x in stack[k + 1:]:
+            del pos[x]
+         del stack[k + 1:]
+         rings.append(numpy.array([(x // W - 1, x % W - 1) for x in loop], dtype = numpy.int64))
+   return rings
+
+def ringWKT(ring):
+   '''Formats a closed ring (an N x 2 array of coordinates) as WKT'''
+   return "(" + ",".join(["%r %r" % (x, y) for (x, y) in ring.tolist()]) + ")"
+
+def pointInRing(xy, px, py):
+   '''Tests whether a point is inside a closed ring (an N x 2 array), by the even-odd rule'''
+   (x1, y1, x2, y2) = (xy[:-1,0], xy[:-1,1], xy[1:,0], xy[1:,1])
+   crosses = (y1 > py) != (y2 > py)
+   with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+      xi = x1 + (py - y1)*(x2 - x1)/(y2 - y1)
+   return bool(numpy.sum(crosses & (px < xi)) % 2)
+
+def maskToGeom(mask, info, window, sources = None, smooth = 0):
+   '''Converts a 2D boolean array on a raster window to a single (possibly multipart) polygon geometry, in memory. Returns None if the mask is empty. Requires arcpy, but not Spatial Analyst.
+   Parameters:
+   - mask = 2D boolean array
+   - info = raster grid properties from rasterInfo
+   - window = (left, top, nRows, nCols) of the mask on the raster grid
+   - sources = optional 2D boolean array of source cells (e.g. the SCU). If supplied, orphan fragments (components of the mask not touching a source cell) are dropped.
+   - smooth = number of smoothing iterations (see smoothMask); source cells are always retained
+   '''
+   if smooth:
+      mask = smoothMask(mask, smooth)
+      if sources is not None:
+         mask = mask | sources
+   if sources is not None:
+      (labels, n) = labelComponents(mask)
+      keep = numpy.zeros(n + 1, dtype = bool)
+      keep[labels[sources & mask]] = True
+      keep[0] = False
+      mask = keep[labels]
+   if not mask.any():
+      return None
+   (left, top, nRows, nCols) = window
+   cs = info["cellSize"]
+   rings = []
+   for ring in traceRings(mask):
+      xy = numpy.column_stack([left + ring[:,1]*cs, top - ring[:,0]*cs])
+      a = numpy.sum(xy[:-1,0]*xy[1:,1] - xy[1:,0]*xy[:-1,1])/2
+      rings.append((a, xy))
+   
+   # Exterior rings run opposite to holes; the largest ring is an exterior
+   sign = numpy.sign(max(rings, key = lambda t: abs(t[0]))[0])
+   exteriors = [xy for (a, xy) in rings if numpy.sign(a) == sign]
+   holes = [xy for (a, xy) in rings if numpy.sign(a) != sign]
+   
+   # Assign each hole to the smallest exterior containing it
+   polys = [[xy] for xy in sorted(exteriors, key = lambda xy: abs(numpy.sum(xy[:-1,0]*xy[1:,1] - xy[1:,0]*xy[:-1,1])))]
+   for h in holes:
+      # Test the center of the cell just inside the hole, off its first edge
+      (x0, y0) = h[0]
+      (x1, y1) = h[1]
+      ux = numpy.sign(x1 - x0)
+      uy = numpy.sign(y1 - y0)
+      px = x0 + ux*cs/2 - uy*cs/2*sign
+      py = y0 + uy*cs/2 + ux*cs/2*sign
+      for p in polys:
+         if pointInRing(p[0], px, py):
+            p.append(h)
+            break
+   wkt = "MULTIPOLYGON(" + ",".join(["(" + ",".join([ringWKT(xy) for xy in p]) + ")" for p in polys]) + ")"
+   return arcpy.FromWKT(wkt, info["sr"])
+
+### Zonal statistics ###
+zonalStatTypes = ["COUNT", "AREA", "MIN", "MAX", "RANGE", "MEAN", "STD", "SUM", "MEDIAN"]
+
+def polygonCells(geom, info):
+   '''Returns the cells of a raster grid covered by a polygon (those with centers inside it), as a tuple (r0, c0, rows, cols): the offset of the polygon's bounding box on the grid, and the row and column indices of the covered cells within it. Returns None if no cells are covered.
+   Parameters:
+   - geom = polygon geometry, or a list of N x 2 ring arrays
+   - info = raster grid properties from rasterInfo
+   '''
+   if isinstance(geom, list):
+      rings = geom
+   else:
+      rings = geomRings(geom)
+   clip = rasterizeClip(rings, info["left"], info["top"], info["cellSize"], info["nRows"], info["nCols"])
+   if clip is None:
+      return None
+   (r0, c0, mask) = clip
+   (rows, cols) = numpy.nonzero(mask)
+   if len(rows) == 0:
+      return None
+   return (r0, c0, rows, cols)
+
+def cellStats(vals, stats, cellArea = 1.0):
+   '''Returns a dictionary of statistics for an array of cell values, ignoring NaN. Statistics are as in ZonalStatisticsAsTable (see zonalStatTypes); STD is the population standard deviation. Statistics of an empty array are None, except COUNT and AREA, which are 0.'''
+   vals = numpy.asarray(vals)
+   if vals.dtype.kind == 'f':
+      vals = vals[~numpy.isnan(vals)]
+   out = dict()
+   n = len(vals)
+   for s in stats:
+      if s == "COUNT":
+         out[s] = n
+      elif s == "AREA":
+         out[s] = n*cellArea
+      elif n == 0:
+         out[s] = None
+      elif s == "MIN":
+         out[s] = float(vals.min())
+      elif s == "MAX":
+         out[s] = float(vals.max())
+      elif s == "RANGE":
+         out[s] = float(vals.max()) - float(vals.min())
+      elif s == "MEAN":
+         out[s] = float(vals.mean(dtype = numpy.float64))
+      elif s == "STD":
+         out[s] = float(vals.std(dtype = numpy.float64))
+      elif s == "SUM":
+         out[s] = float(vals.sum(dtype = numpy.float64))
+      elif s == "MEDIAN":
+         out[s] = float(numpy.median(vals))
+   return out
+
+def ZonalStats(feats, rasters, stats = ["MIN", "MAX", "MEAN", "MEDIAN", "SUM", "STD"]):
+   '''Computes zonal statistics for polygons over any number of rasters in one pass. Each polygon's cell coverage is determined once per raster grid, as sparse cell indices, so overlapping polygons are handled exactly, without processing them one at a time. Returns a columnar table: a dictionary with the key "ID" for the list of polygon IDs, and keys "<name>_<STAT>" for lists of statistics (None where a polygon covers no cells with data).
+   Parameters:
+   - feats = list of (ID, polygon geometry) tuples
+   - rasters = list of (name, TiledRaster) tuples. Rasters should be opened with nodata set to NaN, so NoData cells are ignored.
+   - stats = list of statistics (see zonalStatTypes), or "ALL"
+   '''
+   if stats == "ALL":
+      stats = zonalStatTypes
+   stats = [s.upper() for s in stats]
+   table = {"ID": [f[0] for f in feats]}
+   for (name, ras) in rasters:
+      for s in stats:
+         table["%s_%s" % (name, s)] = []
+   
+   # Group rasters sharing a grid, so coverage is computed once per grid
+   grids = OrderedDict()
+   for (name, ras) in rasters:
+      info = rasterInfo(ras)
+      key = (info["left"], info["top"], info["cellSize"], info["nRows"], info["nCols"])
+      grids.setdefault(key, []).append((name, ras))
+   
+   for (fid, geom) in feats:
+      for gridRasters in grids.values():
+         info = rasterInfo(gridRasters[0][1])
+         g = geom
+         if arcpy is not None and hasattr(info["sr"], "name") and g.spatialReference.name != info["sr"].name:
+            g = g.projectAs(info["sr"])
+         cells = polygonCells(g, info)
+         for (name, ras) in gridRasters:
+            if cells is None:
+               vals = numpy.zeros(0)
+            else:
+               (r0, c0, rows, cols) = cells
+               window = (info["left"] + c0*info["cellSize"], info["top"] - r0*info["cellSize"], int(rows.max()) + 1, int(cols.max()) + 1)
+               vals = readWindow(ras, info, window)[rows, cols]
+            result = cellStats(vals, stats, info["cellSize"]**2)
+            for s in stats:
+               table["%s_%s" % (name, s)].append(result[s])
+   return table
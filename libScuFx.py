@@ -2,7 +2,7 @@
 # libScuFx.py
 # Version:  ArcGIS 10.3.1 / Python 2.7.8
 # Creation Date: 2017-08-29
-# Last Edit: 2018-11-05
+# Last Edit: 2026-10-19
 # Creator(s):  Kirsten R. Hazler
 
 # Summary:
@@ -24,7 +24,8 @@ from arcpy.sa import *
 arcpy.CheckOutExtension("Spatial")
 import libConSiteFx
 from libConSiteFx import *
-import os, sys, datetime, traceback, gc
+import libRasterFx
+import os, sys, datetime, traceback, gc, numpy
 
 ###DELETE THIS FUNCTION AFTER SUCCESSFULLY MOVED TO CreateSCU.py
 def delinFlowDistBuff(in_Feats, fld_ID, in_FlowDir, out_Feats, maxDist, dilDist = 0, out_Scratch = 'in_memory'):
@@ -249,94 +250,90 @@ def getZonalStats(in_Polys, in_Raster, fld_ID, fld_Stats, type_Stats, out_Polys,
          geoTrans = transList[0]
       arcpy.Project_management (in_Polys, out_Polys, srRast, geoTrans)
       
-   # Set up some variables used in loop below
-   tmpFeat = out_Scratch + os.sep + 'tmpFeat' # temp feature class 
-   tmpTab = out_Scratch + os.sep + 'tmpTab' # temp table 
-   mstrTab = out_Scratch + os.sep + 'mstrTab' # master table
-   for t in [tmpTab, mstrTab]:
-      if arcpy.Exists(t):
-         arcpy.Delete_management(t)
-   myFailList = [] # empty list to keep track of failures
-   
    # Count features and report
    numFeats = countFeatures(out_Polys)
    printMsg('There are %s features to process.' % numFeats)
    
-   # Set up processing cursor and loop through polygons to get zonal stats. 
-   # This is done in a loop instead of all at once to avoid problems if polys overlap.
-   cursor = arcpy.da.SearchCursor(out_Polys, '%s' % fld_ID)
-   counter = 1
-   for row in cursor:
-      try:
-         myID = row[0]
-         printMsg('Working on zonal stats for feature %s with ID %s' % (counter, str(myID)))
-         
-         # Make temporary feature class
-         selQry = "%s = %s" % (fld_ID, str(myID))
-         arcpy.Select_analysis (out_Polys, tmpFeat, selQry)
-         
-         # Run zonal stats and append to master table
-         outTab = ZonalStatisticsAsTable (tmpFeat, fld_ID, in_Raster, tmpTab, 'DATA', 'ALL')
-         if arcpy.Exists(mstrTab):
-            arcpy.Append_management(tmpTab, mstrTab, 'NO_TEST')
-         else:
-            arcpy.Copy_management(tmpTab, mstrTab)
-         
-         # Updates
-         del row, outTab
-         counter += 1
-                  
-         # Reset extent, because Arc is stupid.
-         arcpy.env.extent = "MAXOF"
-         
-      except:
-      # Add failure message and append failed feature ID to list
-         printMsg("\nFailed to fully process feature " + str(myID))
-         myFailList.append(myID)
-
-         # Error handling code swiped from "A Python Primer for ArcGIS"
-         tb = sys.exc_info()[2]
-         tbinfo = traceback.format_tb(tb)[0]
-         pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n " + str(sys.exc_info()[1])
-         msgs = "ARCPY ERRORS:\n" + arcpy.GetMessages(2) + "\n"
-
-         printWrng(msgs)
-         printWrng(pymsg)
-         printMsg(arcpy.GetMessages(1))
-
-         # Add status message
-         printMsg("\nMoving on to the next feature.  Note that the output will be incomplete.")
-   del cursor
+   # Get zonal stats for all polygons in one pass. 
+   # Cell coverage is determined separately for each polygon, so overlapping polys are not a problem.
+   printMsg('Calculating zonal stats...')
+   with arcpy.da.SearchCursor(out_Polys, ["OID@", "SHAPE@"]) as cursor:
+      feats = [(row[0], row[1]) for row in cursor]
+   statList = [t.upper() for t in type_Stats if t.upper() in libRasterFx.zonalStatTypes]
+   for t in type_Stats:
+      if t.upper() not in statList:
+         printWrng('Unable to add %s' %t)
+   rasTiles = libRasterFx.TiledRaster(in_Raster, nodata = float('nan'))
+   table = libRasterFx.ZonalStats(feats, [(fld_Stats, rasTiles)], statList)
+   rasTiles.report()
    
-   # For each stats type, manipulate the fields
+   # For each stats type, add a field
    printMsg('Appending stats fields to output features')
    polyFldNames = [field.name for field in arcpy.ListFields(out_Polys)]
-   printMsg(polyFldNames)
-   for t in type_Stats:
+   fldNames = []
+   for t in statList:
       fldName = fld_Stats + '_' + t
       if fldName in polyFldNames:
          arcpy.DeleteField_management(out_Polys, fldName)
-      arcpy.AddField_management (mstrTab, fldName, 'FLOAT')
-      expression = '!%s!' % t
-      try:
-         arcpy.CalculateField_management(mstrTab, fldName, expression, 'PYTHON')
-         arcpy.JoinField_management(out_Polys, fld_ID, mstrTab, fld_ID, fldName)
-         # I put this in a try block b/c certain stats, such as MEDIAN, are apparently only available for integer rasters.
-      except:
-         printWrng('Unable to add %s' %t)
-
-         # Error handling code swiped from "A Python Primer for ArcGIS"
-         tb = sys.exc_info()[2]
-         tbinfo = traceback.format_tb(tb)[0]
-         pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n " + str(sys.exc_info()[1])
-         msgs = "ARCPY ERRORS:\n" + arcpy.GetMessages(2) + "\n"
-
-         printWrng(msgs)
-         printWrng(pymsg)
-         printMsg(arcpy.GetMessages(1))
-
+      arcpy.AddField_management (out_Polys, fldName, 'FLOAT')
+      fldNames.append(fldName)
+   
+   # Write the stats in one pass
+   statDict = dict()
+   for (k, fid) in enumerate(table["ID"]):
+      statDict[fid] = [table[f][k] for f in fldNames]
+   with arcpy.da.UpdateCursor(out_Polys, ["OID@"] + fldNames) as cursor:
+      for row in cursor:
+         cursor.updateRow([row[0]] + statDict[row[0]])
+   
    return out_Polys
    
+### Scoring functions ###
+# These operate on whole arrays (or single values), so that every SCU can be rescored under different parameter sets without touching the data. Nulls should be passed as NaN; they yield NaN scores.
+brankOffsets = {'B1': 5, 'B2': 0, 'B3': -5, 'B4': -10, 'B5': -15}
+
+def forwetScore(forwet, fMin = 0.15, fMax = 0.85):
+   '''Scores forest/wetland cover, from 0 at or below fMin to 100 at or above fMax, linearly in between'''
+   forwet = numpy.asarray(forwet, dtype = numpy.float64)
+   return numpy.clip(100*(forwet - fMin)/(fMax - fMin), 0, 100)
+
+def impsurScore(impsur, iMin = 0.05, iMax = 0.25):
+   '''Scores impervious surface cover, from 100 at or below iMin to 0 at or above iMax, linearly in between'''
+   impsur = numpy.asarray(impsur, dtype = numpy.float64)
+   return numpy.clip(100*(iMax - impsur)/(iMax - iMin), 0, 100)
+
+def landscapeScore(forwet, impsur, fMin = 0.15, fMax = 0.85, iMin = 0.05, iMax = 0.25):
+   '''Returns a tuple of forest/wetland, impervious surface and landscape scores, the last being the average of the first two'''
+   fScore = forwetScore(forwet, fMin, fMax)
+   iScore = impsurScore(impsur, iMin, iMax)
+   return (fScore, iScore, (fScore + iScore)/2)
+
+def vulnPenalty(vuln, vLo = 20, vHi = 80):
+   '''Returns the vulnerability penalty: 20 at or below vLo, 0 at or above vHi, and -vuln/3 + 26.67 in between'''
+   vuln = numpy.asarray(vuln, dtype = numpy.float64)
+   return numpy.where(vuln >= vHi, 0, numpy.where(vuln <= vLo, 20, -vuln/3 + 26.67))
+
+def conScore(brank, integ, cprior_mean, cprior_max, vuln, lo_Integrity, offsets = brankOffsets):
+   '''Scores SCUs for conservation priority. The score is 0 where watershed integrity is below lo_Integrity; otherwise it is the average of integrity and conservation priority (itself the average of the priority mean and maximum), plus the BRANK offset, minus the vulnerability penalty, clamped to 0-100.
+   Parameters:
+   - brank = BRANK values (e.g. 'B1'); values without an offset yield NaN
+   - integ = mean watershed integrity
+   - cprior_mean = mean conservation priority
+   - cprior_max = maximum conservation priority
+   - vuln = mean development vulnerability
+   - lo_Integrity = minimum watershed integrity
+   - offsets = dictionary of score offsets by BRANK
+   '''
+   b = numpy.array([offsets.get(r, numpy.nan) for r in numpy.atleast_1d(brank)], dtype = numpy.float64)
+   integ = numpy.asarray(integ, dtype = numpy.float64)
+   i = numpy.where(integ >= float(lo_Integrity), 1, 0)
+   cprior = (numpy.asarray(cprior_mean, dtype = numpy.float64) + numpy.asarray(cprior_max, dtype = numpy.float64))/2
+   rawScore = i*((integ + cprior)/2 + b - vulnPenalty(vuln))
+   score = numpy.clip(rawScore, 0, 100)
+   if numpy.ndim(brank) == 0:
+      return score[0]
+   return score
+
 def getLandscapeScore(in_Feats, fld_ForWet, fld_ImpSur):
    '''Scores features based on forest/wetland and impervious surface cover'''
    
@@ -346,41 +343,12 @@ def getLandscapeScore(in_Feats, fld_ForWet, fld_ImpSur):
    for f in ['ForWet_score', 'ImpSur_score', 'Landscape_score']:
       if f not in fldNames:
          arcpy.AddField_management (in_Feats, f, 'FLOAT')
-      
-   # Get forest/wetland score
-   printMsg('Calculating forest/wetland score')
-   codeblock = '''def forwetScore(forwet):
-      fMax = 0.85
-      fMin = 0.15
-      if forwet <= fMin:
-         score = 0
-      elif forwet >= fMax:
-         score = 100
-      else:
-         score = 100*(forwet - fMin)/(fMax - fMin)
-      return score'''
-   expression = 'forwetScore(!%s!)' % fld_ForWet
-   arcpy.CalculateField_management(in_Feats, 'ForWet_score', expression, "PYTHON", codeblock)
-         
-   # Get impervious surface score
-   printMsg('Calculating impervious surface score')
-   codeblock = '''def impsurScore(impsur):
-      iMax = 0.25
-      iMin = 0.05
-      if impsur <= iMin:
-         score = 100
-      elif impsur >= iMax:
-         score = 0
-      else:
-         score = 100*(iMax - impsur)/(iMax - iMin)
-      return score''' 
-   expression = 'impsurScore(!%s!)' % fld_ImpSur
-   arcpy.CalculateField_management(in_Feats, 'ImpSur_score', expression, "PYTHON", codeblock)
-     
-   # Get landscape score
-   printMsg('Calculating landscape score')
-   expression = r'(!ForWet_score! + !ImpSur_score!)/2' 
-   arcpy.CalculateField_management(in_Feats, 'Landscape_score', expression, "PYTHON")
+   
+   # Get forest/wetland, impervious surface, and landscape scores
+   printMsg('Calculating forest/wetland, impervious surface, and landscape scores')
+   cols = readColumns(in_Feats, [fld_ForWet, fld_ImpSur])
+   (fScore, iScore, lScore) = landscapeScore(cols[fld_ForWet], cols[fld_ImpSur])
+   writeColumns(in_Feats, cols["OID@"], {'ForWet_score': fScore, 'ImpSur_score': iScore, 'Landscape_score': lScore})
    
    return in_Feats
 
@@ -398,110 +366,45 @@ def prioritizeSCUs(in_Feats, fld_ID, fld_BRANK, lo_BRANK, in_Integrity, lo_Integ
    selQry = "%s <= '%s'" % (fld_BRANK, lo_BRANK)
    arcpy.Select_analysis (in_Feats, out_Feats, selQry)
    
-   # Step 2: For each buffered SCU in subset, get zonal stats for Watershed Integrity, Conservation Priority and Vulnerability. Do this in loop in case of buffer overlap.
+   # Step 2: For each buffered SCU in subset, get zonal stats for Watershed Integrity, Conservation Priority and Vulnerability. Overlapping buffers are handled by the zonal engine.
    
    # Add fields to hold the stats
    for f in ['INTEG', 'CPRIOR_MEAN', 'CPRIOR_MAX', 'VULN', 'SCORE']:
       arcpy.AddField_management (out_Feats, f, 'FLOAT')
       
-   # Set up some variables used in loop
-   tmpFeat = out_Scratch + os.sep + 'tmpFeat' # temp feature class 
-   tmpTab = out_Scratch + os.sep + 'tmpTab' # temp table 
-   if arcpy.Exists(tmpTab):
-      arcpy.Delete_management(tmpTab)
-   myFailList = [] # empty list to keep track of failures
-   
    # Count features and report
    numFeats = countFeatures(out_Feats)
    printMsg('There are %s features to process.' % numFeats)
    
-   # Set up processing cursor and loop
-   fields = [fld_ID, 'INTEG', 'CPRIOR_MEAN', 'CPRIOR_MAX', 'VULN']
-   cursor = arcpy.da.UpdateCursor(out_Feats, fields)
-   counter = 1
-   for row in cursor:
-      try:
-         myID = row[0]
-         
-         printMsg('Working on zonal stats for feature %s with ID %s' % (counter, str(myID)))
-         
-         # Make temporary feature class
-         selQry = "%s = %s" % (fld_ID, str(myID))
-         arcpy.Select_analysis (out_Feats, tmpFeat, selQry)
-         
-         # Run zonal stats, extract values, and update fields
-         outTab = ZonalStatisticsAsTable (tmpFeat, fld_ID, in_Integrity, tmpTab, 'DATA', 'MEAN')
-         val = arcpy.SearchCursor(tmpTab).next().MEAN
-         printMsg('The watershed integrity mean is %s' % str(val))
-         row[1] = val
-         
-         outTab = ZonalStatisticsAsTable (tmpFeat, fld_ID, in_ConsPriority, tmpTab, 'DATA', 'ALL')
-         val = arcpy.SearchCursor(tmpTab).next().MEAN
-         printMsg('The conservation priority mean is %s' % str(val))
-         row[2] = val
-         val = arcpy.SearchCursor(tmpTab).next().MAX
-         printMsg('The conservation priority maximum is %s' % str(val))
-         row[3] = val
-         
-         outTab = ZonalStatisticsAsTable (tmpFeat, fld_ID, in_Vulnerability, tmpTab, 'DATA', 'MEAN')
-         val = arcpy.SearchCursor(tmpTab).next().MEAN
-         printMsg('The development vulnerability mean is %s' % str(val))
-         row[4] = val
-         
-         # Updates
-         cursor.updateRow(row)
-         del row, val, outTab
-         counter += 1
-                  
-         # Reset extent, because Arc is stupid.
-         arcpy.env.extent = "MAXOF"
-         
-      except:
-      # Add failure message and append failed feature ID to list
-         printMsg("\nFailed to fully process feature " + str(myID))
-         myFailList.append(myID)
-
-         # Error handling code swiped from "A Python Primer for ArcGIS"
-         tb = sys.exc_info()[2]
-         tbinfo = traceback.format_tb(tb)[0]
-         pymsg = "PYTHON ERRORS:\nTraceback Info:\n" + tbinfo + "\nError Info:\n " + str(sys.exc_info()[1])
-         msgs = "ARCPY ERRORS:\n" + arcpy.GetMessages(2) + "\n"
-
-         printWrng(msgs)
-         printWrng(pymsg)
-         printMsg(arcpy.GetMessages(1))
-
-         # Add status message
-         printMsg("\nMoving on to the next feature.  Note that the output will be incomplete.")
-
+   # Get zonal stats from all three rasters in one pass over each feature's cells
+   printMsg('Calculating zonal stats...')
+   with arcpy.da.SearchCursor(out_Feats, ["OID@", "SHAPE@"]) as cursor:
+      feats = [(row[0], row[1]) for row in cursor]
+   rasters = [("INTEG", libRasterFx.TiledRaster(in_Integrity, nodata = float('nan'))), ("CPRIOR", libRasterFx.TiledRaster(in_ConsPriority, nodata = float('nan'))), ("VULN", libRasterFx.TiledRaster(in_Vulnerability, nodata = float('nan')))]
+   table = libRasterFx.ZonalStats(feats, rasters, ["MEAN", "MAX"])
+   for (name, ras) in rasters:
+      ras.report()
+   
+   # Update fields in one pass
+   statDict = dict()
+   for (k, fid) in enumerate(table["ID"]):
+      statDict[fid] = [table["INTEG_MEAN"][k], table["CPRIOR_MEAN"][k], table["CPRIOR_MAX"][k], table["VULN_MEAN"][k]]
+   myFailList = [] # empty list to keep track of features without data
+   with arcpy.da.UpdateCursor(out_Feats, ["OID@", fld_ID, 'INTEG', 'CPRIOR_MEAN', 'CPRIOR_MAX', 'VULN']) as cursor:
+      for row in cursor:
+         vals = statDict[row[0]]
+         if None in vals:
+            myFailList.append(row[1])
+         cursor.updateRow(row[:2] + vals)
+   
    # Step 3: Score catchments based on BRANK, Watershed Integrity, Conservation Priority, and Vulnerability
-   codeblock = '''def ConScore(brank, integ, cprior_mean, cprior_max, vuln):
-      bDict = {'B1': 5, 'B2': 0, 'B3': -5, 'B4': -10, 'B5': -15}
-      b = bDict[brank]
-      if integ >= %s:
-         i = 1
-      else:
-         i = 0
-      if vuln >= 80:
-         v = 0
-      elif vuln <= 20:
-         v = 20
-      else:
-         v = -vuln/3 + 26.67
-      cprior = (cprior_mean + cprior_max)/2
-      rawScore = i*((integ + cprior)/2 + b - v)
-      if rawScore > 100:
-         score = 100
-      elif rawScore < 0:
-         score = 0
-      else: 
-         score = rawScore
-      return score''' % lo_Integrity
-   expression = 'ConScore(!%s!, !INTEG!, !CPRIOR_MEAN!, !CPRIOR_MAX!, !VULN!)' % fld_BRANK
-   arcpy.CalculateField_management(out_Feats, 'SCORE', expression, "PYTHON", codeblock)
+   printMsg('Calculating scores')
+   cols = readColumns(out_Feats, [fld_BRANK, 'INTEG', 'CPRIOR_MEAN', 'CPRIOR_MAX', 'VULN'])
+   score = conScore(cols[fld_BRANK], cols['INTEG'], cols['CPRIOR_MEAN'], cols['CPRIOR_MAX'], cols['VULN'], lo_Integrity)
+   writeColumns(out_Feats, cols["OID@"], {'SCORE': score})
    
    if len(myFailList) > 0:
-      printWrng('These features failed to process: %s' % str(myFailList))
+      printWrng('These features have no data for one or more rasters: %s' % str(myFailList))
       
    return out_Feats
    